@@ -0,0 +1,108 @@
+"""
+Confronta l'invio seriale delle richieste del master con quello concorrente
+(vedi MasterNode.max_concurrent_requests), su un albero i cui rami sono
+catene di slave collegate da bus separati.
+
+Le richieste per rami diversi non interferiscono, e possono essere in corso
+insieme; il master invia però tutte le richieste e riceve tutte le risposte,
+per cui le risposte attese non devono sovrapporsi, e i nodi usano il livello
+MAC e gli ack a livello di collegamento. Per
+ogni numero massimo di transazioni concorrenti vengono riportate la
+concorrenza media e massima raggiunta, il throughput aggregato, la frazione
+di messaggi con risposta e la latenza media, sommate su più simulazioni.
+
+Uso: python -m benchmarks.concurrent_dispatch [--branches N] [--depth N]
+     [--messages N] [--concurrency N [N ...]] [--runs N]
+"""
+
+import argparse
+import logging
+import random
+
+from infrastructure import Bus
+from infrastructure import Network
+from infrastructure.mac import MacLayer, RandomBackoff
+from protocol import MasterNode
+from protocol import SlaveNode
+from protocol.metrics import TransactionMetrics
+
+
+def answer(slave, _, __):
+    return slave.static_address, 2
+
+
+def run(concurrency, branches, depth, messages, seed):
+
+    rng = random.Random(seed)
+    network = Network(mac_factory=lambda: MacLayer(RandomBackoff(rng=rng)))
+
+    master = MasterNode(network, ack_timeout=30,
+                        max_concurrent_requests=concurrency)
+    slaves = []
+
+    for _ in range(branches):
+        previous = master
+
+        for _ in range(depth):
+            slave = SlaveNode(network, len(slaves) + 1, answer,
+                              ack_timeout=30)
+            network.netgraph.add_star((Bus(network, 4), previous, slave))
+            slaves.append(slave)
+            previous = slave
+
+    master.init_from_netgraph(network.netgraph)
+    network.run_nodes_processes()
+
+    master.send_many(('Blip', 4, rng.choice(slaves).static_address)
+                     for _ in range(messages))
+    network.env.run()
+
+    return master.metrics
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--branches', type=int, default=4,
+                        help='chains of slaves linked to the master')
+    parser.add_argument('--depth', type=int, default=8,
+                        help='number of slaves in every chain')
+    parser.add_argument('--messages', type=int, default=100,
+                        help='messages sent by the master in every run')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[2, 4, 8],
+                        help='maximum numbers of concurrent requests')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='simulations with different seeds')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"dispatch":<14}{"mean conc":>10}{"max conc":>10}'
+          f'{"throughput":>12}{"speedup":>9}{"delivery":>10}'
+          f'{"latency":>9}')
+
+    serial_throughput = None
+
+    for concurrency in [None] + args.concurrency:
+        metrics = TransactionMetrics.merge(
+            run(concurrency, args.branches, args.depth, args.messages, seed)
+            for seed in range(args.runs)
+        )
+
+        if concurrency is None:
+            name = 'serial'
+            serial_throughput = metrics.throughput
+        else:
+            name = f'concurrent {concurrency}'
+
+        print(f'{name:<14}{metrics.mean_concurrency:>10.2f}'
+              f'{metrics.max_concurrency:>10}'
+              f'{metrics.throughput * 1000:>12.3f}'
+              f'{metrics.throughput / serial_throughput:>9.2f}'
+              f'{metrics.delivery_ratio:>10.1%}'
+              f'{metrics.mean_latency:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Confronta la latenza media delle transazioni sulle linee di slave con
+l'inoltro store-and-forward e con quello cut-through.
+
+Uso: python -m benchmarks.cut_through_latency [--lengths N [N ...]]
+"""
+
+import argparse
+import logging
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol import SlaveNode
+
+
+def answer(slave, _, __):
+    res = f'Blop_{slave.static_address}'
+    return res, len(res)
+
+
+def line_latency(length, cut_through):
+    """
+    Invia un messaggio a ogni slave di una linea e restituisce la latenza
+    media delle transazioni e quella verso l'ultimo slave.
+    """
+
+    network = Network(transmission_speed=0.5)
+
+    master = MasterNode(network)
+    nodes = [master]
+    nodes.extend(SlaveNode(network, i, on_message_received=answer,
+                           cut_through=cut_through)
+                 for i in range(1, length + 1))
+
+    network.netgraph.add_path(nodes)
+    master.init_from_netgraph(network.netgraph)
+    network.run_nodes_processes()
+
+    for addr in range(1, length + 1):
+        master.send_message('Blip', 4, addr)
+
+    network.env.run()
+
+    metrics = master.metrics
+    return metrics.mean_latency, metrics.latencies[-1]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--lengths', type=int, nargs='+', default=[5, 10, 20],
+                        help='numbers of slaves of the lines')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"slaves":>6}{"s&f mean":>11}{"c-t mean":>11}'
+          f'{"s&f last":>11}{"c-t last":>11}{"reduction":>11}')
+
+    for length in args.lengths:
+        sf_mean, sf_last = line_latency(length, False)
+        ct_mean, ct_last = line_latency(length, True)
+
+        print(f'{length:>6}{sf_mean:>11.1f}{ct_mean:>11.1f}'
+              f'{sf_last:>11.1f}{ct_last:>11.1f}'
+              f'{1 - ct_mean / sf_mean:>10.1%}')
+
+
+if __name__ == '__main__':
+    main()
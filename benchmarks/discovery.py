@@ -0,0 +1,130 @@
+"""
+Misura il tempo simulato e i frame trasmessi per scoprire e configurare
+reti di slave senza indirizzo, fino al limite degli indirizzi statici.
+
+Gli slave sono disposti a caso in un quadrato, e due nodi sono collegati se
+sono abbastanza vicini; il master è in un angolo. Al termine, il master
+invia un messaggio a ogni slave per verificare la configurazione.
+
+Uso: python -m benchmarks.discovery [--sizes N [N ...]] [--degree D]
+"""
+
+import argparse
+import logging
+import math
+import random
+import time
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol import SlaveNode
+from protocol.node_data_manager import NodeDataManager
+from protocol.packet import PHYSICAL_ADDRESS_BITS
+
+
+def answer(slave, _, __):
+    return slave.static_address, 1
+
+
+def make_network(slaves, degree, rng):
+
+    network = Network(transmission_speed=0.5)
+    nodes = [MasterNode(network)]
+
+    physical_addrs = rng.sample(range(1 << PHYSICAL_ADDRESS_BITS), slaves)
+    nodes.extend(SlaveNode(network, None, answer, physical_address=addr)
+                 for addr in physical_addrs)
+
+    # Every node is linked to the ones within the radius which gives it
+    # about `degree` neighbors, and to the nearest previous node, so that
+    # the network is connected.
+    positions = [(0.0, 0.0)]
+    positions.extend((rng.random(), rng.random()) for _ in range(slaves))
+    radius = math.sqrt(degree / (math.pi * slaves))
+
+    cells = {}
+
+    def cell_of(position):
+        return int(position[0] / radius), int(position[1] / radius)
+
+    for i, position in enumerate(positions):
+        cells.setdefault(cell_of(position), []).append(i)
+
+    netgraph = network.netgraph
+
+    for i, (x, y) in enumerate(positions):
+        cx, cy = cell_of((x, y))
+
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in cells.get((cx + dx, cy + dy), ()):
+                    if j < i and math.hypot(x - positions[j][0],
+                                            y - positions[j][1]) <= radius:
+                        netgraph.add_edge(nodes[i], nodes[j])
+
+        if i > 0 and not netgraph.neighbors(nodes[i]):
+            nearest = min(range(i), key=lambda j: math.hypot(
+                x - positions[j][0], y - positions[j][1]
+            ))
+            netgraph.add_edge(nodes[i], nodes[nearest])
+
+    return network, nodes
+
+
+def run(slaves, degree, seed):
+
+    rng = random.Random(seed)
+    network, nodes = make_network(slaves, degree, rng)
+    master = nodes[0]
+
+    start = time.process_time()
+
+    discovery = master.discover()
+    network.run_nodes_processes()
+    report = network.env.run(discovery)
+
+    elapsed = time.process_time() - start
+
+    frames = sum(node.transmitted_frames for node in nodes)
+    probes = sum(node.hello_probes for node in nodes)
+    collisions = sum(node.hello_collisions for node in nodes)
+
+    completions = [master.send_message('Blip', 4, addr)
+                   for addr in range(1, report.nodes + 1)]
+    network.env.run()
+
+    answered = sum(1 for completion in completions
+                   if completion.value.payload is not None)
+
+    return report, frames, probes, collisions, answered, elapsed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 500, NodeDataManager.MAX_ADDRESS],
+                        help='numbers of slaves')
+    parser.add_argument('--degree', type=float, default=8,
+                        help='mean number of neighbors of a node')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the topology')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"slaves":>7}{"found":>7}{"levels":>8}{"time":>11}{"frames":>10}'
+          f'{"probes":>8}{"collided":>10}{"answered":>10}{"cpu (s)":>9}')
+
+    for slaves in args.sizes:
+        report, frames, probes, collisions, answered, elapsed = run(
+            slaves, args.degree, args.seed
+        )
+
+        print(f'{slaves:>7}{report.nodes:>7}{report.levels:>8}'
+              f'{report.duration:>11}{frames:>10}{probes:>8}'
+              f'{collisions:>10}{answered:>10}{elapsed:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
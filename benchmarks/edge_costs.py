@@ -0,0 +1,167 @@
+"""
+Confronta le funzioni di costo degli archi del master su una griglia di
+slave con collegamenti di qualità diversa, misurando il goodput (i byte
+delle risposte ricevute per unità di tempo), la latenza e le
+ritrasmissioni.
+
+Uso: python -m benchmarks.edge_costs [--size N] [--messages N] [--seed N]
+"""
+
+import argparse
+import logging
+import random
+
+import networkx as nx
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol import SlaveNode
+from protocol.edge_costs import NoiseCost, HopCountCost, EtxCost
+from protocol.packet import PacketWithSource
+
+ANSWER = 'Blop' * 4
+NOISY_FRACTION = 1 / 3
+
+COSTS = [
+    ('noise', NoiseCost),
+    ('hop count', HopCountCost),
+    ('etx', lambda: EtxCost(packet_frames=16)),
+]
+
+
+class NoisyLinks:
+    """
+    Mixin per i nodi che ricevono con errori i frame trasmessi sui
+    collegamenti rumorosi. Ogni frame riceve un errore con la probabilità
+    del collegamento, e un secondo, che lo rende illeggibile, con la stessa
+    probabilità.
+    """
+
+    link_errors = {}
+    rng = random.Random()
+
+    def _check_packet(self, received):
+
+        if isinstance(received, PacketWithSource):
+            error = self.link_errors.get(
+                frozenset((received.source_static, self.static_address)), 0
+            )
+
+            errors = [1 + (self.rng.random() < error)
+                      if self.rng.random() < error else 0
+                      for _ in range(received.number_of_frames())]
+
+            if any(errors):
+                # The other nodes hear the packet through their own links.
+                original, received = received, received.copy()
+
+                # The tables of new logic addresses, as in the simulator,
+                # stay shared by every receiver of the packet.
+                if hasattr(original, 'new_logic_addresses'):
+                    received.new_logic_addresses = original.new_logic_addresses
+
+                for frame, frame_errors in enumerate(errors):
+                    if frame_errors:
+                        received.damage_frame(frame, frame_errors)
+
+        super()._check_packet(received)
+
+
+class NoisyMasterNode(NoisyLinks, MasterNode):
+    pass
+
+
+class NoisySlaveNode(NoisyLinks, SlaveNode):
+    pass
+
+
+def answer(_, __, ___):
+    return ANSWER, len(ANSWER)
+
+
+def run_cost(edge_cost, size, messages, seed):
+
+    rng = random.Random(seed)
+    network = Network(transmission_speed=0.5)
+
+    kwargs = dict(ack_timeout=20, max_retransmissions=5)
+
+    master = NoisyMasterNode(network, edge_cost=edge_cost, **kwargs)
+    nodes = [master]
+    nodes.extend(NoisySlaveNode(network, i, on_message_received=answer,
+                                **kwargs)
+                 for i in range(1, size * size))
+
+    # A grid, with the master in a corner: a third of the links are noisy.
+    grid = nx.grid_2d_graph(size, size)
+    position = {pos: nodes[i] for i, pos in enumerate(sorted(grid))}
+    link_errors = {}
+
+    for u, v in sorted(grid.edges()):
+        a, b = position[u], position[v]
+        network.netgraph.add_edge(a, b)
+
+        if rng.random() < NOISY_FRACTION:
+            link_errors[frozenset((a.static_address, b.static_address))] = (
+                rng.uniform(0.05, 0.2)
+            )
+
+    NoisyLinks.link_errors = link_errors
+    NoisyLinks.rng = random.Random(seed)
+
+    master.init_from_static_addr_graph(nx.relabel_nodes(
+        network.netgraph, lambda node: node.static_address
+    ))
+    network.run_nodes_processes()
+
+    for _ in range(messages):
+        master.send_message('Blip', 4, rng.randrange(1, size * size))
+
+    network.env.run()
+
+    retransmissions = sum(node.retransmissions for node in nodes)
+
+    # The expected number of frames transmitted to deliver a packet along
+    # the final paths, from the real error rates of the links.
+    true_etx = EtxCost(packet_frames=16)
+    path_frames = [
+        sum(true_etx(2000 * link_errors.get(
+            frozenset((u.static_address, v.static_address)), 0
+        )) for u, v in zip(path, path[1:]))
+        for path in master._shortest_paths.values() if len(path) > 1
+    ]
+
+    return (master.metrics, retransmissions,
+            sum(path_frames) / len(path_frames))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--size', type=int, default=6,
+                        help='side of the grid of nodes')
+    parser.add_argument('--messages', type=int, default=300,
+                        help='number of messages to send')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the links and of the traffic')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"cost":<11}{"goodput":>9}{"latency":>9}{"delivered":>11}'
+          f'{"retransmissions":>17}{"path frames":>13}')
+
+    for name, make_cost in COSTS:
+        metrics, retransmissions, path_frames = run_cost(
+            make_cost(), args.size, args.messages, args.seed
+        )
+
+        goodput = metrics.answers * len(ANSWER) / metrics.elapsed_time
+
+        print(f'{name:<11}{goodput * 1000:>9.2f}{metrics.mean_latency:>9.1f}'
+              f'{metrics.delivery_ratio:>11.1%}{retransmissions:>17}'
+              f'{path_frames:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Confronta la memoria e il tempo di CPU per richiesta del master in una rete
+piatta, limitata a NodeDataManager.MAX_ADDRESS slave, e in reti divise in
+segmenti da gateway (vedi protocol.gateway_node), fino a decine di migliaia
+di slave.
+
+La memoria è quella occupata dallo stato di routing creato
+dall'inizializzazione del master; il tempo di CPU è quello speso dal master
+per creare le richieste e gestire le risposte, senza quello dei gateway e
+degli slave. Il master invia messaggi a slave scelti a caso.
+
+Uso: python -m benchmarks.hierarchical_addressing [--sizes N [N ...]]
+     [--segment-size N] [--requests N]
+"""
+
+import argparse
+import gc
+import logging
+import math
+import random
+import time
+import tracemalloc
+
+from infrastructure import Network
+from protocol import GatewayNode
+from protocol import MasterNode
+from protocol import SlaveNode
+from protocol.master_node import SegmentAddress, MessageOutcome
+from protocol.node_data_manager import NodeDataManager
+
+
+class TimedMasterNode(MasterNode):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cpu_time = 0
+
+    def _make_request_packet(self, *args, **kwargs):
+
+        start = time.process_time()
+        packet = super()._make_request_packet(*args, **kwargs)
+        self.cpu_time += time.process_time() - start
+
+        return packet
+
+    def _handle_received(self, packet):
+
+        start = time.process_time()
+        super()._handle_received(packet)
+        self.cpu_time += time.process_time() - start
+
+
+def answer(slave, _, __):
+    return slave.static_address, 1
+
+
+def link_groups(netgraph, root, nodes, rng):
+
+    # Groups of 4 fully connected nodes, each linked to a random node of a
+    # previous group, or to the root.
+    linked = [root]
+
+    for first in range(0, len(nodes), 4):
+        group = nodes[first:first + 4]
+        netgraph.add_path(group)
+        netgraph.add_edge(group[0], group[-1])
+        netgraph.add_edge(group[0], rng.choice(linked))
+        linked.extend(group)
+
+
+def make_flat_network(slaves, rng):
+
+    network = Network()
+    master = TimedMasterNode(network)
+    nodes = [SlaveNode(network, addr, answer)
+             for addr in range(1, slaves + 1)]
+
+    link_groups(network.netgraph, master, nodes, rng)
+
+    destinations = [node.static_address for node in nodes]
+
+    return network, master, [], destinations
+
+
+def make_segmented_network(slaves, segment_size, rng):
+
+    network = Network()
+    master = TimedMasterNode(network)
+
+    gateways = [GatewayNode(network, addr, answer)
+                for addr in range(1, math.ceil(slaves / segment_size) + 1)]
+
+    link_groups(network.netgraph, master, gateways, rng)
+
+    destinations = []
+
+    for gateway in gateways:
+        size = min(segment_size, slaves - len(destinations))
+        nodes = [SlaveNode(network, addr, answer)
+                 for addr in range(1, size + 1)]
+
+        link_groups(network.netgraph, gateway.downlink, nodes, rng)
+
+        destinations.extend(SegmentAddress(gateway.static_address, addr)
+                            for addr in range(1, size + 1))
+
+    return network, master, gateways, destinations
+
+
+def run(segment_size, slaves, requests, seed):
+
+    rng = random.Random(seed)
+
+    network, master, gateways, destinations = (
+        make_flat_network(slaves, rng) if segment_size is None
+        else make_segmented_network(slaves, segment_size, rng)
+    )
+
+    for gateway in gateways:
+        gateway.init_segment_from_netgraph(network.netgraph)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    master.init_from_netgraph(network.netgraph)
+
+    for gateway in gateways:
+        master.add_segment(gateway.static_address, gateway.segment_depth)
+
+    # The temporary copies of the network graph have reference cycles.
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.process_time()
+
+    completions = master.send_many(
+        ('Blip', 4, dest) for dest in rng.choices(destinations, k=requests)
+    )
+    network.run_nodes_processes()
+    network.env.run()
+
+    elapsed = time.process_time() - start
+
+    answered = sum(1 for completion in completions
+                   if completion.value.outcome is MessageOutcome.answered)
+
+    return (len(master.node_graph), memory, master.cpu_time / requests,
+            answered, elapsed)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[NodeDataManager.MAX_ADDRESS, 10000, 20000],
+                        help='numbers of slaves')
+    parser.add_argument('--segment-size', type=int, default=200,
+                        help='number of slaves in every segment')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='number of messages sent by the master')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the topology and of the destinations')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"network":<11}{"slaves":>8}{"master nodes":>14}'
+          f'{"memory (kB)":>13}{"cpu/req (ms)":>14}{"answered":>10}'
+          f'{"total cpu (s)":>15}')
+
+    for slaves in args.sizes:
+        for name, segment_size in (('flat', None),
+                                   ('segmented', args.segment_size)):
+
+            if (segment_size is None and
+                    slaves > NodeDataManager.MAX_ADDRESS):
+                continue
+
+            master_nodes, memory, cpu_time, answered, elapsed = run(
+                segment_size, slaves, args.requests, args.seed
+            )
+
+            print(f'{name:<11}{slaves:>8}{master_nodes:>14}'
+                  f'{memory / 1024:>13.0f}{cpu_time * 1000:>14.2f}'
+                  f'{answered:>10}{elapsed:>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Confronta il tempo di CPU del master con il calcolo completo dei cammini
+minimi e con quello limitato alle destinazioni richieste, su una rete grande
+in cui il traffico riguarda pochi slave.
+
+Uso: python -m benchmarks.lazy_paths [--slaves N] [--active N] [--messages N]
+"""
+
+import argparse
+import logging
+import random
+import time
+from itertools import combinations
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol import SlaveNode
+
+
+def answer(slave, _, __):
+    res = f'Blop_{slave.static_address}'
+    return res, len(res)
+
+
+def run(lazy_paths, slaves, active, messages, seed):
+
+    rng = random.Random(seed)
+    network = Network(transmission_speed=0.5)
+
+    master = MasterNode(network, lazy_paths=lazy_paths)
+    nodes = [master]
+    nodes.extend(SlaveNode(network, i, on_message_received=answer)
+                 for i in range(1, slaves + 1))
+
+    # Groups of 4 fully connected slaves, each linked to a random previous
+    # group.
+    netgraph = network.netgraph
+    netgraph.add_edge(nodes[0], nodes[1])
+
+    for first in range(1, slaves + 1, 4):
+        group = nodes[first:first + 4]
+        netgraph.add_edges_from(combinations(group, 2))
+
+        if first > 1:
+            netgraph.add_edge(group[0], nodes[rng.randrange(1, first)])
+
+    master.init_from_netgraph(netgraph)
+    network.run_nodes_processes()
+
+    destinations = rng.sample(range(1, slaves + 1), active)
+
+    for _ in range(messages):
+        master.send_message('Blip', 4, rng.choice(destinations))
+
+    start = time.process_time()
+    network.env.run()
+    elapsed = time.process_time() - start
+
+    return elapsed, master.metrics.mean_latency
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--slaves', type=int, default=400,
+                        help='number of slaves')
+    parser.add_argument('--active', type=int, default=4,
+                        help='number of slaves messages are sent to')
+    parser.add_argument('--messages', type=int, default=100,
+                        help='number of messages to send')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the topology and of the traffic')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"paths":<8}{"cpu (s)":>9}{"latency":>10}')
+
+    for name, lazy_paths in (('full', False), ('lazy', True)):
+        elapsed, latency = run(lazy_paths, args.slaves, args.active,
+                               args.messages, args.seed)
+
+        print(f'{name:<8}{elapsed:>9.2f}{latency:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Misura il tempo impiegato dal master per applicare tabelle del rumore grandi
+al grafo dei nodi, con la media mobile predefinita e con gli stimatori
+vettoriali, con e senza soglia di cambiamento.
+
+Uso: python -m benchmarks.noise_estimation [--nodes N] [--entries N]
+"""
+
+import argparse
+import logging
+import random
+import time
+
+import networkx as nx
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol.noise_estimation import (
+    EwmaEstimator, WindowMeanEstimator, VarianceAwareEstimator
+)
+from protocol.packet import NoiseReport
+
+ESTIMATORS = [
+    ('default', lambda: None),
+    ('ewma', EwmaEstimator),
+    ('ewma, threshold 5', lambda: EwmaEstimator(threshold=5)),
+    ('window, threshold 5', lambda: WindowMeanEstimator(threshold=5)),
+    ('variance, threshold 5', lambda: VarianceAwareEstimator(threshold=5)),
+]
+
+
+def run_estimator(noise_estimator, nodes, entries, rounds, seed):
+
+    rng = random.Random(seed)
+
+    master = MasterNode(Network(), noise_estimator=noise_estimator)
+    master.init_from_static_addr_graph(nx.star_graph(nodes - 1))
+
+    node_data = master._node_manager
+    sources = rng.sample(range(1, nodes), 20)
+
+    # Every source hears the same nodes, with a steady noise on each link
+    # and small fluctuations between reports.
+    base = {source: NoiseReport({dest: rng.randrange(0, 1000)
+                                 for dest in rng.sample(range(nodes), entries)
+                                 if dest != source})
+            for source in sources}
+
+    for source in sources:
+        master._update_node_graph_from_table(node_data[source], base[source])
+
+    tables = [(source, NoiseReport({dest: noise + rng.randrange(-3, 4)
+                                    for dest, noise in base[source].items()}))
+              for _ in range(rounds) for source in sources]
+
+    start = time.perf_counter()
+
+    for source, table in tables:
+        master._update_node_graph_from_table(node_data[source], table)
+
+    return (time.perf_counter() - start) / len(tables)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--nodes', type=int, default=2000,
+                        help='number of nodes of the graph')
+    parser.add_argument('--entries', type=int, default=1000,
+                        help='entries of every noise table')
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='reports of every source')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the tables')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"estimator":<24}{"us per table":>14}{"us per entry":>14}')
+
+    for name, make_estimator in ESTIMATORS:
+        elapsed = run_estimator(make_estimator(), args.nodes, args.entries,
+                                args.rounds, args.seed)
+
+        print(f'{name:<24}{elapsed * 1e6:>14.0f}'
+              f'{elapsed * 1e6 / args.entries:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
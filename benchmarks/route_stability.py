@@ -0,0 +1,98 @@
+"""
+Confronta i cambiamenti dell'albero dei cammini minimi, gli scambi di
+indirizzi logici e i frame di indirizzi inviati dal master, con e senza una
+politica di stabilità, su gruppi di slave collegati con molti cammini di
+costo uguale.
+
+Uso: python -m benchmarks.route_stability [--messages N] [--seed N]
+"""
+
+import argparse
+import logging
+import random
+from itertools import combinations
+
+import networkx as nx
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol import SlaveNode
+from protocol.route_stability import RouteStability
+
+
+def answer(slave, _, __):
+    res = f'Blop_{slave.static_address}'
+    return res, len(res)
+
+
+POLICIES = [
+    ('none', lambda: None),
+    ('margin 0.1', lambda: RouteStability(margin=0.1)),
+    ('dwell 5000', lambda: RouteStability(min_dwell=5000)),
+    ('both', lambda: RouteStability(margin=0.1, min_dwell=5000)),
+]
+
+
+def run_policy(route_stability, messages, seed):
+
+    rng = random.Random(seed)
+    network = Network(transmission_speed=0.5)
+
+    master = MasterNode(network, route_stability=route_stability)
+    nodes = [master]
+    nodes.extend(SlaveNode(network, i, on_message_received=answer)
+                 for i in range(1, 30))
+
+    netgraph = network.netgraph
+    netgraph.add_path(nodes[:3])
+
+    for first in range(2, 30, 4):
+        netgraph.add_edges_from(combinations(nodes[first:first + 4], 2))
+
+    for first in range(3, 26, 4):
+        netgraph.add_edge(nodes[first], nodes[first + 5])
+
+    # The static addresses make the ties between paths of equal cost, and
+    # so the results, independent of the order of the nodes in memory.
+    master.init_from_static_addr_graph(nx.relabel_nodes(
+        netgraph, lambda node: node.static_address
+    ))
+    network.run_nodes_processes()
+
+    for _ in range(messages):
+        master.send_message('Blip', 4, rng.randrange(1, 30))
+
+    network.env.run()
+
+    return master.metrics
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--messages', type=int, default=300,
+                        help='number of messages to send')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the traffic generator')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"stability":<12}{"changes":>9}{"parents":>9}{"swaps":>7}'
+          f'{"addr frames":>13}{"avoided":>9}{"latency":>9}')
+
+    for name, make_policy in POLICIES:
+        route_stability = make_policy()
+        metrics = run_policy(route_stability, args.messages, args.seed)
+
+        avoided = (0 if route_stability is None
+                   else route_stability.avoided_changes)
+
+        print(f'{name:<12}{metrics.tree_changes:>9}'
+              f'{metrics.parent_changes:>9}{metrics.address_swaps:>7}'
+              f'{metrics.address_frames:>13}{avoided:>9}'
+              f'{metrics.mean_latency:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
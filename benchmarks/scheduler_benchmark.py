@@ -0,0 +1,137 @@
+"""
+Confronta il numero di eventi al secondo processati da simpy.Environment e
+da HeapEnvironment sugli scenari usati nei test.
+
+Uso: python -m benchmarks.scheduler_benchmark [--repeat N] [--rounds N]
+"""
+
+import argparse
+import logging
+import time
+from itertools import combinations
+
+from infrastructure import Bus
+from infrastructure import Network
+from nodes.nodes import SenderNode, ReceiverNode
+from protocol import MasterNode
+from protocol import SlaveNode
+
+
+def answer(slave, _, __):
+    res = f'Blop_{slave.static_address}'
+    return res, len(res)
+
+
+def bus_collisions(network, rounds):
+
+    messages = [(f'Message{i}', 8) for i in range(10 * rounds)]
+    senders = [SenderNode(network, messages) for _ in range(2)]
+    receivers = [ReceiverNode(network) for _ in range(5)]
+    bus = Bus(network, 4)
+
+    network.netgraph.add_star((bus, *senders, *receivers))
+    network.run_nodes_processes()
+
+
+def protocol_line(network, rounds):
+
+    master = MasterNode(network)
+    nodes = [master]
+    nodes.extend(SlaveNode(network, i, on_message_received=answer)
+                 for i in range(1, 21))
+
+    network.netgraph.add_path(nodes)
+    network.make_buses()
+    master.init_from_netgraph(network.netgraph)
+    network.run_nodes_processes()
+
+    for _ in range(rounds):
+        for addr in range(15, 21):
+            master.send_message('Blip', 4, addr)
+
+
+def protocol_tree(network, rounds):
+
+    master = MasterNode(network)
+    nodes = [master]
+    nodes.extend(SlaveNode(network, i, on_message_received=answer)
+                 for i in range(1, 18))
+
+    netgraph = network.netgraph
+    netgraph.add_path(nodes[:3])
+
+    for first, last in ((2, 6), (6, 10), (10, 14), (14, 18)):
+        netgraph.add_edges_from(combinations(nodes[first:last], 2))
+
+    netgraph.add_edges_from(((nodes[3], nodes[6]), (nodes[4], nodes[10]),
+                             (nodes[5], nodes[14]), (nodes[0], nodes[12])))
+
+    master.init_from_netgraph(netgraph)
+    network.run_nodes_processes()
+
+    for _ in range(rounds):
+        for addr in range(len(nodes) - 1, 0, -1):
+            master.send_message('Blip', 4, addr)
+
+
+SCENARIOS = [
+    ('bus collisions', bus_collisions, {}),
+    ('protocol line', protocol_line, {}),
+    ('protocol line (channel)', protocol_line, {'channel_delivery': True}),
+    ('protocol tree', protocol_tree, {}),
+]
+
+
+def run_scenario(setup, rounds, **network_kwargs):
+    """
+    Esegue uno scenario e restituisce il numero di eventi schedulati e il
+    tempo impiegato.
+    """
+
+    network = Network(transmission_speed=0.5, **network_kwargs)
+    setup(network, rounds)
+
+    start = time.perf_counter()
+    network.env.run()
+    elapsed = time.perf_counter() - start
+
+    # Both environments number the scheduled events with the same counter.
+    events = next(network.env._eid)
+
+    return events, elapsed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each scenario, the best one is kept')
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='repetitions of the traffic of each scenario')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"scenario":<26}{"events":>9}{"simpy ev/s":>13}'
+          f'{"heap ev/s":>13}{"speedup":>9}')
+
+    for name, setup, kwargs in SCENARIOS:
+
+        rates = []
+
+        for lightweight in (False, True):
+            results = [run_scenario(setup, args.rounds,
+                                    lightweight_scheduler=lightweight,
+                                    **kwargs)
+                       for _ in range(args.repeat)]
+            events = results[0][0]
+            rates.append(events / min(elapsed for _, elapsed in results))
+
+        simpy_rate, heap_rate = rates
+
+        print(f'{name:<26}{events:>9}{simpy_rate:>13.0f}{heap_rate:>13.0f}'
+              f'{heap_rate / simpy_rate:>8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Confronta le politiche di scheduling del master su un albero di slave, con
+messaggi che arrivano a raffiche verso destinazioni casuali.
+
+Uso: python -m benchmarks.scheduling_policies [--bursts N] [--seed N]
+"""
+
+import argparse
+import logging
+import random
+from itertools import combinations
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol import SlaveNode
+from protocol.scheduling import (
+    FifoPolicy, TreeOrderPolicy, PriorityAgingPolicy
+)
+
+
+def answer(slave, _, __):
+    res = f'Blop_{slave.static_address}'
+    return res, len(res)
+
+
+POLICIES = [
+    ('fifo', FifoPolicy),
+    ('tree order', lambda: TreeOrderPolicy(max_delay=20000)),
+    ('priority aging', lambda: PriorityAgingPolicy(aging_rate=0.001)),
+]
+
+
+def run_policy(make_policy, bursts, seed):
+
+    rng = random.Random(seed)
+    network = Network(transmission_speed=0.5)
+
+    master = MasterNode(network, scheduling_policy=make_policy())
+    nodes = [master]
+    nodes.extend(SlaveNode(network, i, on_message_received=answer)
+                 for i in range(1, 30))
+
+    netgraph = network.netgraph
+    netgraph.add_path(nodes[:3])
+
+    for first in range(2, 30, 4):
+        netgraph.add_edges_from(combinations(nodes[first:first + 4], 2))
+
+    for first in range(3, 26, 4):
+        netgraph.add_edge(nodes[first], nodes[first + 5])
+
+    master.init_from_netgraph(netgraph)
+    network.run_nodes_processes()
+
+    def traffic():
+        for _ in range(bursts):
+            for _ in range(8):
+                master.send_message('Blip', 4, rng.randrange(1, 30),
+                                    priority=rng.randrange(3))
+            yield network.env.timeout(rng.expovariate(1 / 10000))
+
+    network.env.process(traffic())
+    network.env.run()
+
+    return master.metrics
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--bursts', type=int, default=20,
+                        help='bursts of 8 messages to send')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the traffic generator')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"policy":<16}{"latency":>9}{"queueing":>10}'
+          f'{"throughput":>12}{"static":>8}')
+
+    for name, make_policy in POLICIES:
+        metrics = run_policy(make_policy, args.bursts, args.seed)
+
+        print(f'{name:<16}{metrics.mean_latency:>9.1f}'
+              f'{metrics.mean_queueing_time:>10.1f}'
+              f'{metrics.throughput * 1000:>12.3f}'
+              f'{metrics.static_addressing_ratio:>8.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Confronta il tempo di CPU del master per seguire i cambiamenti della
+topologia di una rete grande (slave che entrano ed escono, collegamenti che
+si guastano) con le modifiche incrementali e con la reinizializzazione
+completa a ogni cambiamento, e il numero di indirizzi logici cambiati, che
+il master deve poi comunicare agli slave.
+
+Uso: python -m benchmarks.topology_changes [--slaves N] [--changes N]
+"""
+
+import argparse
+import logging
+import random
+import time
+from itertools import combinations
+
+import networkx as nx
+
+from infrastructure import Network
+from protocol import MasterNode
+
+
+def make_graph(slaves, rng):
+
+    # Groups of 4 fully connected slaves, each linked to a random previous
+    # group.
+    graph = nx.Graph()
+    graph.add_edge(0, 1)
+
+    for first in range(1, slaves + 1, 4):
+        group = range(first, min(first + 4, slaves + 1))
+        graph.add_edges_from(combinations(group, 2))
+
+        if first > 1:
+            graph.add_edge(group[0], rng.randrange(1, first))
+
+    return graph
+
+
+def make_changes(graph, changes, rng):
+    """
+    Genera i cambiamenti, applicandoli a graph: ('join', indirizzo, vicini),
+    ('leave', indirizzo) o ('fail', indirizzo, indirizzo).
+    """
+
+    next_addr = max(graph) + 1
+    result = []
+
+    while len(result) < changes:
+        kind = rng.choice(('join', 'leave', 'fail'))
+
+        if kind == 'join':
+            neighbors = rng.sample(sorted(graph), 2)
+            graph.add_star([next_addr, *neighbors])
+            result.append((kind, next_addr, neighbors))
+            next_addr += 1
+            continue
+
+        node = rng.choice(sorted(graph)[1:])
+
+        if kind == 'leave':
+            rest = graph.copy()
+            rest.remove_node(node)
+
+            if nx.is_connected(rest):
+                graph.remove_node(node)
+                result.append((kind, node))
+
+        else:
+            neighbor = rng.choice(graph.neighbors(node))
+            graph.remove_edge(node, neighbor)
+
+            if nx.is_connected(graph):
+                result.append((kind, node, neighbor))
+            else:
+                graph.add_edge(node, neighbor)
+
+    return result
+
+
+def run(incremental, slaves, changes, seed):
+
+    rng = random.Random(seed)
+    graph = make_graph(slaves, rng)
+
+    master = MasterNode(Network())
+    master.init_from_static_addr_graph(graph)
+
+    changes = make_changes(graph.copy(), changes, rng)
+    current = graph.copy()
+    readdressed = 0
+    elapsed = 0
+
+    for change in changes:
+        addresses = logic_addresses(master)
+        start = time.process_time()
+
+        kind, addr, *rest = change
+
+        if kind == 'join':
+            current.add_star([addr, *rest[0]])
+        elif kind == 'leave':
+            current.remove_node(addr)
+        else:
+            current.remove_edge(addr, rest[0])
+
+        if not incremental:
+            master = MasterNode(Network())
+            master.init_from_static_addr_graph(current)
+        elif kind == 'join':
+            master.add_node(addr, rest[0])
+        elif kind == 'leave':
+            master.remove_node(addr)
+        else:
+            master.remove_edge(addr, rest[0])
+
+        elapsed += time.process_time() - start
+
+        readdressed += sum(
+            1 for static_addr, logic_addr in logic_addresses(master).items()
+            if addresses.get(static_addr, logic_addr) != logic_addr
+        )
+
+    return elapsed, readdressed
+
+
+def logic_addresses(master):
+    return {node.static_address: node.logic_address
+            for node in master.node_graph}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--slaves', type=int, default=1000,
+                        help='number of slaves')
+    parser.add_argument('--changes', type=int, default=100,
+                        help='number of topology changes')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the topology and of the changes')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f'{"updates":<14}{"cpu (s)":>9}{"readdressed":>13}')
+
+    for name, incremental in (('reinitialize', False),
+                              ('incremental', True)):
+        elapsed, readdressed = run(incremental, args.slaves, args.changes,
+                                   args.seed)
+
+        print(f'{name:<14}{elapsed:>9.2f}{readdressed:>13}')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ from typing import Optional
 
 import simpy
 
+from infrastructure.channel import Channel
 from infrastructure.message import TransmittedMessage, CollisionSentinel
 from utils.condition_var import BroadcastConditionVar
 from utils.simpy_process import simpy_process
@@ -38,11 +39,42 @@ class Bus:
         self._current_send_proc = None
         self._message_in_transmission: Optional[TransmittedMessage] = None
 
+        self._channel: Optional[Channel] = (
+            Channel(self.env, propagation_delay,
+                    lambda: self._netgraph.neighbors(self))
+            if network.channel_delivery else None
+        )
+
         netgraph.add_node(self)
 
     def __str__(self):
         return "<Bus>"
 
+    def deliver(self, message: TransmittedMessage):
+        """
+        Consegna al bus un messaggio trasmesso da un nodo connesso.
+
+        Se la rete usa la consegna tramite callback il messaggio viene
+        propagato dal canale del bus, altrimenti da send_process.
+
+        :param message: Il messaggio trasmesso.
+        """
+
+        if self._channel is not None:
+            self._channel.transmit(message)
+        else:
+            self.send_process(message)
+
+    def is_busy(self):
+        """
+        Indica se un messaggio è in propagazione nel bus.
+        """
+
+        if self._channel is not None:
+            return self._channel.is_busy()
+
+        return self._message_in_transmission is not None
+
     @simpy_process
     def send_process(self, message):
         """
@@ -101,4 +133,4 @@ class Bus:
 
         for node in self._netgraph.neighbors(self):
             if node is not message.sender:
-                node.send_process(message)
+                node.deliver(message)
@@ -0,0 +1,115 @@
+"""
+Contiene il canale condiviso usato dai bus quando la rete consegna i
+messaggi tramite callback anziché tramite processi SimPy.
+
+Un Channel tiene conto dell'intervallo di occupazione corrente del mezzo:
+ogni trasmissione che inizia mentre il canale è occupato produce una
+collisione, calcolata dalla sovrapposizione degli intervalli, e sposta la
+fine dell'occupazione. Alla fine dell'ultimo intervallo un solo callback
+consegna il messaggio a tutti i nodi collegati, raggruppando la fine delle
+ricezioni che terminano nello stesso istante in un unico evento.
+"""
+import collections
+import logging
+from functools import partial
+from typing import Callable, Iterable, Optional
+
+from infrastructure.message import TransmittedMessage, CollisionSentinel
+
+logger = logging.getLogger(__name__)
+
+
+class Channel:
+
+    def __init__(self, env, propagation_delay,
+                 endpoints: Callable[[], Iterable]):
+        """
+        :param env: L'environment di simulazione.
+        :param propagation_delay: Il ritardo di propagazione del canale.
+        :param endpoints: Funzione che restituisce i nodi collegati al canale.
+        """
+
+        self.env = env
+        self.propagation_delay = propagation_delay
+        self._endpoints = endpoints
+        self._message: Optional[TransmittedMessage] = None
+        self._generation = 0
+        self.busy_until = None
+
+    def __str__(self):
+        return '<Channel>'
+
+    def is_busy(self):
+        return self._message is not None
+
+    def transmit(self, message: TransmittedMessage):
+        """
+        Inizia la propagazione di un messaggio nel canale.
+
+        Se il canale è già occupato, il messaggio collide con quello in
+        propagazione, e la consegna viene posticipata alla fine del ritardo
+        di propagazione a partire dall'istante attuale.
+
+        :param message: Il messaggio da propagare.
+        """
+
+        env = self.env
+
+        if self._message is None:
+            self._message = message
+        else:
+            logger.warning(f"{self}: A collision has happened between "
+                           f"{message} and {self._message}")
+
+            self._message = TransmittedMessage(
+                CollisionSentinel,
+                max(message.transmission_delay,
+                    self._message.transmission_delay),
+                None
+            )
+
+        self._generation += 1
+        self.busy_until = env.now + self.propagation_delay
+
+        timeout = env.timeout(self.propagation_delay)
+        timeout.callbacks.append(partial(self._deliver, self._generation))
+
+    def _deliver(self, generation, _):
+
+        # A transmission started after this callback was scheduled has moved
+        # the end of the busy interval.
+        if generation != self._generation:
+            return
+
+        message = self._message
+        self._message = None
+        self.busy_until = None
+
+        deliver_all(self.env, (node for node in self._endpoints()
+                               if node is not message.sender), message)
+
+
+def deliver_all(env, nodes: Iterable, message: TransmittedMessage):
+    """
+    Fa iniziare la ricezione di un messaggio a più nodi, programmando un
+    solo evento per tutte le ricezioni che terminano nello stesso istante.
+
+    :param env: L'environment di simulazione.
+    :param nodes: I nodi che ricevono il messaggio.
+    :param message: Il messaggio ricevuto.
+    """
+
+    receptions_by_delay = collections.OrderedDict()
+
+    for node in nodes:
+        delay, generation = node._start_reception(message)
+        receptions_by_delay.setdefault(delay, []).append((node, generation))
+
+    for delay, receptions in receptions_by_delay.items():
+        timeout = env.timeout(delay)
+        timeout.callbacks.append(partial(_end_receptions, receptions))
+
+
+def _end_receptions(receptions, _):
+    for node, generation in receptions:
+        node._end_occupation(generation)
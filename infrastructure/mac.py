@@ -0,0 +1,210 @@
+"""
+Contiene il livello MAC opzionale dei nodi.
+
+Senza livello MAC un nodo trasmette appena il protocollo lo richiede, e più
+nodi che trasmettono insieme sullo stesso bus collidono. Un MacLayer accoda
+invece le trasmissioni del nodo, e prima di ognuna attende un tempo di
+backoff e ascolta il mezzo (CSMA): se il nodo sta ricevendo o uno dei bus a
+cui è collegato sta propagando un messaggio, la trasmissione viene
+rimandata con un nuovo backoff.
+
+La politica di backoff è intercambiabile: RandomBackoff usa un backoff
+esponenziale casuale, PriorityBackoff un ritardo fisso che dipende dalla
+priorità del nodo.
+"""
+
+import collections
+import random
+from typing import Optional
+
+from infrastructure.bus import Bus
+from infrastructure.message import TransmittedMessage
+
+
+class RandomBackoff:
+
+    def __init__(self, slot_time=1, min_exponent=2, max_exponent=6,
+                 rng: Optional[random.Random]=None):
+        """
+        :param slot_time: La durata di uno slot di backoff.
+        :param min_exponent: L'esponente della finestra di contesa al primo
+        tentativo.
+        :param max_exponent: L'esponente massimo della finestra di contesa.
+        :param rng: Il generatore di numeri casuali da usare.
+        """
+
+        self.slot_time = slot_time
+        self.min_exponent = min_exponent
+        self.max_exponent = max_exponent
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt: int):
+        """
+        Restituisce il tempo da attendere prima di ascoltare il mezzo.
+
+        :param attempt: Il numero di volte che il mezzo è stato trovato
+        occupato per la trasmissione corrente.
+        :return: Un tempo positivo, in modo che due ascolti del mezzo non
+        avvengano mai nello stesso istante.
+        """
+
+        exponent = min(self.min_exponent + attempt, self.max_exponent)
+        return self.slot_time * (1 + self.rng.randrange(1 << exponent))
+
+
+class PriorityBackoff:
+
+    def __init__(self, priority: int, slot_time=1):
+        """
+        :param priority: La priorità del nodo. I nodi con valore minore
+        attendono meno, e ottengono il mezzo per primi.
+        :param slot_time: La durata di uno slot di backoff.
+        """
+
+        if priority < 0:
+            raise ValueError('priority must not be negative')
+
+        self.priority = priority
+        self.slot_time = slot_time
+
+    def delay(self, attempt: int):
+        return self.slot_time * (1 + self.priority)
+
+
+class MacStats:
+    """
+    Statistiche sulla coda di trasmissione di un MacLayer.
+    """
+
+    def __init__(self):
+        self.enqueued = 0
+        self.transmitted = 0
+        self.deferrals = 0
+        self.max_queue_length = 0
+        self.total_queueing_time = 0
+        self._queue_length = 0
+        self._queue_length_area = 0
+        self._last_change = 0
+
+    def __repr__(self):
+        return (f'<MacStats enqueued={self.enqueued} '
+                f'transmitted={self.transmitted} '
+                f'deferrals={self.deferrals}>')
+
+    def queue_length_changed(self, length, now):
+
+        elapsed = now - self._last_change
+        self._queue_length_area += self._queue_length * elapsed
+        self._queue_length = length
+        self._last_change = now
+
+        self.max_queue_length = max(self.max_queue_length, length)
+
+    def mean_queue_length(self, now):
+        """
+        La lunghezza media della coda, pesata sul tempo, dall'inizio della
+        simulazione fino a `now`.
+        """
+
+        if now <= 0:
+            return 0
+
+        area = (self._queue_length_area +
+                self._queue_length * (now - self._last_change))
+        return area / now
+
+    @property
+    def mean_queueing_time(self):
+        if self.transmitted == 0:
+            return None
+        return self.total_queueing_time / self.transmitted
+
+
+class MacLayer:
+
+    def __init__(self, backoff=None):
+        """
+        :param backoff: La politica di backoff, ovvero un oggetto con un
+        metodo delay(attempt) che restituisce un tempo positivo. Di default
+        RandomBackoff.
+        """
+
+        self.backoff = backoff or RandomBackoff()
+        self.stats = MacStats()
+        self.node = None
+        self._queue = collections.deque()
+        self._sender = None
+
+    def attach(self, node):
+        """
+        Collega il livello MAC al nodo di cui gestisce le trasmissioni.
+        """
+        self.node = node
+
+    def __len__(self):
+        return len(self._queue)
+
+    def enqueue(self, message: TransmittedMessage):
+        """
+        Accoda un messaggio da trasmettere.
+
+        :param message: Il messaggio da trasmettere.
+        :return: Un evento che scatta al termine della trasmissione.
+        """
+
+        env = self.node.env
+        done = env.event()
+
+        self._queue.append((message, done, env.now))
+        self.stats.enqueued += 1
+        self.stats.queue_length_changed(len(self._queue), env.now)
+
+        if self._sender is None:
+            self._sender = env.process(self._send_queued())
+
+        return done
+
+    def medium_is_busy(self):
+        """
+        Indica se il nodo percepisce il mezzo come occupato: se sta
+        ricevendo o trasmettendo, o se un bus a cui è collegato sta
+        propagando un messaggio.
+        """
+
+        node = self.node
+
+        return node.is_busy() or any(
+            neighbor.is_busy() for neighbor in node._netgraph.neighbors(node)
+            if isinstance(neighbor, Bus)
+        )
+
+    def _send_queued(self):
+
+        node = self.node
+        env = node.env
+        queue = self._queue
+        stats = self.stats
+
+        while queue:
+
+            attempt = 0
+
+            while True:
+                yield env.timeout(self.backoff.delay(attempt))
+
+                if not self.medium_is_busy():
+                    break
+
+                attempt += 1
+                stats.deferrals += 1
+
+            message, done, enqueue_time = queue.popleft()
+            stats.queue_length_changed(len(queue), env.now)
+            stats.total_queueing_time += env.now - enqueue_time
+
+            yield node._transmit_message(message)
+
+            stats.transmitted += 1
+            done.succeed()
+
+        self._sender = None
@@ -1,10 +1,13 @@
 import logging
-from typing import Dict
+from typing import Callable, Dict, Optional
 
 import networkx as nx
 import simpy
 
 from infrastructure import Bus
+from infrastructure.mac import MacLayer
+from infrastructure.scheduler import HeapEnvironment
+from infrastructure.table_store import NoiseTableStore
 
 
 class Network:
@@ -14,12 +17,51 @@ class Network:
     )
 
     def __init__(self, env: simpy.Environment=None, netgraph: nx.Graph=None,
-                 transmission_speed=5):
-
-        self.env = env or simpy.Environment()
+                 transmission_speed=5, compact_noise_tables=False,
+                 channel_delivery=False,
+                 mac_factory: Optional[Callable[[], MacLayer]]=None,
+                 lightweight_scheduler=False):
+
+        if env is not None and lightweight_scheduler:
+            raise ValueError('lightweight_scheduler cannot be used with an '
+                             'explicit env')
+
+        # If set, the simulation runs on HeapEnvironment instead of SimPy's
+        # environment.
+        if env is None:
+            env = (HeapEnvironment() if lightweight_scheduler
+                   else simpy.Environment())
+
+        self.env = env
         self.netgraph = netgraph or nx.Graph()
         self.transmission_speed = transmission_speed
 
+        # If set, buses and nodes deliver messages through scheduled
+        # callbacks on shared channels instead of per-receiver processes.
+        self.channel_delivery = channel_delivery
+
+        # If set, called to create the MAC layer of every node which isn't
+        # given one explicitly.
+        self.mac_factory = mac_factory
+
+        # If set, the noise tables of the nodes are views over a single
+        # matrix owned by the network, instead of separate dicts.
+        self.noise_store: Optional[NoiseTableStore] = (
+            NoiseTableStore() if compact_noise_tables else None
+        )
+
+    def noise_snapshot(self):
+        """
+        Restituisce le tabelle del rumore di tutti i nodi come un'unica
+        matrice. Richiede che la rete sia stata creata con
+        compact_noise_tables.
+        """
+
+        if self.noise_store is None:
+            raise ValueError('The network does not use compact noise tables')
+
+        return self.noise_store.noise_matrix()
+
     def run_nodes_processes(self):
         for node in self.netgraph.nodes_iter():
             if hasattr(node, 'run_proc'):
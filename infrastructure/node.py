@@ -1,3 +1,4 @@
+import collections
 import logging
 import weakref
 from typing import Any, Optional
@@ -6,6 +7,7 @@ import simpy
 
 from utils.condition_var import BroadcastConditionVar
 from utils.simpy_process import simpy_process
+from .mac import MacLayer
 from .message import (
     TransmittedMessage, CollisionSentinel, make_transmission_delay
 )
@@ -37,7 +39,13 @@ class NetworkNode:
 
     """
 
-    def __init__(self, network):
+    def __init__(self, network, mac: Optional[MacLayer]=None):
+        """
+        :param network: La rete in cui si vuole inserire il nodo.
+        :param mac: Il livello MAC che gestisce le trasmissioni del nodo. Se
+        non viene specificato, viene creato tramite il mac_factory della
+        rete, se presente.
+        """
 
         self.env = env = network.env  # type: simpy.Environment
 
@@ -48,16 +56,32 @@ class NetworkNode:
         self._message_in_transmission: Optional[TransmittedMessage] = None
         self._last_transmission_start = None
 
+        self._channel_delivery = network.channel_delivery
+        self._occupation_generation = 0
+        self._transmission_done: Optional[simpy.Event] = None
+        self._pending_transmissions = collections.deque()
+        self._idle_waiters = []
+
+        # Total length of the messages transmitted by the node.
+        self.transmitted_frames = 0
+
+        if mac is None and network.mac_factory is not None:
+            mac = network.mac_factory()
+
+        self.mac = mac
+
+        if mac is not None:
+            mac.attach(self)
+
         netgraph.add_node(self)
 
-    @simpy_process
     def _transmit_process(self, message_val: Any, message_len: int):
         """
         Invia un messaggio dal nodo alla rete.
 
         :param message_val: Il contenuto del messaggio.
         :param message_len: La lunghezza relativa del messaggio.
-        :return: Il processo che esegue l'operazione descritta.
+        :return: Un evento che scatta al termine della trasmissione.
         """
 
         transmission_delay = make_transmission_delay(
@@ -65,7 +89,28 @@ class NetworkNode:
         )
 
         message = TransmittedMessage(message_val, transmission_delay, self)
+        self.transmitted_frames += message_len
+
+        if self.mac is not None:
+            return self.mac.enqueue(message)
+
+        return self._transmit_message(message)
+
+    def _transmit_message(self, message: TransmittedMessage):
+        """
+        Trasmette subito un messaggio, senza passare dal livello MAC.
+
+        :param message: Il messaggio da trasmettere.
+        :return: Un evento che scatta al termine della trasmissione.
+        """
 
+        if self._channel_delivery:
+            return self._transmit_on_channel(message)
+
+        return self.__transmit_with_process(message)
+
+    @simpy_process
+    def __transmit_with_process(self, message: TransmittedMessage):
         yield from self.__occupy(message, in_transmission=True)
 
     @simpy_process
@@ -78,6 +123,60 @@ class NetworkNode:
 
         yield from self.__occupy(message, in_transmission=False)
 
+    def deliver(self, message: TransmittedMessage):
+        """
+        Consegna al nodo un messaggio proveniente da un collegamento diretto
+        o da un bus.
+
+        :param message: Il TransmittedMessage da consegnare al nodo.
+        """
+
+        if self._channel_delivery:
+            delay, generation = self._start_reception(message)
+            self._schedule_occupation_end(delay, generation)
+        else:
+            self.send_process(message)
+
+    def is_busy(self):
+        """
+        Indica se il nodo sta trasmettendo o ricevendo un messaggio.
+        """
+        return self._message_in_transmission is not None
+
+    def _message_received(self, value: Any):
+        """
+        Chiamato al termine della ricezione di un messaggio. Risveglia chi
+        attende tramite _receive_ev; le sottoclassi possono ridefinirlo per
+        gestire la ricezione senza eventi.
+
+        :param value: Il contenuto del messaggio ricevuto.
+        """
+        self._receive_current_transmission_cond.broadcast(value)
+
+    def _idle_ev(self):
+        """
+        Restituisce un evento che scatta al termine della trasmissione o
+        ricezione in corso, o subito se il nodo è libero.
+        """
+
+        event = self.env.event()
+
+        if self.is_busy():
+            self._idle_waiters.append(event)
+        else:
+            event.succeed()
+
+        return event
+
+    def _notify_idle(self):
+
+        waiters = self._idle_waiters
+
+        if waiters:
+            self._idle_waiters = []
+            for event in waiters:
+                event.succeed()
+
     def _receive_ev(self):
         """
         Restituisce un evento che scatta alla prossima ricezione del
@@ -136,7 +235,7 @@ class NetworkNode:
 
         if in_transmission:
             for n in self._netgraph.neighbors(self):
-                n.send_process(message)
+                n.deliver(message)
 
         try:
             yield env.timeout(to_wait)
@@ -149,4 +248,111 @@ class NetworkNode:
         self._current_occupy_proc = None
 
         if not in_transmission:
-            self._receive_current_transmission_cond.broadcast(message.value)
+            self._message_received(message.value)
+
+        self._notify_idle()
+
+    # Consegna tramite callback.
+    #
+    # Quando la rete è creata con channel_delivery, l'occupazione del nodo
+    # viene gestita senza processi: ogni trasmissione o ricezione programma
+    # un solo evento al termine dell'occupazione, e le collisioni vengono
+    # calcolate come in __occupy. Un contatore di generazione sostituisce le
+    # interruzioni: il termine di un'occupazione superata da una collisione
+    # viene ignorato.
+
+    def _transmit_on_channel(self, message: TransmittedMessage):
+
+        done = self.env.event()
+
+        if self.is_busy():
+            self._pending_transmissions.append((message, done))
+        else:
+            self._start_transmission(message, done)
+
+        return done
+
+    def _start_transmission(self, message: TransmittedMessage, done):
+
+        self._last_transmission_start = self.env.now
+        self._message_in_transmission = message
+        self._transmission_done = done
+        self._occupation_generation += 1
+
+        # The end of the transmission is scheduled before the neighbors
+        # start receiving, as it happens with __occupy.
+        self._schedule_occupation_end(message.transmission_delay,
+                                      self._occupation_generation)
+
+        for n in self._netgraph.neighbors(self):
+            n.deliver(message)
+
+    def _start_reception(self, message: TransmittedMessage):
+        """
+        Fa iniziare al nodo la ricezione di un messaggio, senza programmarne
+        il termine.
+
+        :param message: Il messaggio ricevuto.
+        :return: La durata dell'occupazione del nodo e la sua generazione,
+        da passare a _end_occupation al suo termine.
+        """
+
+        now = self.env.now
+
+        # A transmission overlapped by a reception ends immediately, like an
+        # interrupted transmission process.
+        if self._transmission_done is not None:
+            self._transmission_done.succeed()
+            self._transmission_done = None
+
+        last_transmission_start = self._last_transmission_start
+        self._last_transmission_start = now
+
+        if self._message_in_transmission is None:
+            self._message_in_transmission = message
+            to_wait = message.transmission_delay
+        else:
+            logger.warning(f"{self}: A collision has happened between "
+                           f"{message} and {self._message_in_transmission}")
+
+            last_occupation_time = now - last_transmission_start
+
+            remaining_occupation_time = (
+                self._message_in_transmission.transmission_delay -
+                last_occupation_time
+            )
+
+            to_wait = max(message.transmission_delay,
+                          remaining_occupation_time)
+
+            self._message_in_transmission = TransmittedMessage(
+                CollisionSentinel,
+                last_occupation_time + to_wait,
+                None
+            )
+
+        self._occupation_generation += 1
+        return to_wait, self._occupation_generation
+
+    def _schedule_occupation_end(self, delay, generation):
+        timeout = self.env.timeout(delay)
+        timeout.callbacks.append(lambda _: self._end_occupation(generation))
+
+    def _end_occupation(self, generation):
+
+        if generation != self._occupation_generation:
+            return
+
+        message = self._message_in_transmission
+        self._message_in_transmission = None
+
+        if self._transmission_done is not None:
+            self._transmission_done.succeed()
+            self._transmission_done = None
+        else:
+            self._message_received(message.value)
+
+        self._notify_idle()
+
+        if self._pending_transmissions:
+            self._start_transmission(*self._pending_transmissions.popleft())
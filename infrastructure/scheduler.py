@@ -0,0 +1,412 @@
+"""
+Contiene uno scheduler a eventi discreti leggero, utilizzabile al posto di
+simpy.Environment.
+
+HeapEnvironment implementa solo la parte dell'interfaccia di SimPy usata dal
+simulatore: eventi, timeout, processi con interruzioni e condizioni tramite
+gli operatori `|` e `&`. Gli eventi usano gli stessi attributi di quelli di
+SimPy (`callbacks`, `_ok`, `_value`, `_defused`), per cui le risorse di SimPy,
+come Store e PriorityResource, funzionano anche su questo scheduler.
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+
+from simpy.events import ConditionValue, NORMAL, PENDING, URGENT
+from simpy.exceptions import Interrupt
+
+
+class Event:
+
+    __slots__ = ('env', 'callbacks', '_value', '_ok', '_defused')
+
+    def __init__(self, env: 'HeapEnvironment'):
+        self.env = env
+        self.callbacks = []
+        self._value = PENDING
+
+    def __repr__(self):
+        return f'<{type(self).__name__} object at {id(self):#x}>'
+
+    @property
+    def triggered(self):
+        return self._value is not PENDING
+
+    @property
+    def processed(self):
+        return self.callbacks is None
+
+    @property
+    def ok(self):
+        return self._ok
+
+    @property
+    def defused(self):
+        return hasattr(self, '_defused')
+
+    @defused.setter
+    def defused(self, _):
+        self._defused = True
+
+    @property
+    def value(self):
+        if self._value is PENDING:
+            raise AttributeError(f'Value of {self} is not yet available')
+        return self._value
+
+    def trigger(self, event):
+        self._ok = event._ok
+        self._value = event._value
+        self.env.schedule(self)
+
+    def succeed(self, value=None):
+
+        if self._value is not PENDING:
+            raise RuntimeError(f'{self} has already been triggered')
+
+        self._ok = True
+        self._value = value
+
+        env = self.env
+        heappush(env._queue, (env._now, NORMAL, next(env._eid), self))
+        return self
+
+    def fail(self, exception: BaseException):
+
+        if self._value is not PENDING:
+            raise RuntimeError(f'{self} has already been triggered')
+
+        if not isinstance(exception, BaseException):
+            raise ValueError(f'{exception} is not an exception.')
+
+        self._ok = False
+        self._value = exception
+        self.env.schedule(self)
+        return self
+
+    def __and__(self, other):
+        return Condition(self.env, Condition.all_events, (self, other))
+
+    def __or__(self, other):
+        return Condition(self.env, Condition.any_events, (self, other))
+
+
+class Timeout(Event):
+
+    __slots__ = ()
+
+    def __init__(self, env: 'HeapEnvironment', delay, value=None):
+
+        if delay < 0:
+            raise ValueError(f'Negative delay {delay}')
+
+        self.env = env
+        self.callbacks = []
+        self._value = value
+        self._ok = True
+        heappush(env._queue,
+                 (env._now + delay, NORMAL, next(env._eid), self))
+
+
+class Process(Event):
+
+    __slots__ = ('_generator', '_target')
+
+    def __init__(self, env: 'HeapEnvironment', generator):
+
+        if not hasattr(generator, 'throw'):
+            raise ValueError(f'{generator} is not a generator.')
+
+        self.env = env
+        self.callbacks = []
+        self._value = PENDING
+        self._generator = generator
+
+        # The process starts before any other event scheduled at the same
+        # time, as in SimPy.
+        start = Event(env)
+        start._ok = True
+        start._value = None
+        start.callbacks.append(self._resume)
+        heappush(env._queue, (env._now, URGENT, next(env._eid), start))
+
+        self._target = start
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def is_alive(self):
+        return self._value is PENDING
+
+    def interrupt(self, cause=None):
+
+        if self._value is not PENDING:
+            raise RuntimeError(f'{self} has terminated and cannot be '
+                               f'interrupted.')
+
+        if self is self.env.active_process:
+            raise RuntimeError('A process is not allowed to interrupt itself.')
+
+        interruption = Event(self.env)
+        interruption._ok = False
+        interruption._value = Interrupt(cause)
+        interruption._defused = True
+        interruption.callbacks.append(self._interrupt)
+        self.env.schedule(interruption, URGENT)
+
+    def _interrupt(self, event):
+
+        # The process may have terminated after the interruption was
+        # scheduled.
+        if self._value is not PENDING:
+            return
+
+        target_callbacks = self._target.callbacks
+
+        if target_callbacks is not None:
+            target_callbacks.remove(self._resume)
+
+        self._resume(event)
+
+    def _resume(self, event):
+
+        env = self.env
+        env._active_proc = self
+        generator = self._generator
+
+        while True:
+            try:
+                if event._ok:
+                    event = generator.send(event._value)
+                else:
+                    event._defused = True
+                    event = generator.throw(event._value)
+            except StopIteration as e:
+                event = None
+                self._ok = True
+                self._value = e.value
+                env.schedule(self)
+                break
+            except BaseException as e:
+                event = None
+                self._ok = False
+                self._value = e
+                env.schedule(self)
+                break
+
+            try:
+                callbacks = event.callbacks
+            except AttributeError:
+                raise RuntimeError(f'{self} yielded an invalid event '
+                                   f'{event!r}') from None
+
+            # Events already processed resume the process immediately.
+            if callbacks is not None:
+                callbacks.append(self._resume)
+                break
+
+        self._target = event
+        env._active_proc = None
+
+
+class Condition(Event):
+
+    __slots__ = ('_evaluate', '_events', '_count')
+
+    def __init__(self, env: 'HeapEnvironment', evaluate, events):
+
+        super().__init__(env)
+        self._evaluate = evaluate
+        self._events = tuple(events)
+        self._count = 0
+
+        if not self._events:
+            self.succeed(ConditionValue())
+            return
+
+        for event in self._events:
+            if event.env is not env:
+                raise ValueError('It is not allowed to mix events from '
+                                 'different environments')
+
+        for event in self._events:
+            if event.callbacks is None:
+                self._check(event)
+            else:
+                event.callbacks.append(self._check)
+
+        self.callbacks.append(self._build_value)
+
+    def _populate_value(self, value: ConditionValue):
+        for event in self._events:
+            if isinstance(event, Condition):
+                event._populate_value(value)
+            elif event.callbacks is None:
+                value.events.append(event)
+
+    def _build_value(self, _):
+
+        for event in self._events:
+            callbacks = event.callbacks
+            if callbacks is not None and self._check in callbacks:
+                callbacks.remove(self._check)
+
+        if self._ok:
+            self._value = ConditionValue()
+            self._populate_value(self._value)
+
+    def _check(self, event):
+
+        if self._value is not PENDING:
+            return
+
+        self._count += 1
+
+        if not event._ok:
+            event._defused = True
+            self.fail(event._value)
+        elif self._evaluate(self._events, self._count):
+            # The value is built when the condition is processed, so that
+            # it includes the events processed in the meantime.
+            self.succeed()
+
+    @staticmethod
+    def all_events(events, count):
+        return len(events) == count
+
+    @staticmethod
+    def any_events(events, count):
+        return count > 0 or len(events) == 0
+
+
+class AllOf(Condition):
+
+    __slots__ = ()
+
+    def __init__(self, env, events):
+        super().__init__(env, Condition.all_events, events)
+
+
+class AnyOf(Condition):
+
+    __slots__ = ()
+
+    def __init__(self, env, events):
+        super().__init__(env, Condition.any_events, events)
+
+
+class _StopRun(Exception):
+    pass
+
+
+class HeapEnvironment:
+    """
+    Environment di simulazione basato su una coda con priorità, con la
+    stessa interfaccia di simpy.Environment.
+    """
+
+    def __init__(self, initial_time=0):
+        self._now = initial_time
+        self._queue = []
+        self._eid = count()
+        self._active_proc = None
+
+    @property
+    def now(self):
+        return self._now
+
+    @property
+    def active_process(self):
+        return self._active_proc
+
+    def event(self):
+        return Event(self)
+
+    def timeout(self, delay, value=None):
+        return Timeout(self, delay, value)
+
+    def process(self, generator):
+        return Process(self, generator)
+
+    def all_of(self, events):
+        return AllOf(self, events)
+
+    def any_of(self, events):
+        return AnyOf(self, events)
+
+    def schedule(self, event, priority=NORMAL, delay=0):
+        heappush(self._queue,
+                 (self._now + delay, priority, next(self._eid), event))
+
+    def peek(self):
+        return self._queue[0][0] if self._queue else float('inf')
+
+    def step(self):
+
+        self._now, _, _, event = heappop(self._queue)
+
+        callbacks, event.callbacks = event.callbacks, None
+
+        for callback in callbacks:
+            callback(event)
+
+        if not event._ok and not hasattr(event, '_defused'):
+            raise event._value
+
+    def run(self, until=None):
+        """
+        Esegue la simulazione finché ci sono eventi, oppure fino all'istante
+        o all'evento indicati da `until`.
+
+        :param until: Un istante di simulazione, un evento o None.
+        :return: Il valore dell'evento `until`, se specificato.
+        """
+
+        if until is not None:
+
+            if not hasattr(until, 'callbacks'):
+                at = float(until)
+
+                if at <= self._now:
+                    raise ValueError(f'until(={at}) should be > the current '
+                                     f'simulation time.')
+
+                until = Event(self)
+                until._ok = True
+                until._value = None
+                self.schedule(until, URGENT, at - self._now)
+
+            elif until.callbacks is None:
+                return until.value
+
+            until.callbacks.append(_stop_run)
+
+        queue = self._queue
+
+        try:
+            # Same as step(), inlined to avoid a method call for each event.
+            while queue:
+                self._now, _, _, event = heappop(queue)
+
+                callbacks, event.callbacks = event.callbacks, None
+
+                for callback in callbacks:
+                    callback(event)
+
+                if not event._ok and not hasattr(event, '_defused'):
+                    raise event._value
+
+        except _StopRun:
+            if not until._ok:
+                raise until._value
+            return until._value
+
+        if until is not None:
+            raise RuntimeError(f'No scheduled events left but "until" event '
+                               f'was not triggered: {until}')
+
+
+def _stop_run(_):
+    raise _StopRun()
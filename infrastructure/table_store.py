@@ -0,0 +1,141 @@
+"""
+Contiene la memorizzazione compatta delle tabelle del rumore dei nodi.
+
+NoiseTableStore conserva le tabelle del rumore di tutti i nodi di una rete in
+un'unica matrice di interi a 16 bit, indicizzata per indirizzo statico del
+nodo proprietario (riga) e del nodo sorgente (colonna). Le voci assenti sono
+segnate dal valore EMPTY.
+
+I nodi accedono alla propria riga tramite NoiseTableView, che si comporta
+come un dizionario e può sostituire le tabelle del rumore dei nodi senza
+modifiche al resto del codice.
+"""
+
+import collections.abc
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EMPTY = -1
+MAX_NOISE = (1 << 15) - 1
+
+
+class NoiseTableStore:
+
+    def __init__(self, initial_capacity=64, max_capacity=1 << 11):
+        """
+        :param initial_capacity: Il numero di indirizzi per cui viene
+        inizialmente allocata la matrice.
+        :param max_capacity: Il massimo numero di indirizzi gestibili.
+        """
+
+        if np is None:
+            raise ImportError('numpy is required for compact noise tables')
+
+        self.max_capacity = max_capacity
+        self._matrix = np.full((initial_capacity, initial_capacity), EMPTY,
+                               dtype=np.int16)
+        self._row_lengths = np.zeros(initial_capacity, dtype=np.int32)
+
+    @property
+    def capacity(self):
+        return self._matrix.shape[0]
+
+    def table_for(self, address: int) -> 'NoiseTableView':
+        """
+        Restituisce la tabella del rumore del nodo con l'indirizzo dato.
+
+        :param address: L'indirizzo statico del nodo.
+        :return: Una vista sulla riga della matrice relativa al nodo.
+        """
+        self._ensure_capacity(address)
+        return NoiseTableView(self, address)
+
+    def noise_matrix(self):
+        """
+        Restituisce una copia delle tabelle del rumore di tutti i nodi, come
+        matrice quadrata indicizzata per indirizzo statico. Le voci assenti
+        valgono EMPTY.
+        """
+        return self._matrix.copy()
+
+    def nbytes(self):
+        return self._matrix.nbytes + self._row_lengths.nbytes
+
+    def _ensure_capacity(self, address: int):
+
+        capacity = self.capacity
+
+        if address < capacity:
+            return
+
+        if address >= self.max_capacity:
+            raise ValueError(f'Address {address} exceeds the store capacity')
+
+        new_capacity = min(max(capacity * 2, address + 1), self.max_capacity)
+
+        matrix = np.full((new_capacity, new_capacity), EMPTY, dtype=np.int16)
+        matrix[:capacity, :capacity] = self._matrix
+
+        row_lengths = np.zeros(new_capacity, dtype=np.int32)
+        row_lengths[:capacity] = self._row_lengths
+
+        self._matrix = matrix
+        self._row_lengths = row_lengths
+
+
+class NoiseTableView(collections.abc.MutableMapping):
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store: NoiseTableStore, row: int):
+        self._store = store
+        self._row = row
+
+    def __repr__(self):
+        return f'NoiseTableView({dict(self.items())!r})'
+
+    def __len__(self):
+        return int(self._store._row_lengths[self._row])
+
+    def __iter__(self):
+        row = self._store._matrix[self._row]
+        return iter(np.flatnonzero(row != EMPTY).tolist())
+
+    def __contains__(self, address):
+        store = self._store
+        return (0 <= address < store.capacity and
+                store._matrix[self._row, address] != EMPTY)
+
+    def __getitem__(self, address):
+
+        if address not in self:
+            raise KeyError(address)
+
+        return int(self._store._matrix[self._row, address])
+
+    def __setitem__(self, address, noise):
+
+        store = self._store
+        store._ensure_capacity(address)
+
+        if store._matrix[self._row, address] == EMPTY:
+            store._row_lengths[self._row] += 1
+
+        store._matrix[self._row, address] = min(max(noise, 0), MAX_NOISE)
+
+    def __delitem__(self, address):
+
+        if address not in self:
+            raise KeyError(address)
+
+        store = self._store
+        store._matrix[self._row, address] = EMPTY
+        store._row_lengths[self._row] -= 1
+
+    def items(self):
+        row = self._store._matrix[self._row]
+        addresses = np.flatnonzero(row != EMPTY)
+        return list(zip(addresses.tolist(), row[addresses].tolist()))
@@ -1,3 +1,4 @@
+from .gateway_node import GatewayNode
 from .master_node import MasterNode
 from .slave_node import SlaveNode
 
@@ -0,0 +1,65 @@
+"""
+Contiene le funzioni di costo degli archi con cui il master calcola i
+cammini minimi.
+
+Una funzione di costo riceve il rumore di un collegamento, come lo stima il
+master, e restituisce il costo dell'arco. Deve essere non decrescente nel
+rumore. Il rumore è la media, moltiplicata per 1000, degli errori per frame
+dei pacchetti ricevuti, in cui ogni frame con errori conta almeno 2.
+"""
+
+
+class NoiseCost:
+    """
+    Il costo dell'arco è il rumore stesso. È il comportamento predefinito
+    del master.
+    """
+
+    # noinspection PyMethodMayBeStatic
+    def __call__(self, noise):
+        return noise
+
+
+class HopCountCost:
+    """
+    Ogni arco costa 1: i cammini minimizzano il numero di salti, ignorando il
+    rumore.
+    """
+
+    # noinspection PyMethodMayBeStatic
+    def __call__(self, noise):
+        return 1
+
+
+class EtxCost:
+    """
+    Il costo dell'arco è il numero atteso di frame trasmessi per far
+    arrivare un pacchetto di `packet_frames` frame, ritrasmissioni comprese,
+    ed è quindi proporzionale al tempo atteso di consegna sul collegamento.
+
+    Dal rumore si ricava la frazione dei frame ricevuti con errori; un frame
+    diventa illeggibile con due errori, che si suppongono indipendenti, per
+    cui la probabilità di perderlo è il quadrato di quella frazione.
+    """
+
+    # Above this loss probability the link is considered unusable, but
+    # still gets a finite cost.
+    MAX_FRAME_LOSS = 0.99
+
+    def __init__(self, packet_frames=16):
+
+        if packet_frames < 1:
+            raise ValueError('packet_frames must be positive')
+
+        self.packet_frames = packet_frames
+
+    def __repr__(self):
+        return f'<EtxCost packet_frames={self.packet_frames}>'
+
+    def __call__(self, noise):
+
+        damaged_fraction = min(noise / 2000, 1)
+        frame_loss = min(damaged_fraction ** 2, self.MAX_FRAME_LOSS)
+        frames = self.packet_frames
+
+        return frames / (1 - frame_loss) ** frames
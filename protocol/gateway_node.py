@@ -0,0 +1,153 @@
+"""
+Contiene il gateway, lo slave che collega al resto della rete un segmento
+con il proprio spazio di indirizzi.
+
+Gli indirizzi statici e logici occupano un frame, per cui un master non può
+gestire più di NodeDataManager.MAX_ADDRESS slave, e deve conoscere e
+instradare l'intero grafo della rete. Un gateway ha due interfacce: con la
+prima è uno slave della rete del master; con la seconda, `downlink`, è il
+master del proprio segmento, che assegna ai suoi nodi indirizzi locali,
+indipendenti da quelli degli altri segmenti, e ne segue il rumore e i
+cammini minimi. I nodi di un segmento sono collegati solo tra loro e al
+downlink del gateway.
+
+Il master della rete conosce solo i nodi collegati a lui e, di ogni
+segmento, la profondità (vedi MasterNode.add_segment): il suo stato cresce
+con il numero di segmenti, e non con il numero totale dei nodi. Una
+richiesta per il nodo SegmentAddress(gateway, locale) raggiunge il gateway
+come una richiesta normale, con un frame in più per l'indirizzo locale; il
+gateway invia il payload nel segmento e risponde al master con la risposta
+del nodo. Se il nodo del segmento non risponde, neanche il gateway
+risponde, e la richiesta del master scade.
+"""
+
+import logging
+from typing import Optional
+
+import networkx as nx
+
+from protocol.master_node import MasterNode, MessageOutcome
+from protocol.packet import (
+    RequestPacket, CoalescedPayload, MAX_PAYLOAD_LENGTH
+)
+from protocol.slave_node import SlaveNode
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayNode(SlaveNode):
+
+    def __init__(self, network, static_address: int,
+                 on_message_received=None,
+                 segment_options: Optional[dict]=None, **kwargs):
+        """
+        :param network: La rete, che contiene sia il gateway sia il
+        segmento.
+        :param static_address: L'indirizzo statico del gateway nella rete
+        del master.
+        :param on_message_received: Risponde ai messaggi per il gateway
+        stesso, come per uno slave.
+        :param segment_options: Gli argomenti del MasterNode del segmento.
+        :param kwargs: Gli altri argomenti di SlaveNode.
+        """
+
+        # The same static addresses are used in every segment.
+        if network.noise_store is not None:
+            raise ValueError('The segments of the gateways cannot use '
+                             'compact noise tables')
+
+        super().__init__(network, static_address, on_message_received,
+                         **kwargs)
+
+        self.downlink = MasterNode(network, **(segment_options or {}))
+
+    def __repr__(self):
+        return f'<GatewayNode static={self.static_address} ' \
+               f'logic={self.logic_address}>'
+
+    def init_segment_from_netgraph(self, netgraph: nx.Graph,
+                                   initial_noise_value=0.5):
+        """
+        Inizializza il master del segmento con i nodi collegati al downlink.
+        """
+
+        self.downlink.init_from_netgraph(netgraph, initial_noise_value)
+
+    @property
+    def segment_depth(self):
+        """
+        La profondità dell'albero dei cammini minimi del segmento, da
+        passare a MasterNode.add_segment.
+        """
+
+        downlink = self.downlink
+
+        paths = nx.shortest_path(downlink.node_graph,
+                                 downlink._node_manager[0],
+                                 weight=downlink._path_weight)
+
+        return max(len(path) for path in paths.values()) - 1
+
+    def _make_response_packet(self, packet):
+
+        if packet.segment_destination is None:
+            return super()._make_response_packet(packet)
+
+        # The gateway answers after the transaction in the segment, from
+        # run_proc.
+        self._deferred_response = self._answer_segment_request(packet)
+        return None
+
+    def _answer_segment_request(self, request: RequestPacket):
+        """
+        Invia il payload di una richiesta al nodo del segmento, e crea la
+        risposta per il master con quella del nodo.
+        """
+
+        local_addr = request.segment_destination
+        coalesced = isinstance(request.payload, CoalescedPayload)
+
+        # The messages of a coalesced payload are completed one by one by
+        # the master of the segment.
+        messages = (list(request.payload) if coalesced
+                    else [(request.payload, request.payload_length)])
+
+        logger.info(f"{self} forwards {len(messages)} messages to "
+                    f"{local_addr} in its segment")
+
+        try:
+            completions = self.downlink.send_many(
+                (message, length, local_addr) for message, length in messages
+            )
+        except ValueError:
+            logger.warning(f"{self} has no node {local_addr} in its segment")
+            return None
+
+        yield self.env.all_of(completions)
+        results = [completion.value for completion in completions]
+
+        if any(result.outcome is not MessageOutcome.answered
+               for result in results):
+            logger.info(f"{self} received no answer from {local_addr}")
+            return None
+
+        response = self._new_response_packet(request)
+
+        if coalesced:
+            answers = CoalescedPayload((result.payload, result.payload_length)
+                                       for result in results)
+
+            if answers.length > MAX_PAYLOAD_LENGTH:
+                answers = answers.truncated()
+                logger.warning(f"{self} answers only {len(answers)} of "
+                               f"{len(results)} messages, whose answers "
+                               f"don't fit in the response")
+
+            response.payload = answers
+            response.payload_length = answers.length
+        else:
+            result, = results
+            response.payload = result.payload
+            response.payload_length = result.payload_length
+
+        return response
@@ -1,7 +1,9 @@
 import collections
+import enum
 import itertools
 import logging
-from typing import List, Dict, Tuple
+import math
+from typing import List, Dict, Optional, Tuple
 
 import networkx as nx
 import simpy
@@ -9,12 +11,26 @@ from networkx.algorithms import bipartite
 
 from infrastructure import Bus
 from infrastructure.message import make_transmission_delay
+from protocol.metrics import TransactionMetrics
 from protocol.node_data_manager import NodeDataManager, NodeDataT
 from protocol.packet import AddressType
-from protocol.packet import Packet, RequestPacket, ResponsePacket
+from protocol.packet import (
+    Packet, PacketWithSource, RequestPacket, ResponsePacket,
+    MulticastRequestPacket, MulticastResponsePacket, CoalescedPayload,
+    HelloProbePacket, HelloRequestPacket, HelloResponsePacket, NoiseReport,
+    AckPacket, MAX_PAYLOAD_LENGTH, PROBE_COMMAND_LENGTH, payload_frame_count
+)
+from protocol.reported_routes import (
+    reported_next_hop, address_heard, transmission_lost, link_heard,
+    table_reported
+)
 from protocol.rethunder_node import ReThunderNode
+from protocol.send_queue import SendQueue, QueuePolicy
 from utils.func import singledispatchmethod
-from utils.graph import shortest_paths_tree, preorder_tree_dfs
+from utils.graph import (
+    shortest_paths_tree, preorder_tree_dfs, path_from_parents,
+    LazyShortestPaths
+)
 from utils.simpy_process import simpy_process
 
 logger = logging.getLogger(__name__)
@@ -22,50 +38,246 @@ logger = logging.getLogger(__name__)
 
 AnswerPendingRecord = collections.namedtuple(
     'AnswerPendingRecord',
-    'token, path, new_addrs_table, send_time, expiry_delay'
+    'token, path, new_addrs_table, send_time, expiry_delay, request_time, '
+    'enqueue_times, completions'
 )
 
 AnswerPendingRecord.expiry_time = property(
     lambda self: self.send_time + self.expiry_delay
 )
 
+# completions holds an event (or None) for every message of the request, and
+# enqueue_times the time the message was queued. enqueue_time is the one of
+# the first message.
+SendRequest = collections.namedtuple(
+    'SendRequest',
+    'message, message_length, dest_static_addr, enqueue_time, priority, '
+    'completions, enqueue_times'
+)
+
+
+# Address of a node in the segment of a gateway: the static address of the
+# gateway and the one of the node in the segment (see add_segment).
+SegmentAddress = collections.namedtuple('SegmentAddress', 'segment, local')
+
+
+class MessageOutcome(enum.Enum):
+    answered = 0
+    timed_out = 1
+    dropped = 2
+    rejected = 3
+    unreachable = 4
+    # The answer of the slave didn't fit in the response to a coalesced
+    # request, together with those of the previous messages.
+    answer_too_long = 5
+
+
+MessageResult = collections.namedtuple(
+    'MessageResult',
+    'outcome, payload, payload_length, latency, queueing_time, retries'
+)
+
+# A request sent concurrently with others (see max_concurrent_requests).
+# footprint holds the buses and links used by its path, windows the intervals
+# in which the master sends the request and expects the answer (see
+# _transaction_windows), sending the process which transmits it, and pending
+# its AnswerPendingRecord, once sent.
+Transaction = collections.namedtuple(
+    'Transaction', 'footprint, windows, dest_static_addr, sending, pending'
+)
+
+MulticastSendRequest = collections.namedtuple(
+    'MulticastSendRequest',
+    'message, message_length, dest_static_addrs, enqueue_time, priority'
+)
+
+# Outcome of MasterNode.discover. failed_probers are the static addresses of
+# the nodes which didn't answer the request to probe their neighbors.
+DiscoveryReport = collections.namedtuple(
+    'DiscoveryReport',
+    'nodes, levels, start_time, end_time, probe_requests, failed_probers'
+)
+
+DiscoveryReport.duration = property(
+    lambda self: self.end_time - self.start_time
+)
+
 PAST_NOISE_HISTORY_WEIGHT = 2/3
 
 
 class MasterNode(ReThunderNode):
 
-    def __init__(self, network, on_message_received=None):
+    next_hop_filtering = True
 
-        super().__init__(network, 0, 0)
+    def __init__(self, network, on_message_received=None,
+                 ack_timeout: Optional[int]=None, max_retransmissions=3,
+                 coalescing_delay: Optional[int]=None,
+                 max_answer_length: Optional[int]=None,
+                 scheduling_policy=None, queue_capacity: Optional[int]=None,
+                 queue_policy=QueuePolicy.block,
+                 per_destination_limit: Optional[int]=None,
+                 lazy_paths=False, route_stability=None, edge_cost=None,
+                 noise_estimator=None, unreachable_after: Optional[int]=None,
+                 unreachable_probe_interval: Optional[int]=None,
+                 max_concurrent_requests: Optional[int]=None):
+
+        super().__init__(network, 0, 0, ack_timeout=ack_timeout,
+                         max_retransmissions=max_retransmissions)
 
         self.node_graph = nx.DiGraph()
         self.sent_messagges = []
         self.on_message_received = on_message_received
         self._sptree: nx.DiGraph = None
         self._shortest_paths: Dict[NodeDataT, List[NodeDataT]] = None
-        self._send_store = simpy.Store(self.env)
+        self._send_store = SendQueue(self.env, queue_capacity, queue_policy,
+                                     per_destination_limit,
+                                     self._message_discarded)
         self._answer_pending = None
         self._node_manager = NodeDataManager()
         self._token_it = itertools.cycle(range(1 << Packet.TOKEN_BIT_SIZE))
+        self._noise_refresh_needed = set()
+        self.metrics = TransactionMetrics()
+
+        # If set, the messages queued for the same slave are sent in a single
+        # request, and a message waits at most coalescing_delay for others.
+        self.coalescing_delay = coalescing_delay
+
+        # If set, the longest answer of a slave to a single message: only as
+        # many messages are coalesced as their answers fit in the response.
+        # Otherwise the slave answers only the first messages, and the others
+        # complete with MessageOutcome.answer_too_long.
+        self.max_answer_length = max_answer_length
+
+        # Chooses the next message to send among the queued ones (see
+        # protocol.scheduling). If None, they are sent in arrival order.
+        self.scheduling_policy = scheduling_policy
+
+        # If set, the shortest paths are computed only towards the nodes
+        # which messages are sent to, and recomputed only when a change of
+        # the node graph can affect them (see utils.graph.LazyShortestPaths).
+        self.lazy_paths = lazy_paths
+
+        # If set, a RouteStability which keeps the nodes on their current
+        # parent unless a better one is worth the readdressing.
+        self.route_stability = route_stability
+
+        # If set, the cost of an edge as a function of its noise (see
+        # protocol.edge_costs). If None, the paths minimize the noise.
+        self.edge_cost = edge_cost
+
+        # If set, a NoiseEstimator (see protocol.noise_estimation) which
+        # merges the noise tables of the slaves into the node graph, in place
+        # of the fixed moving average.
+        self.noise_estimator = noise_estimator
+
+        # If set, a node is marked unreachable after this many consecutive
+        # requests to it have timed out (see mark_unreachable).
+        self.unreachable_after = unreachable_after
+
+        # If set, an unreachable node is probed this long after being marked,
+        # and restored if it answers (see mark_unreachable). The probe keeps
+        # the simulation running while the node doesn't answer.
+        self.unreachable_probe_interval = unreachable_probe_interval
+        self.unreachable_nodes: Dict[int, List[Tuple[int, dict]]] = {}
+        self._consecutive_timeouts = collections.Counter()
+        self._removed_nodes = set()
+        self._initial_noise_value = 0.5
+
+        # Triggered at the end of the discovery, if the master is
+        # initialized by discover.
+        self._discovered: Optional[simpy.Event] = None
+
+        # The depth of the segment of every gateway, by its static address
+        # (see add_segment).
+        self.segments: Dict[int, int] = {}
+
+        # If set, up to this many requests whose paths don't interfere are
+        # in progress at the same time (see _run_concurrently). If None,
+        # every request waits for the answer to the previous one.
+        self.max_concurrent_requests = max_concurrent_requests
+        self._transactions: Dict[int, Transaction] = {}
+        self._dispatch_blocked = False
+        self._dispatch_retry_time = None
+
+        # The shortest and longest delays between a request and its answer,
+        # and the longest transmission of an answer, observed for every
+        # number of hops; and the longest time the request and its
+        # forwarding by the first node keep the master's neighbors busy.
+        self._answer_delays: Dict[int, Tuple[float, float, float]] = {}
+        self._request_phase = 0
+
+        # The buses every node is attached to, by its static address, if the
+        # master is initialized from a network with buses.
+        self._buses: Dict[int, frozenset] = {}
+
+        if lazy_paths and route_stability is not None:
+            raise ValueError('route_stability requires the full computation '
+                             'of the shortest paths')
+
+        if max_concurrent_requests is not None:
+            if not 1 <= max_concurrent_requests <= 1 << Packet.TOKEN_BIT_SIZE:
+                raise ValueError('max_concurrent_requests must be between 1 '
+                                 'and the number of tokens')
+
+            # The dispatcher can't stop receiving the answers to wait for
+            # more messages.
+            if coalescing_delay:
+                raise ValueError('max_concurrent_requests requires a zero '
+                                 'coalescing_delay')
 
     def __repr__(self):
         return '<MasterNode>'
 
+    @property
+    def queue_stats(self):
+        return self._send_store.stats
+
+    @property
+    def _path_weight(self):
+        return 'noise' if self.edge_cost is None else 'cost'
+
     def init_from_netgraph(self, netgraph: nx.Graph, initial_noise_value=0.5,
                            **kwargs):
 
+        # Only the nodes connected to the master can be reached. The others
+        # may belong to the segments of gateways, whose static addresses are
+        # local to the segment.
+        if self in netgraph:
+            netgraph = netgraph.subgraph(
+                nx.node_connected_component(netgraph, self)
+            )
+
         bus_graph = any(isinstance(node, Bus) for node in netgraph.nodes_iter())
 
         if bus_graph:
+            rethunder_nodes = [node for node in netgraph.nodes_iter()
+                               if isinstance(node, ReThunderNode)]
+
             addr_graph: nx.Graph = bipartite.projected_graph(
-                netgraph, [node for node in netgraph.nodes_iter()
-                           if isinstance(node, ReThunderNode)]
+                netgraph, rethunder_nodes
             )
+
+            self._buses = {node.static_address:
+                           frozenset(netgraph.neighbors(node))
+                           for node in rethunder_nodes}
         else:
-            addr_graph: nx.Graph = netgraph.copy()
+            # Unlike copy, this doesn't copy the nodes, and with them the
+            # whole simulation.
+            addr_graph: nx.Graph = nx.Graph(netgraph)
+
+        # The order of the nodes and of the edges decides between paths of
+        # equal cost, and mustn't depend on the identity of the objects,
+        # which orders the sets used by networkx.
+        addresses = sorted(node.static_address
+                           for node in addr_graph.nodes_iter())
+        edges = sorted(
+            (*sorted((u.static_address, v.static_address)), data)
+            for u, v, data in addr_graph.edges_iter(data=True)
+        )
 
-        # noinspection PyTypeChecker
-        nx.relabel_nodes(addr_graph, lambda x: x.static_address, False)
+        addr_graph = nx.Graph()
+        addr_graph.add_nodes_from(addresses)
+        addr_graph.add_edges_from(edges)
 
         return self.init_from_static_addr_graph(
             addr_graph, initial_noise_value, **kwargs
@@ -89,8 +301,26 @@ class MasterNode(ReThunderNode):
 
         # noinspection PyTypeChecker
         nx.set_edge_attributes(node_graph, 'noise', initial_noise_value)
+        self._initial_noise_value = initial_noise_value
+
+        if self.edge_cost is not None:
+            # noinspection PyTypeChecker
+            nx.set_edge_attributes(node_graph, 'cost',
+                                   self.edge_cost(initial_noise_value))
 
         self.node_graph = node_graph
+
+        if self.noise_estimator is not None:
+            self.noise_estimator.add_edges(
+                [(u.static_address, v.static_address)
+                 for u, v in node_graph.edges_iter()],
+                initial_noise_value
+            )
+
+        if self.lazy_paths:
+            self._shortest_paths = LazyShortestPaths(node_graph, nodes[0],
+                                                     weight=self._path_weight)
+
         self._update_sptree()
 
         assign_logic_addr = kwargs.get('assign_logic_addr', True)
@@ -103,23 +333,70 @@ class MasterNode(ReThunderNode):
         def assign_logic_address(n: NodeDataT):
             n.logic_address = next(addr_iter)
 
-        preorder_tree_dfs(self._sptree, nodes[0], action=assign_logic_address)
+        # The initial addresses follow the whole tree, even if only part of
+        # it is kept afterwards.
+        sptree = (
+            shortest_paths_tree(nx.shortest_path(node_graph, nodes[0],
+                                                 weight=self._path_weight))
+            if self.lazy_paths else self._sptree
+        )
+
+        preorder_tree_dfs(sptree, nodes[0], action=assign_logic_address)
 
     def _update_noise_table(self, packet: Packet):
         super()._update_noise_table(packet)
-        self._update_node_graph_from_table(self._node_manager[0],
-                                           self.noise_table)
+
+        if not isinstance(packet, PacketWithSource):
+            return
+
+        # Only the entry of the sender has changed: the rest of the table
+        # has already been merged in the node graph.
+        source = packet.source_static
+        self._update_node_graph_from_table(
+            self._node_manager[0],
+            NoiseReport({source: self.noise_table[source]}, full=False)
+        )
+
+        # During the discovery the neighbors probing theirs are overheard
+        # often: the tree is updated once the nodes they find are added.
+        if self._discovered is not None and not self._discovered.triggered:
+            return
+
         self._update_sptree()
         self._readdress_nodes()
 
     def _update_sptree(self):
         nodes = self._node_manager
+        old_sptree = self._sptree
 
-        self._shortest_paths = shortest_paths = nx.shortest_path(
-            self.node_graph, nodes[0], weight='noise'
-        )
+        if self.lazy_paths:
+            self._sptree = self._shortest_paths.tree()
+
+        elif self.route_stability is not None and old_sptree is not None:
+            parents = self.route_stability.stable_parents(
+                self.node_graph, nodes[0], old_sptree, self.env.now,
+                weight=self._path_weight
+            )
+
+            self._shortest_paths = shortest_paths = {
+                node: path_from_parents(parents, node) for node in parents
+            }
+
+            self._sptree = shortest_paths_tree(shortest_paths)
 
-        self._sptree = shortest_paths_tree(shortest_paths)
+        else:
+            self._shortest_paths = shortest_paths = nx.shortest_path(
+                self.node_graph, nodes[0], weight=self._path_weight
+            )
+
+            self._sptree = shortest_paths_tree(shortest_paths)
+
+        if old_sptree is not None:
+            # Nodes which were already in the tree and changed parent.
+            self.metrics.tree_updated(sum(
+                1 for father, node in self._sptree.edges_iter()
+                if node in old_sptree and not old_sptree.has_edge(father, node)
+            ))
 
     def _readdress_nodes(self):
 
@@ -130,10 +407,18 @@ class MasterNode(ReThunderNode):
 
         previous_node_addr = 0
 
+        def swap(node, other):
+            node.swap_logic_address(other)
+            self.metrics.address_swaps += 1
+
         # Addresses, not nodes, need to be iterated, because the address
         # associated with a node changes during the execution of the algorithm.
 
-        for logic_addr in nodes.logic_addresses_view()[1:]:
+        # The tree may cover only some of the nodes (see lazy_paths).
+        logic_addresses = sorted(node.logic_address for node in sptree
+                                 if node != nodes[0])
+
+        for logic_addr in logic_addresses:
 
             node = nodes.from_logic_address(logic_addr)
             previous_node = nodes.from_logic_address(previous_node_addr)
@@ -144,7 +429,7 @@ class MasterNode(ReThunderNode):
                 father, = sptree.predecessors(node)
 
                 if father.logic_address > node.logic_address:
-                    node.swap_logic_address(father)
+                    swap(node, father)
                     node = father
                 else:
                     break
@@ -157,7 +442,7 @@ class MasterNode(ReThunderNode):
                                key=lambda x: x.logic_address, default=None)
 
             if greatest_son is not None:
-                node.swap_logic_address(greatest_son)
+                swap(node, greatest_son)
                 continue
 
             ancestor_of_previous, = sptree.predecessors(previous_node)
@@ -169,252 +454,1810 @@ class MasterNode(ReThunderNode):
                                    key=lambda x: x.logic_address)
 
                 if greatest_son.logic_address > node.logic_address:
-                    node.swap_logic_address(greatest_son)
+                    swap(node, greatest_son)
                     break
 
                 ancestor_of_previous, = sptree.predecessors(
                     ancestor_of_previous
                 )
 
-    def send_message(self, message, message_length, dest_static_addr):
-        self._send_store.put((message, message_length, dest_static_addr))
+    def send_message(self, message, message_length, dest_static_addr,
+                     priority=0) -> simpy.Event:
+        """
+        Mette in coda un messaggio per uno slave.
+
+        :return: Un evento che scatta con un MessageResult quando arriva la
+        risposta o scade il tempo per riceverla.
+        """
+
+        completion, _ = self._enqueue_message(message, message_length,
+                                              dest_static_addr, priority)
+        return completion
 
     @simpy_process
-    def run_proc(self):
+    def put_message(self, message, message_length, dest_static_addr,
+                    priority=0):
+        """
+        Come send_message, ma se la coda è piena e la sua politica è
+        QueuePolicy.block il processo termina solo quando il messaggio entra
+        nella coda. Permette così a chi genera il traffico di rallentare.
+
+        :return: Un processo il cui valore è l'evento restituito da
+        send_message.
+        """
+
+        completion, admission = self._enqueue_message(
+            message, message_length, dest_static_addr, priority
+        )
 
-        if self._sptree is None:
-            raise ValueError(f"{self} must be initialized before it's started.")
+        yield admission
+        return completion
 
-        send_ev = None
+    def _enqueue_message(self, message, message_length, dest_static_addr,
+                         priority):
 
-        logger.info(f"{self} started.")
+        completion = self.env.event()
 
-        while True:
+        now = self.env.now
+        admission = self._send_store.put(SendRequest(
+            message, message_length, dest_static_addr, now, priority,
+            (completion,), (now,)
+        ))
 
-            send_ev = send_ev or self._send_store.get()
-            recv_ev = self._receive_packet_ev()
+        return completion, admission
 
-            cond_value = yield send_ev | recv_ev
+    def _message_discarded(self, request, policy: QueuePolicy):
 
-            if recv_ev in cond_value:
-                self._handle_received(recv_ev.value)
+        outcome = (MessageOutcome.rejected if policy is QueuePolicy.reject
+                   else MessageOutcome.dropped)
 
-            elif send_ev in cond_value:
-                self._answer_pending = yield from self._handle_send_request(
-                    send_ev.value
-                )
-                yield from self._wait_for_answer()
-                send_ev = None
+        logger.info(f"{self} discarded a message for "
+                    f"{getattr(request, 'dest_static_addr', None)} "
+                    f"({policy.name})")
 
-    def _handle_send_request(self, msg_data):
+        self._fail_request(request, outcome)
 
-        msg, msg_len, dest_addr = msg_data
+    def _fail_request(self, request, outcome: MessageOutcome):
 
-        try:
-            dest = self._node_manager[dest_addr]
-        except KeyError:
-            raise ValueError(f"{self} is not aware of a node with address "
-                             f"{dest_addr}")
+        for completion, enqueue_time in zip(
+                getattr(request, 'completions', ()),
+                getattr(request, 'enqueue_times', ())):
 
-        path_to_dest = self._shortest_paths[dest]
+            if completion is not None:
+                completion.succeed(MessageResult(
+                    outcome, None, 0, None, self.env.now - enqueue_time, 0
+                ))
 
-        packet = self._make_request_packet(msg, msg_len, path_to_dest)
+    def send_many(self, messages) -> List[simpy.Event]:
+        """
+        Mette in coda più messaggi con un'unica chiamata.
 
-        self.sent_messagges.append(msg)
-        logger.info(f"Master sends request with token {packet.token}")
+        :param messages: Un iterabile di tuple (messaggio, lunghezza,
+        indirizzo statico) o (messaggio, lunghezza, indirizzo statico,
+        priorità).
+        :return: Un evento per ogni messaggio, come quello restituito da
+        send_message.
+        """
 
-        yield self._transmit_process(packet, packet.number_of_frames())
+        messages = list(messages)
+        nodes = self._node_manager
 
-        estimated_rtt = (
-            len(path_to_dest) *
-            make_transmission_delay(self._transmission_speed,
-                                    packet.number_of_frames())
-            + 50
-        ) * 5
+        # Unknown destinations are reported to the caller, instead of
+        # stopping the master when their turn comes.
+        for _, _, dest_addr, *_ in messages:
+            if isinstance(dest_addr, SegmentAddress):
+                if dest_addr.segment not in self.segments:
+                    raise ValueError(f"{self} is not aware of a segment with "
+                                     f"gateway {dest_addr.segment}")
+                continue
 
-        return AnswerPendingRecord(
-            packet.token, path_to_dest, packet.new_logic_addresses,
-            self.env.now, estimated_rtt
-        )
+            try:
+                nodes[dest_addr]
+            except KeyError:
+                raise ValueError(f"{self} is not aware of a node with "
+                                 f"address {dest_addr}")
+
+        return [self.send_message(*message) for message in messages]
+
+    def send_multicast(self, message, message_length, dest_static_addrs,
+                       priority=0):
+        """
+        Invia lo stesso messaggio a più slave con un'unica richiesta, che
+        percorre l'albero dei cammini minimi dividendosi nei punti di
+        diramazione. Le risposte dei destinatari risalgono l'albero
+        aggregate, e ognuna viene passata a on_message_received.
+
+        :param message: Il messaggio da inviare.
+        :param message_length: La lunghezza del messaggio.
+        :param dest_static_addrs: Gli indirizzi statici dei destinatari, che
+        non possono appartenere ai segmenti dei gateway.
+        :param priority: La priorità della richiesta, usata da
+        PriorityAgingPolicy.
+        """
+
+        if any(isinstance(addr, SegmentAddress) for addr in dest_static_addrs):
+            raise ValueError('Multicast requests cannot reach the segments '
+                             'of the gateways')
+
+        self._send_store.put(MulticastSendRequest(
+            message, message_length, tuple(dest_static_addrs), self.env.now,
+            priority
+        ))
+
+    # Cambiamenti della topologia.
+
+    def add_node(self, static_addr: int, neighbors, noise=None):
+        """
+        Aggiunge uno slave alla rete, senza reinizializzare il master. Il
+        nodo riceve un indirizzo logico libero, che viene poi spostato nella
+        posizione giusta dal riassegnamento degli indirizzi.
+
+        :param static_addr: L'indirizzo statico del nuovo nodo.
+        :param neighbors: Gli indirizzi statici dei nodi che lo sentono.
+        :param noise: Il rumore iniziale dei collegamenti, o None per usare
+        quello dell'inizializzazione.
+        """
 
-    def _wait_for_answer(self):
-        pending = self._answer_pending
-        to = self.env.timeout(pending.expiry_delay)
-        recv_ev = None
+        nodes = self._node_manager
+        neighbors = [nodes[addr] for addr in neighbors]
+        node = self._create_node(static_addr)
 
-        while True:
-            recv_ev = recv_ev or self._receive_packet_ev()
-            cond_value = yield recv_ev | to
+        for neighbor in neighbors:
+            self._add_edge(node, neighbor, noise)
 
-            if to in cond_value:
-                logger.info(f"Timeout for answer with token {pending.token}")
-                self._unset_ambiguous_addresses(pending.new_addrs_table)
-                break
-            elif recv_ev in cond_value:
-                self._handle_received(recv_ev.value)
+        self._topology_changed()
 
-                if self._waiting_for_answer():
-                    recv_ev = None
-                else:
-                    break
+    def remove_node(self, static_addr: int):
+        """
+        Rimuove uno slave che ha lasciato la rete.
+        """
 
-    @singledispatchmethod
-    def _handle_received(self, _):
-        logger.error(f'{self} received something unsupported.')
+        if static_addr == self.static_address:
+            raise ValueError(f"{self} can't remove itself")
 
-    @_handle_received.register(Packet)
-    def _(self, packet):
-        logger.warning(f'{self} received {packet}, which cannot be handled.')
+        nodes = self._node_manager
+        node = nodes[static_addr]
 
-    @_handle_received.register(RequestPacket)
-    def _(self, _):
-        logger.info(f'{self} received a RequestPacket.')
+        self.unreachable_nodes.pop(static_addr, None)
+        self._detach_node(node)
 
-    @_handle_received.register(ResponsePacket)
-    def _(self, packet):
+        # The estimator also follows the edges reported by the neighbors
+        # while the node was unreachable.
+        if self.noise_estimator is not None:
+            self.noise_estimator.remove_node(static_addr)
 
-        if packet.next_hop != self.static_address:
+        # The noise tables of its neighbors may still report the node, which
+        # is then ignored instead of joining again.
+        self._removed_nodes.add(static_addr)
+
+        del nodes[static_addr]
+        self._consecutive_timeouts.pop(static_addr, None)
+        self._noise_refresh_needed.discard(static_addr)
+        self._topology_changed()
+
+    def add_edge(self, addr1: int, addr2: int, noise=None):
+        """
+        Aggiunge un collegamento tra due nodi.
+        """
+
+        nodes = self._node_manager
+        self._add_edge(nodes[addr1], nodes[addr2], noise)
+        self._topology_changed()
+
+    def remove_edge(self, addr1: int, addr2: int):
+        """
+        Rimuove un collegamento guasto tra due nodi.
+        """
+
+        nodes = self._node_manager
+        self._remove_edge(nodes[addr1], nodes[addr2])
+        self._topology_changed()
+
+    def mark_unreachable(self, static_addr: int):
+        """
+        Esclude un nodo dai cammini, conservandone l'indirizzo logico e i
+        collegamenti. I messaggi per il nodo terminano subito con esito
+        MessageOutcome.unreachable, finché il nodo non torna nei cammini.
+
+        Il nodo viene ripristinato da restore_node, da un proprio report o da
+        un report differenziale di un vicino che lo riporta (il vicino lo ha
+        sentito trasmettere dal report precedente). Se è impostato
+        `unreachable_probe_interval`, il nodo viene inoltre ripristinato in
+        prova dopo tale intervallo e gli viene inviata una richiesta senza
+        messaggio: se non risponde torna irraggiungibile, e viene sondato di
+        nuovo dopo lo stesso intervallo.
+        """
+
+        if static_addr in self.unreachable_nodes:
             return
 
-        pending = self._answer_pending
+        logger.warning(f"{self} marks {static_addr} as unreachable")
 
-        tok = None if pending is None else pending.token
+        node = self._node_manager[static_addr]
+        self.unreachable_nodes[static_addr] = [
+            (neighbor.static_address, dict(data))
+            for neighbor, data in self.node_graph[node].items()
+        ]
 
-        if tok != packet.token:
-            logger.warning(
-                f'{self} has received an answer with token '
-                f'{packet.token}. Current token is {tok}, ignoring'
+        self._detach_node(node)
+        self._topology_changed()
+
+        if self.unreachable_probe_interval is not None:
+            self._probe_unreachable(static_addr)
+
+    def restore_node(self, static_addr: int):
+        """
+        Riporta nei cammini un nodo segnato come irraggiungibile.
+        """
+        self._restore_node(static_addr)
+        self._topology_changed()
+
+    @simpy_process
+    def _probe_unreachable(self, static_addr):
+
+        yield self.env.timeout(self.unreachable_probe_interval)
+
+        # The node may have been restored or removed meanwhile.
+        if static_addr not in self.unreachable_nodes:
+            return
+
+        logger.info(f"{self} probes the unreachable node {static_addr}")
+        self.restore_node(static_addr)
+
+        result = yield self.send_message(None, 0, static_addr)
+
+        if (result.outcome is not MessageOutcome.answered and
+                static_addr in self._node_manager):
+            self.mark_unreachable(static_addr)
+
+    def _restore_node(self, static_addr):
+
+        logger.info(f"{self} restores {static_addr}")
+
+        nodes = self._node_manager
+        node = nodes[static_addr]
+        self._consecutive_timeouts.pop(static_addr, None)
+
+        for neighbor_addr, data in self.unreachable_nodes.pop(static_addr):
+            try:
+                neighbor = nodes[neighbor_addr]
+            except KeyError:
+                continue
+
+            # The neighbor may be unreachable too, or removed meanwhile.
+            if neighbor_addr not in self.unreachable_nodes:
+                self._add_edge(node, neighbor, data['noise'])
+
+    def _create_node(self, static_addr):
+
+        nodes = self._node_manager
+
+        node = nodes.create(static_addr)
+        node.logic_address = nodes.logic_addresses_view()[-1] + 1
+        self.node_graph.add_node(node)
+        self._removed_nodes.discard(static_addr)
+
+        return node
+
+    def _add_edge(self, node1, node2, noise=None):
+
+        if noise is None:
+            noise = self._initial_noise_value
+
+        graph = self.node_graph
+        edge = graph.get_edge_data(node1, node2)
+        old_weight = None if edge is None else edge[self._path_weight]
+
+        graph.add_edge(node1, node2, dict(noise=noise))
+        edge = graph[node1][node2]
+
+        if old_weight is None:
+            link_heard(node1, node2)
+
+        if self.edge_cost is not None:
+            edge['cost'] = self.edge_cost(noise)
+
+        if self.noise_estimator is not None:
+            self.noise_estimator.set_edges(
+                [(node1.static_address, node2.static_address)], noise
+            )
+
+        if self.lazy_paths:
+            self._shortest_paths.edge_changed(node1, node2, old_weight,
+                                              edge[self._path_weight])
+
+    def _remove_edge(self, node1, node2):
+
+        self.node_graph.remove_edge(node1, node2)
+
+        if self.noise_estimator is not None:
+            self.noise_estimator.remove_edges(
+                [(node1.static_address, node2.static_address)]
             )
+
+        if self.lazy_paths:
+            self._shortest_paths.edge_changed(node1, node2, 0, float('inf'))
+
+    def _detach_node(self, node):
+
+        if node not in self.node_graph:
             return
 
-        logger.debug(f"{self} received answer to token {packet.token}")
+        if self.noise_estimator is not None:
+            self.noise_estimator.remove_edges(
+                [(node.static_address, neighbor.static_address)
+                 for neighbor in self.node_graph[node]]
+            )
+
+        self.node_graph.remove_node(node)
+
+        if self.lazy_paths:
+            self._shortest_paths.node_removed(node)
 
-        self._update_node_graph_from_packet(packet)
+    def _topology_changed(self):
         self._update_sptree()
         self._readdress_nodes()
 
-        msg_callback = self.on_message_received or (lambda x, y, z: None)
-        msg_callback(self, packet.payload, packet.payload_length)
+    def _track_reachability(self, dest_addr, answered):
 
-        self._answer_pending = None
+        if answered:
+            self._consecutive_timeouts.pop(dest_addr, None)
+            return
 
-    def _make_request_packet(self, message, length, path_to_dest) \
-            -> RequestPacket:
+        timeouts = self._consecutive_timeouts
+        timeouts[dest_addr] += 1
 
-        node_graph = self.node_graph
+        if (self.unreachable_after is not None and
+                timeouts[dest_addr] >= self.unreachable_after and
+                dest_addr in self._node_manager):
+            self.mark_unreachable(dest_addr)
 
-        packet = RequestPacket()
-        packet.payload = message
-        packet.payload_length = length
+    # Segmenti.
 
-        destination_addr = path_to_dest[-1].logic_address
+    def add_segment(self, gateway_addr: int, depth: int):
+        """
+        Registra il segmento di un gateway (vedi protocol.gateway_node). I
+        nodi del segmento hanno indirizzi statici e logici locali, assegnati
+        dal gateway, e non compaiono nel grafo del master: i messaggi per
+        loro vengono inviati con indirizzi SegmentAddress(gateway_addr,
+        indirizzo statico locale), e il gateway li inoltra nel segmento.
 
-        path: List[Tuple[AddressType, int]] = []
-        new_addrs: Dict[int, int] = {}
+        :param gateway_addr: L'indirizzo statico del gateway.
+        :param depth: La profondità dell'albero dei cammini minimi del
+        segmento, da cui dipende il tempo di attesa delle risposte.
+        """
 
-        next_static_addressing_used = True
+        if gateway_addr not in self._node_manager:
+            raise ValueError(f"{self} is not aware of a node with address "
+                             f"{gateway_addr}")
 
-        for next_node, node in zip(path_to_dest[::-1], path_to_dest[-2::-1]):
+        self.segments[gateway_addr] = depth
 
-            static_addressing_used = next_static_addressing_used
-            next_static_addressing_used = False
+    def _segment_delay(self, gateway_addr, packet: RequestPacket):
+        """
+        Stima il tempo impiegato dal gateway per ottenere la risposta dal
+        proprio segmento, prima di rispondere al master.
+        """
 
-            if next_node.current_logic_address is None:
+        hops = self.segments[gateway_addr] + 1
 
-                new_addrs[next_node.static_address] = next_node.logic_address
-                path.append((AddressType.static, next_node.static_address))
+        # The request in the segment has its own path and new addresses.
+        frames = packet.number_of_frames() + 4 * hops
 
-                destination_addr = next_node.logic_address
-                next_static_addressing_used = True
+        # The messages of a coalesced payload may be sent one at a time.
+        transactions = (len(packet.payload)
+                        if isinstance(packet.payload, CoalescedPayload) else 1)
 
-                continue
+        return transactions * self._estimated_rtt(hops, frames)
 
-            neighbors = node_graph.neighbors(node)
+    # Scoperta della rete.
 
-            max_address = max(c.current_logic_address for c in neighbors
-                              if c.current_logic_address is not None
-                              and c.current_logic_address <= destination_addr)
+    def discover(self, initial_noise_value=0.5, max_nodes_per_probe=64) \
+            -> simpy.Process:
+        """
+        Inizializza il master scoprendo la rete, invece che da un grafo
+        noto. Gli slave senza indirizzo vengono configurati un livello
+        dell'albero alla volta: prima il master, poi ogni nodo scoperto al
+        livello precedente, su richiesta del master, assegna gli indirizzi ai
+        propri vicini ancora senza indirizzo (vedi
+        ReThunderNode._probe_neighbors).
 
-            wrong_addressing = max_address != next_node.current_logic_address
+        Il master conosce inizialmente solo i collegamenti tra ogni nodo e
+        quello che lo ha scoperto; gli altri vengono aggiunti dalle tabelle
+        del rumore.
 
-            candidates = [
-                c for c in neighbors
-                if c.current_logic_address == next_node.current_logic_address
-            ]
+        :param initial_noise_value: Il rumore iniziale dei collegamenti.
+        :param max_nodes_per_probe: Il numero massimo di nodi configurati da
+        ogni richiesta a un nodo; se vengono tutti usati, la richiesta viene
+        ripetuta.
+        :return: Il processo della scoperta, il cui valore è un
+        DiscoveryReport. run_proc attende che termini.
+        """
 
-            ambiguous_addressing = len(candidates) > 1
+        if self._sptree is not None:
+            raise ValueError(f"{self} is already initialized")
 
-            if ambiguous_addressing:
-                path.append((AddressType.static, next_node.static_address))
+        self._discovered = self.env.event()
+        return self._discover_proc(initial_noise_value, max_nodes_per_probe)
 
-                destination_addr = next_node.current_logic_address
-                next_static_addressing_used = True
+    @simpy_process
+    def _discover_proc(self, initial_noise_value, max_nodes_per_probe):
 
-            elif wrong_addressing or static_addressing_used:
-                destination_addr = next_node.current_logic_address
-                path.append((AddressType.logic, destination_addr))
+        start_time = self.env.now
+        logger.info(f"{self} starts the discovery")
 
-            if next_node.logic_address != next_node.current_logic_address:
-                new_addrs[next_node.static_address] = next_node.logic_address
+        addr_graph = nx.Graph()
+        addr_graph.add_node(self.static_address)
+        self.init_from_static_addr_graph(addr_graph, initial_noise_value)
 
-        packet = RequestPacket()
-        packet.token = next(self._token_it)
+        nodes = self._node_manager
+        master = nodes[self.static_address]
 
-        packet.source_static = self.static_address
-        packet.source_logic = self.logic_address
+        next_addr = self.static_address + 1
+        frontier = [master]
+        levels = 0
+        probe_requests = 0
+        failed_probers = []
 
-        dest_type, dest = path.pop()
+        while frontier and next_addr <= NodeDataManager.MAX_ADDRESS:
+            next_frontier = []
 
-        packet.destination = dest
-        packet.code_is_addressing_static = dest_type is AddressType.static
+            for prober in frontier:
 
-        next_hop = path_to_dest[1]
-        packet.next_hop = next_hop.static_address
+                while next_addr <= NodeDataManager.MAX_ADDRESS:
+                    max_nodes = min(max_nodes_per_probe,
+                                    NodeDataManager.MAX_ADDRESS - next_addr + 1)
 
-        packet.payload = message
-        packet.payload_length = length
+                    if prober is master:
+                        found = yield from self._probe_neighbors(next_addr,
+                                                                 max_nodes)
+                    else:
+                        probe_requests += 1
+                        found = yield from self._request_probe(
+                            prober, next_addr, max_nodes
+                        )
 
-        packet.path = path
-        packet.new_logic_addresses = new_addrs
+                        if found is None:
+                            logger.warning(f"{self} received no answer from "
+                                           f"the prober {prober}")
+                            failed_probers.append(prober.static_address)
+                            break
 
-        return packet
+                    for _, static_addr in found:
+                        # The node may have already been found in a noise
+                        # table.
+                        node = (nodes.get(static_addr) or
+                                self._create_node(static_addr))
+                        self._add_edge(prober, node)
+                        next_frontier.append(node)
 
-    def _unset_ambiguous_addresses(self, new_addrs_table):
+                    next_addr += len(found)
 
-        nodes = self._node_manager
+                    if found:
+                        self._topology_changed()
 
-        for static_addr in new_addrs_table.keys():
-            nodes[static_addr].current_logic_address = None
+                    if len(found) < max_nodes:
+                        break
 
-    def _update_node_graph_from_packet(self, packet: ResponsePacket):
+            if next_frontier:
+                levels += 1
 
-        nodes = self._node_manager
-        new_addresses = self._answer_pending.new_addrs_table
-        message_path = self._answer_pending.path
+            frontier = next_frontier
 
-        for static_addr, new_logic_addr in new_addresses.items():
-            nodes[static_addr].current_logic_address = new_logic_addr
+        if next_addr > NodeDataManager.MAX_ADDRESS:
+            logger.warning(f"{self} has run out of static addresses")
 
-        for source_node, noise_table in zip(message_path[1:],
-                                            reversed(packet.noise_tables)):
+        report = DiscoveryReport(
+            len(nodes) - 1, levels, start_time, self.env.now, probe_requests,
+            failed_probers
+        )
 
-            self._update_node_graph_from_table(source_node, noise_table)
+        logger.info(f"{self} has discovered {report.nodes} nodes")
+        self._discovered.succeed(report)
+        return report
 
-    def _update_node_graph_from_table(self, source, table):
+    def _request_probe(self, prober: NodeDataT, first_static_address,
+                       max_nodes):
+        """
+        Chiede a un nodo di assegnare gli indirizzi ai propri vicini.
 
-        graph = self.node_graph
-        node_manager = self._node_manager
+        :return: Le coppie (indirizzo fisico, indirizzo statico) dei nodi
+        configurati, o None se il nodo non ha risposto.
+        """
 
-        for dest_addr, new_noise in table.items():
-            dest = node_manager[dest_addr]
-            try:
-                old_noise = graph[source][dest]['noise']
-                graph[source][dest]['noise'] = (
-                    old_noise * PAST_NOISE_HISTORY_WEIGHT +
-                    new_noise * (1 - PAST_NOISE_HISTORY_WEIGHT)
-                )
-            except KeyError:
-                graph.add_edge(source, dest, dict(noise=new_noise))
+        path = self._shortest_paths[prober]
+
+        packet = self._make_request_packet(
+            (first_static_address, max_nodes), PROBE_COMMAND_LENGTH, path
+        )
+        packet.code_is_node_init = True
+
+        completion = self.env.event()
+
+        pending = yield from self._send_request(
+            packet, path, dict(packet.new_logic_addresses), len(path),
+            self.env.now, completions=(completion,)
+        )
+
+        # The prober answers after probing its neighbors.
+        self._answer_pending = pending._replace(
+            expiry_delay=pending.expiry_delay +
+            self._probe_duration(max_nodes)
+        )
+
+        yield from self._wait_for_answer()
+
+        result = completion.value
+        return (result.payload if result.outcome is MessageOutcome.answered
+                else None)
+
+    @simpy_process
+    def run_proc(self):
+
+        if self._discovered is not None:
+            yield self._discovered
+
+        if self._sptree is None:
+            raise ValueError(f"{self} must be initialized before it's started.")
+
+        send_ev = None
+
+        logger.info(f"{self} started.")
+
+        if self.max_concurrent_requests is not None:
+            yield from self._run_concurrently()
+
+        while True:
+
+            send_ev = send_ev or self._send_store.get()
+            recv_ev = self._receive_packet_ev()
+
+            cond_value = yield send_ev | recv_ev
+
+            if recv_ev in cond_value:
+                self._handle_received(recv_ev.value)
+
+            elif send_ev in cond_value:
+
+                msg_data = self._select_next_send(send_ev.value)
+
+                if isinstance(msg_data, MulticastSendRequest):
+                    yield from self._handle_multicast_request(msg_data)
+                else:
+                    if self.coalescing_delay is not None:
+                        msg_data = yield from self._coalesce_messages(msg_data)
+
+                    self._answer_pending = yield from (
+                        self._handle_send_request(msg_data)
+                    )
+
+                    if self._answer_pending is not None:
+                        answered = yield from self._wait_for_answer()
+                        self._track_reachability(msg_data.dest_static_addr,
+                                                 answered)
+
+                send_ev = None
+
+    def _select_next_send(self, msg_data):
+        """
+        Sceglie, tramite la politica di scheduling, il messaggio da inviare
+        tra quello appena tolto dalla coda e quelli ancora in attesa. Se non
+        è il primo, questo viene rimesso in testa alla coda.
+        """
+
+        queue = self._send_store
+
+        if self.scheduling_policy is None or not queue:
+            return msg_data
+
+        pending = [msg_data]
+        pending.extend(queue.items)
+
+        chosen = pending[
+            self.scheduling_policy.select(self, pending, self.env.now)
+        ]
+
+        if chosen is not msg_data:
+            queue.swap_front(msg_data, chosen)
+
+        return chosen
+
+    # Invio concorrente.
+
+    def _run_concurrently(self):
+        """
+        Invia le richieste senza attendere le risposte alle precedenti,
+        finché i loro percorsi non interferiscono con quelli delle
+        transazioni in corso e non viene raggiunto max_concurrent_requests.
+        Ogni transazione in corso ha il proprio token.
+
+        Due richieste interferiscono se un nodo del percorso di una, escluso
+        il master, condivide un bus o un collegamento con un nodo del
+        percorso dell'altra, perché le loro trasmissioni potrebbero
+        collidere. Il master partecipa a tutte le transazioni, ma solo con la
+        trasmissione della richiesta e la ricezione della risposta: invia una
+        richiesta solo quando la precedente ha lasciato i suoi vicini (vedi
+        _send_transaction), e solo se né questa né la sua risposta si
+        sovrappongono alle risposte attese per le transazioni in corso (vedi
+        _transaction_windows). Altrimenti le risposte, trasmesse da nodi
+        che non si sentono tra loro, collidono al master.
+        """
+
+        env = self.env
+        transactions = self._transactions
+        send_ev = None
+        recv_ev = None
+
+        while True:
+
+            sending = [transaction.sending
+                       for transaction in transactions.values()
+                       if not transaction.sending.triggered]
+
+            if (send_ev is None and not sending and
+                    not self._dispatch_blocked and
+                    len(transactions) < self.max_concurrent_requests):
+                send_ev = self._send_store.get()
+
+            recv_ev = recv_ev or self._receive_packet_ev()
+            events = [recv_ev]
+
+            if send_ev is not None:
+                events.append(send_ev)
+
+            # The request still being sent, and the first answer to expire.
+            events.extend(sending)
+
+            expiry_times = [transaction.pending.expiry_time
+                            for transaction in transactions.values()
+                            if transaction.pending is not None]
+
+            if expiry_times:
+                events.append(env.timeout(max(min(expiry_times) - env.now,
+                                              0)))
+
+            retry_time = self._dispatch_retry_time
+
+            # A message waiting for the answers to the other transactions
+            # can be sent after them.
+            if self._dispatch_blocked and retry_time is not None:
+                events.append(env.timeout(max(retry_time - env.now, 0)))
+
+            yield env.any_of(events)
+
+            if retry_time is not None and retry_time <= env.now:
+                self._dispatch_blocked = False
+                self._dispatch_retry_time = None
+
+            if recv_ev.triggered:
+                self._handle_received(recv_ev.value)
+                recv_ev = None
+
+            self._expire_transactions()
+
+            if send_ev is not None and send_ev.triggered:
+                msg_data = send_ev.value
+                send_ev = None
+
+                yield from self._dispatch_concurrently(msg_data)
+
+                # A multicast request has received the packets meanwhile.
+                recv_ev = None
+
+    def _dispatch_concurrently(self, msg_data):
+
+        transactions = self._transactions
+
+        if isinstance(msg_data, MulticastSendRequest):
+            # A multicast request covers the whole tree, and is sent alone.
+            if transactions:
+                self._send_store.unget(msg_data)
+                self._dispatch_blocked = True
+            else:
+                yield from self._handle_multicast_request(msg_data)
+            return
+
+        msg_data = self._select_concurrent_send(msg_data)
+
+        if msg_data is None:
+            self._dispatch_blocked = True
+            return
+
+        if self.coalescing_delay is not None:
+            msg_data = yield from self._coalesce_messages(msg_data)
+
+        prepared = self._prepare_request(msg_data)
+
+        if prepared is None:
+            return
+
+        packet, path_to_dest = prepared
+        token = packet.token
+        now = self.env.now
+
+        windows = tuple(
+            (now + start, now + end) for start, end in
+            self._transaction_windows(path_to_dest, msg_data.dest_static_addr)
+        )
+
+        transactions[token] = Transaction(
+            self._path_footprint(path_to_dest), windows,
+            msg_data.dest_static_addr,
+            self._send_transaction(token, msg_data, packet, path_to_dest),
+            None
+        )
+
+    @simpy_process
+    def _send_transaction(self, token, msg_data: SendRequest,
+                          packet: RequestPacket, path_to_dest):
+        """
+        Invia la richiesta di una transazione. Se gli ack a livello di
+        collegamento sono attivi, termina solo quando il primo nodo del
+        percorso ne ha confermato la ricezione: fino ad allora una nuova
+        richiesta collide con le ritrasmissioni o con l'inoltro di questa.
+        """
+
+        start_time = self.env.now
+
+        pending = yield from self._send_prepared_request(msg_data, packet,
+                                                         path_to_dest)
+
+        self._transactions[token] = self._transactions[token]._replace(
+            pending=pending
+        )
+
+        waiter = self._ack_waiters.get(token)
+
+        if waiter is not None:
+            acked = waiter.acked
+
+            # The master stops retransmitting after max_retransmissions.
+            yield acked | self.env.timeout(
+                (self.max_retransmissions + 1) * self.ack_timeout
+            )
+
+            if not acked.triggered:
+                return
+
+        # The first node forwards the request right after acknowledging it.
+        forwarding_delay = make_transmission_delay(self._transmission_speed,
+                                                   packet.number_of_frames())
+
+        self._request_phase = max(
+            self._request_phase,
+            self.env.now - start_time + forwarding_delay
+        )
+
+    def _select_concurrent_send(self, msg_data):
+        """
+        Come _select_next_send, ma sceglie solo tra i messaggi che non
+        interferiscono con le transazioni in corso.
+
+        :return: Il messaggio scelto, o None se interferiscono tutti. In
+        questo caso quello tolto dalla coda vi viene rimesso in testa, e se
+        alcuni messaggi attendono solo le risposte delle transazioni in
+        corso _dispatch_retry_time indica quando potranno essere inviati.
+        """
+
+        queue = self._send_store
+        now = self.env.now
+        in_use = set()
+        busy_windows = []
+
+        for transaction in self._transactions.values():
+            in_use.update(transaction.footprint)
+            request_window, (answer_start, answer_end) = transaction.windows
+
+            # A late answer can still arrive until the transaction expires.
+            if answer_end < now:
+                answer_end = math.inf
+
+            busy_windows.append((request_window, (answer_start, answer_end)))
+
+        candidates = []
+        retry_time = math.inf
+
+        for request in itertools.chain((msg_data,), queue.items):
+            if not isinstance(request, SendRequest):
+                continue
+
+            path = self._request_path(request)
+
+            if path is None:
+                # The message fails as soon as it's sent.
+                candidates.append(request)
+                continue
+
+            if not in_use.isdisjoint(self._path_footprint(path)):
+                continue
+
+            start_time = self._earliest_dispatch(
+                self._transaction_windows(path, request.dest_static_addr),
+                busy_windows
+            )
+
+            if start_time <= now:
+                candidates.append(request)
+
+                if self.scheduling_policy is None:
+                    break
+            else:
+                retry_time = min(retry_time, start_time)
+
+        if not candidates:
+            chosen = None
+        elif self.scheduling_policy is None:
+            chosen = candidates[0]
+        else:
+            chosen = candidates[
+                self.scheduling_policy.select(self, candidates, now)
+            ]
+
+        if chosen is None:
+            queue.unget(msg_data)
+
+            if retry_time < math.inf:
+                self._dispatch_retry_time = retry_time
+        elif chosen is not msg_data:
+            queue.swap_front(msg_data, chosen)
+
+        return chosen
+
+    def _request_path(self, request: SendRequest):
+
+        dest_addr = request.dest_static_addr
+
+        # The nodes of a segment are reached through their gateway.
+        dest_addr = getattr(dest_addr, 'segment', dest_addr)
+
+        try:
+            return self._shortest_paths[self._node_manager[dest_addr]]
+        except KeyError:
+            return None
+
+    def _transaction_windows(self, path, dest_addr):
+        """
+        Restituisce gli intervalli, relativi all'invio della richiesta di
+        una transazione, in cui il master e i suoi vicini sono occupati
+        dalla richiesta e in cui il master attende la risposta.
+
+        L'intervallo della risposta è ricavato dai ritardi osservati per i
+        percorsi con lo stesso numero di salti, e comprende la trasmissione
+        della risposta e il suo ack. Finché non ne sono stati osservati, o
+        se la destinazione è nel segmento di un gateway, la risposta può
+        arrivare in qualsiasi momento.
+        """
+
+        request_window = (0, self._request_phase)
+        delays = self._answer_delays.get(len(path) - 1)
+
+        if delays is None or isinstance(dest_addr, SegmentAddress):
+            return request_window, (0, math.inf)
+
+        min_delay, max_delay, answer_delay = delays
+
+        if self.ack_timeout is None:
+            margin = 0
+        else:
+            # An answer can also be delayed by a retransmission.
+            margin = self.ack_timeout + make_transmission_delay(
+                self._transmission_speed, AckPacket().number_of_frames()
+            )
+
+        return request_window, (min_delay - answer_delay - margin,
+                                max_delay + margin)
+
+    def _earliest_dispatch(self, windows, busy_windows):
+        """
+        Restituisce il primo istante, non precedente a quello attuale, in
+        cui può iniziare una transazione con gli intervalli dati (vedi
+        _transaction_windows) senza che la sua richiesta o la sua risposta si
+        sovrappongano alle risposte attese per le transazioni in corso, o la
+        sua risposta alle loro richieste.
+
+        :param busy_windows: Gli intervalli delle transazioni in corso.
+        """
+
+        (request_start, request_end), (answer_start, answer_end) = windows
+
+        # The starting times which make two intervals overlap.
+        forbidden = []
+
+        for (busy_request_start, busy_request_end), \
+                (busy_answer_start, busy_answer_end) in busy_windows:
+            forbidden.append((busy_answer_start - request_end,
+                              busy_answer_end - request_start))
+            forbidden.append((busy_answer_start - answer_end,
+                              busy_answer_end - answer_start))
+            forbidden.append((busy_request_start - answer_end,
+                              busy_request_end - answer_start))
+
+        start_time = self.env.now
+
+        for forbidden_start, forbidden_end in sorted(forbidden):
+            if forbidden_start < start_time < forbidden_end:
+                start_time = forbidden_end
+
+        return start_time
+
+    def _record_answer_delay(self, transaction: Transaction,
+                             packet: ResponsePacket):
+
+        if isinstance(transaction.dest_static_addr, SegmentAddress):
+            return
+
+        pending = transaction.pending
+        hops = len(pending.path) - 1
+        delay = self.env.now - pending.request_time
+        answer_delay = make_transmission_delay(self._transmission_speed,
+                                               packet.number_of_frames())
+
+        min_delay, max_delay, max_answer_delay = self._answer_delays.get(
+            hops, (delay, delay, answer_delay)
+        )
+
+        self._answer_delays[hops] = (min(min_delay, delay),
+                                     max(max_delay, delay),
+                                     max(max_answer_delay, answer_delay))
+
+    def _path_footprint(self, path):
+        """
+        Restituisce i bus, o i collegamenti se la rete non ha bus, su cui
+        trasmettono i nodi di un percorso, escluso il master.
+        """
+
+        footprint = set()
+        buses = self._buses
+
+        for node in path[1:]:
+            node_buses = buses.get(node.static_address)
+
+            if node_buses is None:
+                # Nodes added after the initialization are known only by
+                # their links.
+                footprint.update(frozenset((node, neighbor))
+                                 for neighbor in self.node_graph[node])
+            else:
+                footprint.update(node_buses)
+
+        return footprint
+
+    def _expire_transactions(self):
+
+        now = self.env.now
+
+        for token, transaction in list(self._transactions.items()):
+            pending = transaction.pending
+
+            if pending is not None and pending.expiry_time <= now:
+                self._answer_timed_out(pending)
+                self._end_transaction(token, answered=False)
+
+    def _end_transaction(self, token, answered):
+
+        transaction = self._transactions.pop(token)
+        self._dispatch_blocked = False
+        self._dispatch_retry_time = None
+        self._track_reachability(transaction.dest_static_addr, answered)
+
+    def _next_token(self):
+
+        token = next(self._token_it)
+
+        # The tokens of the transactions in progress are skipped.
+        while token in self._transactions:
+            token = next(self._token_it)
+
+        return token
+
+    def _coalesce_messages(self, msg_data):
+        """
+        Raccoglie i messaggi in coda diretti allo stesso nodo del primo,
+        finché entrano nel payload di una richiesta e, se è dato
+        max_answer_length, le loro risposte in quello della risposta. Se c'è
+        ancora spazio, attende coalescing_delay e raccoglie anche quelli
+        arrivati nel frattempo.
+
+        :param msg_data: Il primo messaggio, tolto dalla coda.
+        :return: Il messaggio da inviare, con un CoalescedPayload se sono
+        stati raccolti più messaggi.
+        """
+
+        # The probes of the unreachable nodes carry no message, and are sent
+        # alone.
+        if msg_data.message is None:
+            return msg_data
+
+        dest_addr = msg_data.dest_static_addr
+
+        messages = CoalescedPayload([(msg_data.message,
+                                      msg_data.message_length)])
+        completions = list(msg_data.completions)
+        enqueue_times = list(msg_data.enqueue_times)
+        queue = self._send_store
+
+        def answers_fit(count):
+            return (self.max_answer_length is None or
+                    count * CoalescedPayload.encoded_length(
+                        self.max_answer_length
+                    ) <= MAX_PAYLOAD_LENGTH)
+
+        def collect():
+            for item in list(queue.items):
+                if (isinstance(item, SendRequest) and
+                        item.dest_static_addr == dest_addr and
+                        item.message is not None and
+                        messages.length + CoalescedPayload.encoded_length(
+                            item.message_length
+                        ) <= MAX_PAYLOAD_LENGTH and
+                        answers_fit(len(messages) + 1)):
+                    queue.remove(item)
+                    messages.append((item.message, item.message_length))
+                    completions.extend(item.completions)
+                    enqueue_times.extend(item.enqueue_times)
+
+        collect()
+
+        if (self.coalescing_delay > 0 and
+                messages.length < MAX_PAYLOAD_LENGTH and
+                answers_fit(len(messages) + 1)):
+            yield self.env.timeout(self.coalescing_delay)
+            collect()
+
+        if len(messages) == 1:
+            return msg_data
+
+        logger.debug(f"{self} coalesced {len(messages)} messages for "
+                     f"{dest_addr}")
+
+        return msg_data._replace(message=messages,
+                                 message_length=messages.length,
+                                 completions=tuple(completions),
+                                 enqueue_times=tuple(enqueue_times))
+
+    def _handle_send_request(self, msg_data: SendRequest):
+
+        prepared = self._prepare_request(msg_data)
+
+        if prepared is None:
+            return None
+
+        return (yield from self._send_prepared_request(msg_data, *prepared))
+
+    def _prepare_request(self, msg_data: SendRequest):
+        """
+        Crea la richiesta per un messaggio, o fa fallire il messaggio se la
+        destinazione non è raggiungibile.
+
+        :return: La richiesta e il percorso fino alla destinazione, o None.
+        """
+
+        msg, msg_len, dest_addr = msg_data[:3]
+        local_addr = None
+
+        # The nodes of a segment are reached through their gateway.
+        if isinstance(dest_addr, SegmentAddress):
+            dest_addr, local_addr = dest_addr
+
+            if dest_addr not in self.segments:
+                raise ValueError(f"{self} is not aware of a segment with "
+                                 f"gateway {dest_addr}")
+
+        try:
+            dest = self._node_manager[dest_addr]
+        except KeyError:
+            # Messages for a removed node may still be in the queue.
+            if dest_addr not in self._removed_nodes:
+                raise ValueError(f"{self} is not aware of a node with "
+                                 f"address {dest_addr}")
+            dest = None
+
+        try:
+            if dest is None or dest_addr in self.unreachable_nodes:
+                raise KeyError(dest_addr)
+
+            path_to_dest = self._shortest_paths[dest]
+        except KeyError:
+            logger.info(f"{self} has no path to {dest_addr}")
+            self._fail_request(msg_data, MessageOutcome.unreachable)
+            return None
+
+        packet = self._make_request_packet(msg, msg_len, path_to_dest)
+        packet.segment_destination = local_addr
+
+        return packet, path_to_dest
+
+    def _send_prepared_request(self, msg_data: SendRequest,
+                               packet: RequestPacket, path_to_dest):
+
+        # The slaves modify the path while forwarding the packet.
+        static_addressing = packet.code_is_addressing_static or any(
+            addr_type is AddressType.static for addr_type, _ in packet.path
+        )
+
+        pending = yield from self._send_request(
+            packet, path_to_dest, dict(packet.new_logic_addresses),
+            len(path_to_dest), msg_data.enqueue_time, static_addressing,
+            msg_data.completions, msg_data.enqueue_times
+        )
+
+        if packet.segment_destination is not None:
+            # The gateway answers after the transaction in its segment.
+            gateway_addr = path_to_dest[-1].static_address
+
+            pending = pending._replace(
+                expiry_delay=pending.expiry_delay +
+                self._segment_delay(gateway_addr, packet)
+            )
+
+        return pending
+
+    def _handle_multicast_request(self, request: MulticastSendRequest):
+
+        # Every subtree of the master is a separate transaction.
+        for subtree in self._make_multicast_trees(request.dest_static_addrs):
+
+            packet = self._make_multicast_packet(
+                request.message, request.message_length, subtree
+            )
+
+            path = [self._node_manager[0]]
+            path.extend(node for node, _, _ in subtree)
+
+            pending = yield from self._send_request(
+                packet, path, dict(packet.new_logic_addresses), 2,
+                request.enqueue_time
+            )
+
+            # Every node of the subtree adds its own request and response to
+            # the wait of its ancestors (see SlaveNode._multicast_timeout).
+            self._answer_pending = pending._replace(
+                expiry_delay=len(subtree) * pending.expiry_delay
+            )
+            yield from self._wait_for_answer()
+
+    def _send_request(self, packet: RequestPacket, path, new_addrs_table,
+                      hops, enqueue_time, static_addressing=False,
+                      completions=(), enqueue_times=None):
+        """
+        Invia una richiesta e crea il record della risposta attesa.
+
+        :param packet: La richiesta da inviare.
+        :param path: I nodi attraversati dalla richiesta, a partire dal
+        master.
+        :param new_addrs_table: I nuovi indirizzi logici assegnati dalla
+        richiesta.
+        :param hops: Il numero di trasmissioni necessarie a ricevere la
+        risposta, da cui dipende il tempo di attesa.
+        :param enqueue_time: L'istante in cui il messaggio è stato messo in
+        coda.
+        :param static_addressing: Se la richiesta usa l'indirizzamento
+        statico per una parte del percorso.
+        :param completions: Gli eventi da far scattare con il risultato di
+        ogni messaggio della richiesta.
+        :param enqueue_times: Gli istanti in cui ogni messaggio è stato messo
+        in coda, se diversi da enqueue_time.
+        """
+
+        if isinstance(packet.payload, CoalescedPayload):
+            self.sent_messagges.extend(msg for msg, _ in packet.payload)
+        else:
+            self.sent_messagges.append(packet.payload)
+
+        logger.info(f"Master sends request with token {packet.token}")
+
+        request_time = self.env.now
+        self.metrics.request_sent(request_time, request_time - enqueue_time,
+                                  static_addressing,
+                                  address_frames=2 * len(new_addrs_table))
+
+        if enqueue_times is None:
+            enqueue_times = (enqueue_time,) * len(completions)
+
+        # The retries of the messages are the retransmissions of this request.
+        self._transaction_retransmissions[packet.token] = 0
+
+        yield self._send_packet(packet)
+
+        frames = packet.number_of_frames()
+
+        # The answers to the coalesced messages may be longer than the request.
+        if (self.max_answer_length is not None and
+                isinstance(packet.payload, CoalescedPayload)):
+            answers_length = (len(packet.payload) *
+                              CoalescedPayload.encoded_length(
+                                  self.max_answer_length
+                              ))
+            frames += max(0, payload_frame_count(
+                packet.payload, answers_length
+            ) - payload_frame_count(packet.payload, packet.payload_length))
+
+        estimated_rtt = self._estimated_rtt(hops, frames)
+
+        return AnswerPendingRecord(
+            packet.token, path, new_addrs_table,
+            self.env.now, estimated_rtt, request_time, enqueue_times,
+            completions
+        )
+
+    def _estimated_rtt(self, hops, frames):
+
+        transmission_delay = make_transmission_delay(
+            self._transmission_speed, frames
+        )
+
+        estimated_rtt = (hops * transmission_delay + 50) * 5
+
+        # Leave time for the retransmissions on every hop.
+        if self.ack_timeout is not None:
+            estimated_rtt += (2 * hops * self.max_retransmissions *
+                              (self.ack_timeout + transmission_delay))
+
+        return estimated_rtt
+
+    def _wait_for_answer(self):
+        """
+        Attende la risposta alla richiesta in corso.
+
+        :return: True se la risposta è arrivata, False se il tempo per
+        riceverla è scaduto.
+        """
+
+        pending = self._answer_pending
+        to = self.env.timeout(pending.expiry_delay)
+        recv_ev = None
+
+        while True:
+            recv_ev = recv_ev or self._receive_packet_ev()
+            cond_value = yield recv_ev | to
+
+            if to in cond_value:
+                self._answer_timed_out(pending)
+                return False
+            elif recv_ev in cond_value:
+                self._handle_received(recv_ev.value)
+
+                if self._waiting_for_answer():
+                    recv_ev = None
+                else:
+                    return self._answer_pending is None
+
+    def _answer_timed_out(self, pending: AnswerPendingRecord):
+
+        logger.info(f"Timeout for answer with token {pending.token}")
+        self.metrics.answer_timed_out(self.env.now)
+
+        # The nodes may have been heard with their new addresses, and may
+        # have sent reports which have been lost.
+        for node in pending.path[1:]:
+            transmission_lost(self.node_graph, node, (
+                node.current_logic_address,
+                pending.new_addrs_table.get(node.static_address)
+            ))
+
+        self._unset_ambiguous_addresses(pending.new_addrs_table)
+        self._noise_refresh_needed.update(
+            node.static_address for node in pending.path[1:]
+        )
+        self._complete_messages(
+            pending, MessageOutcome.timed_out,
+            [(None, 0)] * len(pending.completions)
+        )
+
+    @singledispatchmethod
+    def _handle_received(self, _):
+        logger.error(f'{self} received something unsupported.')
+
+    @_handle_received.register(Packet)
+    def _(self, packet):
+        logger.warning(f'{self} received {packet}, which cannot be handled.')
+
+    @_handle_received.register(RequestPacket)
+    def _(self, _):
+        logger.info(f'{self} received a RequestPacket.')
+
+    @_handle_received.register(HelloProbePacket)
+    @_handle_received.register(HelloRequestPacket)
+    @_handle_received.register(HelloResponsePacket)
+    def _(self, _):
+        # Overheard from the neighbors probing theirs.
+        pass
+
+    @_handle_received.register(ResponsePacket)
+    def _(self, packet):
+
+        pending = self._pending_answer_to(packet)
+
+        if pending is None:
+            return
+
+        now = self.env.now
+        self.metrics.answer_received(now - pending.request_time, now)
+
+        self._update_node_graph_from_packet(packet, pending)
+
+        # The discovery updates the tree after adding the nodes found by the
+        # prober.
+        if not packet.code_is_node_init:
+            self._update_sptree()
+            self._readdress_nodes()
+
+        msg_callback = self.on_message_received or (lambda x, y, z: None)
+
+        if isinstance(packet.payload, CoalescedPayload):
+            answers = list(packet.payload)
+        else:
+            answers = [(packet.payload, packet.payload_length)]
+
+        # The answers to the probe requests are handled by the discovery, and
+        # those without payload, like the ones to the probes of the
+        # unreachable nodes, carry nothing for the application.
+        if not packet.code_is_node_init:
+            for payload, payload_length in answers:
+                if payload is not None:
+                    msg_callback(self, payload, payload_length)
+
+        self._complete_messages(pending, MessageOutcome.answered, answers)
+
+        # The slave answers only the first messages of a coalesced request
+        # whose answers fit in the response.
+        unanswered = pending.completions[len(answers):]
+
+        if unanswered:
+            self._complete_messages(
+                pending._replace(
+                    completions=unanswered,
+                    enqueue_times=pending.enqueue_times[len(answers):]
+                ),
+                MessageOutcome.answer_too_long, [(None, 0)] * len(unanswered)
+            )
+
+        self._answer_pending = None
+
+    def _complete_messages(self, pending: AnswerPendingRecord,
+                           outcome: MessageOutcome, answers):
+        """
+        Fa scattare gli eventi dei messaggi di una richiesta.
+
+        :param pending: Il record della richiesta.
+        :param outcome: L'esito della richiesta.
+        :param answers: Le tuple (payload, lunghezza) delle risposte, una
+        per messaggio.
+        """
+
+        now = self.env.now
+        latency = (now - pending.request_time
+                   if outcome is MessageOutcome.answered else None)
+        retries = self._transaction_retransmissions[pending.token]
+
+        for completion, enqueue_time, (payload, payload_length) in zip(
+                pending.completions, pending.enqueue_times, answers):
+
+            # A late answer may arrive after the timeout.
+            if completion is not None and not completion.triggered:
+                completion.succeed(MessageResult(
+                    outcome, payload, payload_length, latency,
+                    pending.request_time - enqueue_time, retries
+                ))
+
+    @_handle_received.register(MulticastResponsePacket)
+    def _(self, packet):
+
+        pending = self._pending_answer_to(packet)
+
+        if pending is None:
+            return
+
+        now = self.env.now
+        self.metrics.answer_received(now - pending.request_time, now)
+
+        nodes = self._node_manager
+        refresh_needed = self._noise_refresh_needed
+        reported = set(packet.noise_sources)
+
+        for node in pending.path[1:]:
+            new_logic_addr = pending.new_addrs_table.get(
+                node.static_address, node.current_logic_address
+            )
+
+            if node.static_address in reported:
+                address_heard(self.node_graph, node, new_logic_addr)
+            else:
+                transmission_lost(self.node_graph, node,
+                                  (node.current_logic_address,
+                                   new_logic_addr))
+
+        # The nodes of the subtrees which didn't answer in time may not have
+        # received their new addresses, and may have lost their reports.
+        for static_addr, new_logic_addr in pending.new_addrs_table.items():
+            nodes[static_addr].current_logic_address = (
+                new_logic_addr if static_addr in reported else None
+            )
+
+        refresh_needed.update(
+            node.static_address for node in pending.path[1:]
+            if node.static_address not in reported
+        )
+
+        for source_addr, noise_table in zip(packet.noise_sources,
+                                            packet.noise_tables):
+
+            self._update_node_graph_from_table(nodes[source_addr],
+                                               noise_table)
+
+            if noise_table.full:
+                refresh_needed.discard(source_addr)
+
+        self._update_sptree()
+        self._readdress_nodes()
+
+        msg_callback = self.on_message_received or (lambda x, y, z: None)
+
+        for _, payload, payload_length in packet.answers:
+            msg_callback(self, payload, payload_length)
+
+        self._answer_pending = None
+
+    def _pending_answer_to(self, packet: ResponsePacket) \
+            -> Optional[AnswerPendingRecord]:
+        """
+        Restituisce il record della risposta attesa, se il pacchetto è la
+        risposta alla richiesta in corso, o a una delle transazioni in corso
+        se le richieste vengono inviate in modo concorrente. In questo caso
+        la transazione termina.
+        """
+
+        if packet.next_hop != self.static_address:
+            return None
+
+        pending = self._answer_pending
+
+        if pending is None and self._transactions:
+            transaction = self._transactions.get(packet.token)
+
+            # Tokens have only a few bits: the answer must also come from
+            # the first node of the path of the transaction.
+            if (transaction is not None and transaction.pending is not None
+                    and packet.source_static ==
+                    transaction.pending.path[1].static_address):
+                logger.debug(f"{self} received answer to token "
+                             f"{packet.token}")
+                self._record_answer_delay(transaction, packet)
+                self._end_transaction(packet.token, answered=True)
+                return transaction.pending
+
+        tok = None if pending is None else pending.token
+
+        if tok != packet.token:
+            logger.warning(
+                f'{self} has received an answer with token '
+                f'{packet.token}. Current token is {tok}, ignoring'
+            )
+            return None
+
+        logger.debug(f"{self} received answer to token {packet.token}")
+
+        return pending
+
+    def _make_request_packet(self, message, length, path_to_dest) \
+            -> RequestPacket:
+
+        packet = RequestPacket()
+        packet.payload = message
+        packet.payload_length = length
+
+        destination_addr = path_to_dest[-1].logic_address
+
+        path: List[Tuple[AddressType, int]] = []
+        new_addrs: Dict[int, int] = {}
+
+        next_static_addressing_used = True
+
+        for next_node, node in zip(path_to_dest[::-1], path_to_dest[-2::-1]):
+
+            static_addressing_used = next_static_addressing_used
+            next_static_addressing_used = False
+
+            if next_node.current_logic_address is None:
+
+                new_addrs[next_node.static_address] = next_node.logic_address
+                path.append((AddressType.static, next_node.static_address))
+
+                destination_addr = next_node.logic_address
+                next_static_addressing_used = True
+
+                continue
+
+            # The slave forwards by the table of its last report, which keeps
+            # a single node for every logic address, so neighbors sharing a
+            # confirmed address don't make the addressing ambiguous.
+            if node is path_to_dest[0]:
+                # The master sends the packet straight to the next node.
+                wrong_addressing = False
+                known_route = True
+            else:
+                next_addr = next_node.static_address
+                wrong_addressing = (reported_next_hop(
+                    node, destination_addr) != next_addr)
+                known_route = (reported_next_hop(
+                    node, next_node.current_logic_address) == next_addr)
+
+            if not known_route:
+                path.append((AddressType.static, next_node.static_address))
+
+                destination_addr = next_node.current_logic_address
+                next_static_addressing_used = True
+
+            elif wrong_addressing or static_addressing_used:
+                destination_addr = next_node.current_logic_address
+                path.append((AddressType.logic, destination_addr))
+
+            if next_node.logic_address != next_node.current_logic_address:
+                new_addrs[next_node.static_address] = next_node.logic_address
+
+        packet = RequestPacket()
+        packet.token = self._next_token()
+
+        packet.source_static = self.static_address
+        packet.source_logic = self.logic_address
+
+        dest_type, dest = path.pop()
+
+        packet.destination = dest
+        packet.code_is_addressing_static = dest_type is AddressType.static
+
+        next_hop = path_to_dest[1]
+        packet.next_hop = next_hop.static_address
+
+        packet.payload = message
+        packet.payload_length = length
+
+        packet.path = path
+        packet.new_logic_addresses = new_addrs
+
+        refresh_needed = self._noise_refresh_needed
+        packet.code_is_noise_refresh = any(
+            node.static_address in refresh_needed for node in path_to_dest[1:]
+        )
+
+        return packet
+
+    def _make_multicast_trees(self, dest_static_addrs) \
+            -> List[List[Tuple[NodeDataT, int, bool]]]:
+        """
+        Costruisce l'albero che unisce i cammini minimi verso i destinatari.
+
+        :param dest_static_addrs: Gli indirizzi statici dei destinatari.
+        :return: I sottoalberi dei figli del master, ognuno come lista in
+        preordine di tuple (nodo, numero di discendenti, destinatario).
+        """
+
+        nodes = self._node_manager
+
+        try:
+            destinations = {nodes[addr] for addr in dest_static_addrs}
+        except KeyError as e:
+            raise ValueError(f"{self} is not aware of a node with address "
+                             f"{e.args[0]}")
+
+        paths = []
+
+        for dest in sorted(destinations, key=lambda node: node.static_address):
+            try:
+                if dest.static_address in self.unreachable_nodes:
+                    raise KeyError(dest)
+
+                paths.append(self._shortest_paths[dest])
+            except KeyError:
+                logger.warning(f"{self} has no path to {dest.static_address}")
+
+        if self.lazy_paths:
+            self._update_sptree()
+
+        tree_nodes = set()
+
+        for path in paths:
+            tree_nodes.update(path[1:])
+
+        sptree = self._sptree
+
+        def children(node):
+            return sorted((child for child in sptree.successors_iter(node)
+                           if child in tree_nodes),
+                          key=lambda child: child.static_address)
+
+        def visit(node, entries):
+            index = len(entries)
+            entries.append(None)
+
+            for child in children(node):
+                visit(child, entries)
+
+            entries[index] = (node, len(entries) - index - 1,
+                              node in destinations)
+
+        subtrees = []
+
+        for child in children(nodes[0]):
+            subtree = []
+            visit(child, subtree)
+            subtrees.append(subtree)
+
+        return subtrees
+
+    def _make_multicast_packet(self, message, length, subtree) \
+            -> MulticastRequestPacket:
+
+        child, _, _ = subtree[0]
+
+        packet = MulticastRequestPacket()
+        packet.token = self._next_token()
+
+        packet.source_static = self.static_address
+        packet.source_logic = self.logic_address
+
+        packet.destination = child.static_address
+        packet.code_is_addressing_static = True
+        packet.next_hop = child.static_address
+
+        packet.payload = message
+        packet.payload_length = length
+
+        packet.tree = [(node.static_address, descendants, is_destination)
+                       for node, descendants, is_destination in subtree]
+
+        packet.new_logic_addresses = {
+            node.static_address: node.logic_address for node, _, _ in subtree
+            if node.logic_address != node.current_logic_address
+        }
+
+        refresh_needed = self._noise_refresh_needed
+        packet.code_is_noise_refresh = any(
+            node.static_address in refresh_needed for node, _, _ in subtree
+        )
+
+        return packet
+
+    def _unset_ambiguous_addresses(self, new_addrs_table):
+
+        nodes = self._node_manager
+
+        for static_addr in new_addrs_table.keys():
+            nodes[static_addr].current_logic_address = None
+
+    def _update_node_graph_from_packet(self, packet: ResponsePacket,
+                                       pending: AnswerPendingRecord):
+
+        nodes = self._node_manager
+        new_addresses = pending.new_addrs_table
+        message_path = pending.path
+
+        for static_addr, new_logic_addr in new_addresses.items():
+            nodes[static_addr].current_logic_address = new_logic_addr
+
+        for node in message_path[1:]:
+            address_heard(self.node_graph, node, node.current_logic_address)
+
+        # Delta reports only carry the entries that have changed, so merging
+        # them like full ones leaves the omitted edges untouched.
+
+        for source_node, noise_table in zip(message_path[1:],
+                                            reversed(packet.noise_tables)):
+
+            self._update_node_graph_from_table(source_node, noise_table)
+
+            if noise_table.full:
+                self._noise_refresh_needed.discard(source_node.static_address)
+
+    def _update_node_graph_from_table(self, source, table):
+
+        # An unreachable node is alive again if its own report arrives, or if
+        # a neighbor reports it in a delta report, which only carries the
+        # nodes heard since the previous one. A full report may carry an
+        # entry that the neighbor has kept from before.
+        unreachable = self.unreachable_nodes
+        revived = [] if table.full else [
+            addr for addr in table if addr in unreachable
+        ]
+
+        if source.static_address in unreachable:
+            revived.append(source.static_address)
+
+        for static_addr in revived:
+            self._restore_node(static_addr)
+
+        # The node may have been removed or marked unreachable while the
+        # packet was on its way.
+        if source not in self.node_graph:
+            return
+
+        if self.noise_estimator is None:
+            updates = self._average_noise_table(source, table)
+        else:
+            # Only the edges whose estimate has changed enough are updated.
+            updates = self.noise_estimator.update(source.static_address,
+                                                  table)
+
+        graph = self.node_graph
+        node_manager = self._node_manager
+        weight = self._path_weight
+
+        for dest_addr, _, noise in updates:
+
+            if dest_addr in self._removed_nodes:
+                # The estimator has just added the edge again.
+                if self.noise_estimator is not None:
+                    self.noise_estimator.remove_edges(
+                        [(source.static_address, dest_addr)]
+                    )
+                continue
+
+            if dest_addr in self.unreachable_nodes:
+                continue
+
+            try:
+                dest = node_manager[dest_addr]
+            except KeyError:
+                # A slave which has joined the network, heard by source.
+                logger.info(f"{self} found the new node {dest_addr}")
+                dest = self._create_node(dest_addr)
+
+            edge = graph.get_edge_data(source, dest)
+
+            if edge is None:
+                old_weight = None
+                graph.add_edge(source, dest, dict(noise=noise))
+                edge = graph[source][dest]
+                link_heard(source, dest)
+            else:
+                old_weight = edge[weight]
+                edge['noise'] = noise
+
+            if self.edge_cost is not None:
+                edge['cost'] = self.edge_cost(edge['noise'])
+
+            if self.lazy_paths:
+                self._shortest_paths.edge_changed(source, dest, old_weight,
+                                                  edge[weight])
+
+        # The entries aged out of the table of the node: it hasn't heard
+        # those nodes for a while.
+        for dest_addr in table.removed:
+            dest = node_manager.get(dest_addr)
+
+            if dest is not None and graph.has_edge(source, dest):
+                logger.info(f"{self} removes the edge from {source} to "
+                            f"{dest}, aged out of its noise table")
+                self._remove_edge(source, dest)
+
+        # The node routes by the table sent along with the report.
+        table_reported(source)
+
+    def _average_noise_table(self, source, table):
+        """
+        Stima il rumore degli archi con una media mobile esponenziale.
+
+        :return: Gli archi aggiornati, come tuple (indirizzo dell'altro
+        estremo, rumore precedente o None, nuovo rumore).
+        """
+
+        graph = self.node_graph
+        node_manager = self._node_manager
+        updates = []
+
+        for dest_addr, new_noise in table.items():
+            edge = graph.get_edge_data(source, node_manager.get(dest_addr))
+
+            if edge is None:
+                updates.append((dest_addr, None, new_noise))
+            else:
+                old_noise = edge['noise']
+                updates.append((dest_addr, old_noise, (
+                    old_noise * PAST_NOISE_HISTORY_WEIGHT +
+                    new_noise * (1 - PAST_NOISE_HISTORY_WEIGHT)
+                )))
+
+        return updates
 
     def _waiting_for_answer(self):
         pending: AnswerPendingRecord = self._answer_pending
@@ -0,0 +1,175 @@
+from typing import Iterable, List, Optional
+
+
+class TransactionMetrics:
+    """
+    Statistiche sulle transazioni (richiesta e relativa risposta) gestite
+    dal master.
+
+    Le stesse statistiche vengono prodotte dal simulatore a eventi e da
+    quello a slot, in modo che i due possano essere confrontati.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.answers = 0
+        self.timeouts = 0
+        self.latencies: List[float] = []
+        self.queueing_times: List[float] = []
+        self.static_addressing_requests = 0
+        self.address_frames = 0
+        self.tree_changes = 0
+        self.parent_changes = 0
+        self.address_swaps = 0
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+        # Transactions in progress at the same time.
+        self.max_concurrency = 0
+        self._in_progress = 0
+        self._concurrency_area = 0
+        self._last_change = 0
+
+    def __repr__(self):
+        return (f'<TransactionMetrics requests={self.requests} '
+                f'answers={self.answers} timeouts={self.timeouts}>')
+
+    def request_sent(self, now, queueing_time=0, static_addressing=False,
+                     address_frames=0):
+        """
+        :param now: L'istante di invio della richiesta.
+        :param queueing_time: Il tempo che il messaggio ha atteso in coda
+        prima dell'invio.
+        :param static_addressing: Se la richiesta ha dovuto ricorrere
+        all'indirizzamento statico per una parte del percorso.
+        :param address_frames: I frame della richiesta occupati dai nuovi
+        indirizzi logici.
+        """
+
+        self._concurrency_changed(1, now)
+        self.requests += 1
+        self.queueing_times.append(queueing_time)
+        self.address_frames += address_frames
+
+        if static_addressing:
+            self.static_addressing_requests += 1
+
+        if self.start_time is None:
+            self.start_time = now
+
+    def tree_updated(self, parent_changes):
+        """
+        :param parent_changes: Il numero di nodi che hanno cambiato padre
+        nell'albero dei cammini minimi.
+        """
+
+        if parent_changes > 0:
+            self.tree_changes += 1
+            self.parent_changes += parent_changes
+
+    def answer_received(self, latency, now):
+        self._concurrency_changed(-1, now)
+        self.answers += 1
+        self.latencies.append(latency)
+        self.end_time = now
+
+    def answer_timed_out(self, now):
+        self._concurrency_changed(-1, now)
+        self.timeouts += 1
+        self.end_time = now
+
+    def _concurrency_changed(self, delta, now):
+
+        self._concurrency_area += self._in_progress * (now - self._last_change)
+        self._in_progress += delta
+        self._last_change = now
+
+        self.max_concurrency = max(self.max_concurrency, self._in_progress)
+
+    @property
+    def mean_latency(self):
+        if not self.latencies:
+            return None
+        return sum(self.latencies) / len(self.latencies)
+
+    @property
+    def mean_queueing_time(self):
+        if not self.queueing_times:
+            return None
+        return sum(self.queueing_times) / len(self.queueing_times)
+
+    @property
+    def mean_concurrency(self):
+        """
+        Il numero medio di transazioni in corso, pesato sul tempo, tra la
+        prima richiesta e l'ultima risposta.
+        """
+        elapsed = self.elapsed_time
+        return self._concurrency_area / elapsed if elapsed > 0 else None
+
+    @property
+    def static_addressing_ratio(self):
+        """
+        La frazione delle richieste che hanno usato l'indirizzamento statico.
+        """
+        if self.requests == 0:
+            return None
+        return self.static_addressing_requests / self.requests
+
+    @property
+    def delivery_ratio(self):
+        if self.requests == 0:
+            return None
+        return self.answers / self.requests
+
+    @property
+    def elapsed_time(self):
+        if self.start_time is None or self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+
+    @property
+    def throughput(self):
+        """
+        Il numero di risposte ricevute per unità di tempo di simulazione.
+        """
+        elapsed = self.elapsed_time
+        return self.answers / elapsed if elapsed > 0 else None
+
+    def summary(self):
+        return dict(
+            requests=self.requests, answers=self.answers,
+            timeouts=self.timeouts, mean_latency=self.mean_latency,
+            delivery_ratio=self.delivery_ratio, throughput=self.throughput
+        )
+
+    @classmethod
+    def merge(cls, metrics: Iterable['TransactionMetrics']):
+        """
+        Unisce le statistiche di più simulazioni indipendenti. Il tempo
+        trascorso del risultato è la somma di quelli delle simulazioni.
+        """
+
+        merged = cls()
+        elapsed = 0
+
+        for m in metrics:
+            merged.requests += m.requests
+            merged.answers += m.answers
+            merged.timeouts += m.timeouts
+            merged.latencies.extend(m.latencies)
+            merged.queueing_times.extend(m.queueing_times)
+            merged.static_addressing_requests += m.static_addressing_requests
+            merged.address_frames += m.address_frames
+            merged.tree_changes += m.tree_changes
+            merged.parent_changes += m.parent_changes
+            merged.address_swaps += m.address_swaps
+            merged.max_concurrency = max(merged.max_concurrency,
+                                         m.max_concurrency)
+            merged._concurrency_area += m._concurrency_area
+            elapsed += m.elapsed_time
+
+        merged.start_time = 0
+        merged.end_time = elapsed
+
+        return merged
@@ -1,13 +1,16 @@
 import collections
 import weakref
+from typing import Optional
 
 from sortedcontainers import SortedDict
 
+from protocol.routing_table import RoutingTable
+
 
 class NodeDataManager(collections.Mapping):
 
     FLAG_VALUES = frozenset((None,))
-    MAX_ADDRESS = 1 << 11 - 1
+    MAX_ADDRESS = (1 << 11) - 1
 
     class NodeData:
 
@@ -24,6 +27,16 @@ class NodeDataManager(collections.Mapping):
             self.logic_address = logic_address
             self.current_logic_address = None
 
+            # The routing table of the node as the master rebuilds it from
+            # the packets the node has heard, with the nodes whose entries
+            # it can't tell, and both as they were when the node sent its
+            # last report, along with the table it routes by. The table is
+            # created once the node hears something.
+            self.heard_routing_table: Optional[RoutingTable] = None
+            self.unknown_routing_entries = frozenset()
+            self.reported_routing_table: Optional[RoutingTable] = None
+            self.reported_unknown_entries = frozenset()
+
             node_manager._on_create(self)
 
         @property
@@ -0,0 +1,415 @@
+"""
+Contiene gli stimatori del rumore dei collegamenti usati dal master.
+
+Uno stimatore conserva lo stato di tutti gli archi del grafo dei nodi in
+array numpy indicizzati per arco, e applica un'intera tabella del rumore
+ricevuta con un'unica operazione vettoriale. Restituisce solo gli archi la
+cui stima si è spostata di più di `threshold` dall'ultimo valore
+comunicato, per cui il lavoro in Python del master è proporzionale agli
+archi cambiati, e non alla dimensione della tabella.
+
+Gli archi non sono orientati: la tabella di un nodo aggiorna gli stessi
+archi delle tabelle dei suoi vicini. Ogni arco è identificato da una chiave
+formata dai due indirizzi statici, e le chiavi sono conservate ordinate, per
+cui la memoria occupata è proporzionale al numero di archi: le righe degli
+archi rimossi vengono riusate da quelli aggiunti in seguito.
+"""
+
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ADDRESS_BITS = 32
+
+
+class NoiseEstimator:
+    """
+    Classe base degli stimatori. Le sottoclassi conservano il proprio stato
+    in array con una riga per arco, allocati da _allocate_state, e
+    implementano _first_samples e _next_samples.
+    """
+
+    def __init__(self, threshold=0.0, initial_capacity=64):
+        """
+        :param threshold: Lo scostamento minimo della stima dall'ultimo
+        valore comunicato perché un arco venga considerato cambiato.
+        :param initial_capacity: Il numero di archi per cui vengono
+        inizialmente allocati gli array.
+        """
+
+        if np is None:
+            raise ImportError('numpy is required for the noise estimators')
+
+        if threshold < 0:
+            raise ValueError('threshold must not be negative')
+
+        self.threshold = threshold
+        self._keys = np.empty(0, dtype=np.int64)
+        self._key_edges = np.empty(0, dtype=np.int64)
+        # Rows in use or freed, and the freed ones.
+        self._edge_count = 0
+        self._free_edges = []
+        self._published = np.zeros(initial_capacity)
+        self._allocate_state(initial_capacity)
+
+        # Samples applied and edges reported as changed.
+        self.samples = 0
+        self.changes = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _allocate_state(self, edges):
+        raise NotImplementedError
+
+    def _grow_state(self, edges):
+        """
+        Ingrandisce gli array dello stato, mantenendone i valori.
+        """
+
+        for name, array in list(vars(self).items()):
+            if (name.startswith('_state_') and isinstance(array, np.ndarray)
+                    and array.shape[0] < edges):
+                grown = np.zeros((edges, *array.shape[1:]), array.dtype)
+                grown[:array.shape[0]] = array
+                setattr(self, name, grown)
+
+    def _first_samples(self, edges, samples):
+        """
+        Inizializza lo stato di archi nuovi con il loro primo campione.
+
+        :return: Le stime degli archi.
+        """
+        raise NotImplementedError
+
+    def _next_samples(self, edges, samples):
+        """
+        Aggiunge un campione allo stato di archi già noti.
+
+        :return: Le nuove stime degli archi.
+        """
+        raise NotImplementedError
+
+    def estimate(self, source: int, dest: int) -> Optional[float]:
+
+        key = self._keys_of(source, np.array([dest]))[0]
+        i = np.searchsorted(self._keys, key)
+
+        if i == len(self._keys) or self._keys[i] != key:
+            return None
+
+        return float(self._published[self._key_edges[i]])
+
+    @staticmethod
+    def _keys_of(source, dests):
+        low = np.minimum(dests, source)
+        high = np.maximum(dests, source)
+        return (low << ADDRESS_BITS) | high
+
+    def add_edges(self, pairs, noise):
+        """
+        Aggiunge degli archi con la stessa stima iniziale, senza comunicarli
+        come cambiati.
+
+        :param pairs: Le coppie di indirizzi statici degli estremi.
+        :param noise: La stima iniziale.
+        """
+
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+        for source, dests in self._group_by_source(pairs):
+            edges, new_mask = self._edges_of(source, dests)
+            new = edges[new_mask]
+            self._published[new] = self._first_samples(
+                new, np.full(len(new), noise, dtype=float)
+            )
+
+    def set_edges(self, pairs, noise):
+        """
+        Imposta la stima di alcuni archi, creando quelli mancanti, senza
+        comunicarli come cambiati. Lo stato degli archi già noti viene
+        reinizializzato, come se la stima fosse il loro primo campione.
+
+        :param pairs: Le coppie di indirizzi statici degli estremi.
+        :param noise: La stima.
+        """
+
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+        for source, dests in self._group_by_source(pairs):
+            edges, _ = self._edges_of(source, dests)
+            self._published[edges] = self._first_samples(
+                edges, np.full(len(edges), noise, dtype=float)
+            )
+
+    def remove_edges(self, pairs):
+        """
+        Rimuove degli archi. Quelli sconosciuti vengono ignorati.
+
+        :param pairs: Le coppie di indirizzi statici degli estremi.
+        """
+
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        positions, found = self._find(self._keys_of(pairs[:, 0], pairs[:, 1]))
+        self._remove_positions(np.unique(positions[found]))
+
+    def remove_node(self, address: int):
+        """
+        Rimuove tutti gli archi di un nodo.
+        """
+
+        low = self._keys >> ADDRESS_BITS
+        high = self._keys & ((1 << ADDRESS_BITS) - 1)
+        self._remove_positions(np.flatnonzero((low == address) |
+                                              (high == address)))
+
+    def _remove_positions(self, positions):
+
+        self._free_edges.extend(self._key_edges[positions].tolist())
+        self._keys = np.delete(self._keys, positions)
+        self._key_edges = np.delete(self._key_edges, positions)
+
+    @staticmethod
+    def _group_by_source(pairs):
+        for source in np.unique(pairs[:, 0]):
+            yield int(source), pairs[pairs[:, 0] == source, 1]
+
+    def update(self, source: int, table) \
+            -> List[Tuple[int, Optional[float], float]]:
+        """
+        Applica la tabella del rumore ricevuta da un nodo.
+
+        :param source: L'indirizzo statico del nodo.
+        :param table: Un dizionario da indirizzo statico a rumore.
+        :return: Gli archi cambiati, come tuple (indirizzo dell'altro
+        estremo, stima precedente o None se l'arco è nuovo, nuova stima).
+        """
+
+        if not table:
+            return []
+
+        count = len(table)
+        dests = np.fromiter(table.keys(), np.int64, count)
+        samples = np.fromiter(table.values(), float, count)
+
+        edges, new_mask = self._edges_of(source, dests)
+
+        estimates = np.empty(count)
+        estimates[new_mask] = self._first_samples(edges[new_mask],
+                                                  samples[new_mask])
+        known = ~new_mask
+        estimates[known] = self._next_samples(edges[known], samples[known])
+
+        self.samples += count
+
+        published = self._published[edges]
+        changed = new_mask | (np.abs(estimates - published) > self.threshold)
+
+        changed_edges = edges[changed]
+        old = published[changed]
+        new = estimates[changed]
+        self._published[changed_edges] = new
+        self.changes += len(changed_edges)
+
+        changed_new = new_mask[changed]
+
+        return [
+            (dest, None if is_new else old_value, new_value)
+            for dest, is_new, old_value, new_value in zip(
+                dests[changed].tolist(), changed_new.tolist(),
+                old.tolist(), new.tolist()
+            )
+        ]
+
+    def _edges_of(self, source, dests):
+        """
+        Restituisce gli indici degli archi tra source e dests, creando
+        quelli mancanti, e la maschera degli archi creati.
+        """
+
+        keys = self._keys_of(source, dests)
+        positions, found = self._find(keys)
+
+        edges = np.empty(len(keys), dtype=np.int64)
+        edges[found] = self._key_edges[positions[found]]
+        new_mask = ~found
+
+        if new_mask.any():
+            new_keys = keys[new_mask]
+            new_edges = self._allocate_edges(len(new_keys))
+
+            order = np.argsort(new_keys)
+            insert_at = np.searchsorted(self._keys, new_keys[order])
+            self._keys = np.insert(self._keys, insert_at, new_keys[order])
+            self._key_edges = np.insert(self._key_edges, insert_at,
+                                        new_edges[order])
+
+            edges[new_mask] = new_edges
+
+        return edges, new_mask
+
+    def _find(self, keys):
+        """
+        Restituisce le posizioni delle chiavi tra quelle degli archi, e la
+        maschera delle chiavi trovate.
+        """
+
+        positions = np.searchsorted(self._keys, keys)
+
+        found = positions < len(self._keys)
+        found[found] = self._keys[positions[found]] == keys[found]
+
+        return positions, found
+
+    def _allocate_edges(self, count):
+        """
+        Restituisce le righe dello stato per degli archi nuovi, riusando
+        prima quelle degli archi rimossi.
+        """
+
+        free = self._free_edges
+        reused = min(len(free), count)
+
+        edges = np.empty(count, dtype=np.int64)
+        edges[:reused] = free[len(free) - reused:]
+        del free[len(free) - reused:]
+
+        first = self._edge_count
+        edges[reused:] = np.arange(first, first + count - reused)
+
+        self._ensure_edge_capacity(first + count - reused)
+        self._edge_count += count - reused
+
+        return edges
+
+    def _ensure_edge_capacity(self, edges):
+
+        capacity = len(self._published)
+
+        if edges <= capacity:
+            return
+
+        new_capacity = max(capacity * 2, edges)
+        published = np.zeros(new_capacity)
+        published[:capacity] = self._published
+        self._published = published
+        self._grow_state(new_capacity)
+
+
+class EwmaEstimator(NoiseEstimator):
+    """
+    Media mobile esponenziale: ogni campione pesa 1 - past_weight. Con il
+    peso predefinito e threshold nullo dà le stesse stime del master senza
+    stimatore.
+    """
+
+    def __init__(self, past_weight=2/3, threshold=0.0, initial_capacity=64):
+
+        if not 0 <= past_weight < 1:
+            raise ValueError('past_weight must be between 0 and 1')
+
+        self.past_weight = past_weight
+        super().__init__(threshold, initial_capacity)
+
+    def _allocate_state(self, edges):
+        self._state_mean = np.zeros(edges)
+
+    def _first_samples(self, edges, samples):
+        self._state_mean[edges] = samples
+        return samples
+
+    def _next_samples(self, edges, samples):
+        mean = (self._state_mean[edges] * self.past_weight +
+                samples * (1 - self.past_weight))
+        self._state_mean[edges] = mean
+        return mean
+
+
+class WindowMeanEstimator(NoiseEstimator):
+    """
+    Media degli ultimi `window` campioni di ogni arco.
+    """
+
+    def __init__(self, window=4, threshold=0.0, initial_capacity=64):
+
+        if window < 1:
+            raise ValueError('window must be positive')
+
+        self.window = window
+        super().__init__(threshold, initial_capacity)
+
+    def _allocate_state(self, edges):
+        self._state_samples = np.zeros((edges, self.window))
+        self._state_sums = np.zeros(edges)
+        self._state_counts = np.zeros(edges, dtype=np.int64)
+
+    def _first_samples(self, edges, samples):
+        self._state_samples[edges] = 0
+        self._state_samples[edges, 0] = samples
+        self._state_sums[edges] = samples
+        self._state_counts[edges] = 1
+        return samples
+
+    def _next_samples(self, edges, samples):
+
+        counts = self._state_counts[edges]
+        slots = counts % self.window
+
+        evicted = self._state_samples[edges, slots]
+        self._state_samples[edges, slots] = samples
+
+        sums = self._state_sums[edges] + samples - evicted
+        counts += 1
+
+        self._state_sums[edges] = sums
+        self._state_counts[edges] = counts
+
+        return sums / np.minimum(counts, self.window)
+
+
+class VarianceAwareEstimator(NoiseEstimator):
+    """
+    Media e varianza mobili esponenziali: la stima è la media più
+    `deviation_weight` deviazioni standard, per cui i collegamenti
+    instabili costano più di quelli costanti con lo stesso rumore medio.
+    """
+
+    def __init__(self, past_weight=2/3, deviation_weight=1.0, threshold=0.0,
+                 initial_capacity=64):
+
+        if not 0 <= past_weight < 1:
+            raise ValueError('past_weight must be between 0 and 1')
+
+        if deviation_weight < 0:
+            raise ValueError('deviation_weight must not be negative')
+
+        self.past_weight = past_weight
+        self.deviation_weight = deviation_weight
+        super().__init__(threshold, initial_capacity)
+
+    def _allocate_state(self, edges):
+        self._state_mean = np.zeros(edges)
+        self._state_variance = np.zeros(edges)
+
+    def _first_samples(self, edges, samples):
+        self._state_mean[edges] = samples
+        self._state_variance[edges] = 0
+        return samples
+
+    def _next_samples(self, edges, samples):
+
+        past_weight = self.past_weight
+        mean = self._state_mean[edges]
+        delta = samples - mean
+
+        mean = mean + (1 - past_weight) * delta
+        variance = past_weight * (self._state_variance[edges] +
+                                  (1 - past_weight) * delta ** 2)
+
+        self._state_mean[edges] = mean
+        self._state_variance[edges] = variance
+
+        return mean + self.deviation_weight * np.sqrt(variance)
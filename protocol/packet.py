@@ -1,15 +1,26 @@
 import abc
+import copy
 import enum
 import inspect
 import math
 import random
 from collections import defaultdict
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 
 from protocol.packet_fields import FixedSizeInt
 
 FRAME_SIZE = 11
 PHYSICAL_ADDRESS_FRAMES = 2
+PHYSICAL_ADDRESS_BITS = FRAME_SIZE * PHYSICAL_ADDRESS_FRAMES
+
+# Payload lengths of the request which makes a node probe its neighbors (the
+# first address to assign and the number of nodes) and of every node in its
+# answer (physical and static address).
+PROBE_COMMAND_LENGTH = 3
+PROBED_NODE_LENGTH = 5
+
+# The payload length is sent in a single frame.
+MAX_PAYLOAD_LENGTH = (1 << FRAME_SIZE) - 1
 
 
 def bitmap_frame_count(list_len: int):
@@ -24,6 +35,68 @@ def bitmap_frame_count(list_len: int):
     return math.ceil(list_len / FRAME_SIZE)
 
 
+def payload_frame_count(payload, payload_length: int):
+    """
+    Calcola quanti frame occupa un payload all'interno di un pacchetto.
+
+    :param payload: Il payload, o None se il pacchetto non ne ha.
+    :param payload_length: La lunghezza del payload.
+    :return: Il numero di frame del payload.
+    """
+
+    frames = 0 if payload is None else 1
+
+    quot, remainder = divmod(payload_length, 4)
+    return frames + quot * 3 + remainder
+
+
+class CoalescedPayload(list):
+    """
+    Payload composto da più messaggi diretti allo stesso nodo, ognuno
+    rappresentato da una tupla (messaggio, lunghezza) e preceduto nel
+    pacchetto dalla propria lunghezza. Lo slave risponde con un
+    CoalescedPayload contenente una risposta per ogni messaggio, nello stesso
+    ordine.
+
+    Le lunghezze fino a SHORT_LENGTH occupano un byte, le altre due: il bit
+    più alto del primo byte indica se ne segue un secondo.
+    """
+
+    SHORT_LENGTH = 127
+
+    @classmethod
+    def encoded_length(cls, message_length):
+        """
+        Restituisce lo spazio occupato nel payload da un messaggio, compreso
+        quello della sua lunghezza.
+        """
+        return message_length + (1 if message_length <= cls.SHORT_LENGTH
+                                 else 2)
+
+    @property
+    def length(self):
+        return sum(self.encoded_length(length) for _, length in self)
+
+    def truncated(self, max_length=MAX_PAYLOAD_LENGTH) -> 'CoalescedPayload':
+        """
+        Restituisce i primi messaggi del payload, finché la loro lunghezza
+        complessiva non supera quella data.
+        """
+
+        fitting = CoalescedPayload()
+        length = 0
+
+        for message in self:
+            length += self.encoded_length(message[1])
+
+            if length > max_length:
+                break
+
+            fitting.append(message)
+
+        return fitting
+
+
 class Packet(metaclass=abc.ABCMeta):
 
     __STATIC_FRAMES = 1
@@ -57,6 +130,30 @@ class Packet(metaclass=abc.ABCMeta):
     def _frame_increment(self):
         return self.__STATIC_FRAMES
 
+    def header_frames(self):
+        """
+        Calcola il numero di frame a lunghezza fissa con cui inizia il
+        pacchetto, che contengono gli indirizzi necessari a inoltrarlo.
+
+        Le classi con una parte a lunghezza variabile definiscono
+        _header_frame_increment, che ne esclude la parte variabile; per le
+        altre viene usato _frame_increment.
+
+        :return: Il numero di frame dell'intestazione del pacchetto.
+        """
+
+        # noinspection PyProtectedMember
+        return sum(
+            vars(cls).get('_header_frame_increment',
+                          cls._frame_increment)(self)
+            for cls in inspect.getmro(type(self)) if issubclass(cls, Packet)
+        )
+
+    def is_header_readable(self):
+        header_frames = self.header_frames()
+        return all(errors < 2 for frame, errors in self.__frame_errors.items()
+                   if frame < header_frames)
+
     def damage_frame(self, frame_index=None, errors=1):
 
         if frame_index is None:
@@ -83,10 +180,32 @@ class Packet(metaclass=abc.ABCMeta):
     def remove_errors(self):
         self.__frame_errors = defaultdict(int)
 
+    def copy(self):
+        """
+        Restituisce una copia del pacchetto, in modo che le modifiche fatte
+        dai nodi che inoltrano l'originale non si riflettano sulla copia.
+
+        I campi a dimensione fissa vengono copiati dai descrittori, mentre le
+        liste e i dizionari del pacchetto vengono copiati a un livello.
+        """
+
+        packet = copy.copy(self)
+
+        for name, value in vars(self).items():
+            if isinstance(value, (list, dict)):
+                setattr(packet, name, copy.copy(value))
+
+        for cls in inspect.getmro(type(self)):
+            for field in vars(cls).values():
+                if isinstance(field, FixedSizeInt) and self in field._data:
+                    field._data[packet] = field._data[self]
+
+        return packet
+
 
 class PacketWithPhysicalAddress(Packet):
 
-    physical_address = FixedSizeInt(FRAME_SIZE * PHYSICAL_ADDRESS_FRAMES)
+    physical_address = FixedSizeInt(PHYSICAL_ADDRESS_BITS)
 
     @abc.abstractmethod
     def _frame_increment(self):
@@ -112,6 +231,30 @@ class PacketWithNextHop(Packet):
         return 1
 
 
+class HelloProbePacket(PacketWithPhysicalAddress, PacketWithSource):
+    """
+    Invita i nodi senza indirizzo il cui indirizzo fisico inizia con i primi
+    prefix_length bit di physical_address a rispondere con un
+    HelloRequestPacket.
+    """
+
+    prefix_length = FixedSizeInt(5)
+
+    def __init__(self):
+        super().__init__()
+
+    def __repr__(self):
+        return (f'<HelloProbePacket prefix={self.physical_address} '
+                f'len={self.prefix_length}>')
+
+    def matches(self, physical_address: int):
+        shift = PHYSICAL_ADDRESS_BITS - self.prefix_length
+        return physical_address >> shift == self.physical_address >> shift
+
+    def _frame_increment(self):
+        return 1
+
+
 class HelloRequestPacket(PacketWithPhysicalAddress):
 
     def __init__(self):
@@ -170,16 +313,10 @@ class CommunicationPacket(PacketWithSource, PacketWithNextHop):
 
     @abc.abstractmethod
     def _frame_increment(self):
+        return payload_frame_count(self.payload, self.payload_length)
 
-        if self.payload is None:
-            frames = 0
-        else:
-            frames = 1
-
-        quot, remainder = divmod(self.payload_length, 4)
-        frames += quot * 3 + remainder
-
-        return frames
+    def _header_frame_increment(self):
+        return 0
 
 
 class AddressType(enum.Enum):
@@ -200,6 +337,15 @@ class RequestPacket(CommunicationPacket):
         self.path: List[Tuple[AddressType, int]] = None
         self.new_logic_addresses: Dict[int, int] = None
 
+        # Chiede ai nodi attraversati di inviare un report completo della
+        # tabella del rumore nella risposta.
+        self.code_is_noise_refresh = False
+
+        # Se impostato, la destinazione è un gateway, che inoltra il payload
+        # al nodo del proprio segmento con questo indirizzo statico locale
+        # (vedi protocol.gateway_node).
+        self.segment_destination: Optional[int] = None
+
     def __repr__(self):
         return f'<RequestPacket tok={self.token} source={self.source_static} ' \
                f'next_hop={self.next_hop}>'
@@ -218,8 +364,38 @@ class RequestPacket(CommunicationPacket):
         if new_addrs_len > 0:
             frames += new_addrs_len * 2
 
+        if self.segment_destination is not None:
+            frames += 1
+
         return frames
 
+    def _header_frame_increment(self):
+        return self.__STATIC_FRAMES
+
+
+class NoiseReport(dict):
+    """
+    Tabella del rumore inviata da un nodo all'interno di un ResponsePacket.
+
+    Se `full` è falso, il report è differenziale: contiene solo i valori
+    cambiati rispetto all'ultimo report inviato dal nodo, e i valori assenti
+    vanno considerati invariati. Il flag viaggia nel frame di intestazione
+    della tabella, e non aumenta quindi la dimensione del pacchetto.
+
+    `removed` contiene gli indirizzi delle voci rimosse dalla tabella del
+    nodo dall'ultimo report, che occupano un frame ciascuno.
+    """
+
+    def __init__(self, *args, full=True, removed=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.full = full
+        self.removed = set(removed)
+
+    def __repr__(self):
+        kind = 'full' if self.full else 'delta'
+        removed = f' removed={sorted(self.removed)}' if self.removed else ''
+        return f'<NoiseReport {kind} {dict.__repr__(self)}{removed}>'
+
 
 class ResponsePacket(CommunicationPacket):
 
@@ -227,7 +403,7 @@ class ResponsePacket(CommunicationPacket):
 
     def __init__(self):
         super().__init__()
-        self.noise_tables: List[Dict[int, int]] = []
+        self.noise_tables: List[NoiseReport] = []
         self.new_node_list: List[int] = []
 
     def __repr__(self):
@@ -240,6 +416,100 @@ class ResponsePacket(CommunicationPacket):
 
         frames += len(self.noise_tables)
         frames += len(self.new_node_list)
-        frames += sum(len(table) * 2 for table in self.noise_tables)
+        frames += sum(len(table) * 2 + len(table.removed)
+                      for table in self.noise_tables)
 
         return frames
+
+    def _header_frame_increment(self):
+        return self.__STATIC_FRAMES
+
+
+class MulticastRequestPacket(RequestPacket):
+    """
+    Richiesta inviata a più destinatari lungo l'albero dei cammini minimi.
+
+    `tree` contiene in preordine il sottoalbero radicato nel nodo a cui il
+    pacchetto è indirizzato: per ogni nodo l'indirizzo statico, il numero dei
+    suoi discendenti e se è uno dei destinatari. Il nodo inoltra la
+    richiesta a un figlio alla volta, ognuna con il sottoalbero del figlio,
+    e ne raccoglie le risposte in un unico MulticastResponsePacket.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tree: List[Tuple[int, int, bool]] = []
+
+    def __repr__(self):
+        return f'<MulticastRequestPacket tok={self.token} ' \
+               f'source={self.source_static} next_hop={self.next_hop}>'
+
+    def _frame_increment(self):
+
+        # An address and a number of descendants for every node, and a bitmap
+        # of the destinations.
+        tree_len = len(self.tree)
+        return tree_len * 2 + bitmap_frame_count(tree_len)
+
+    def _header_frame_increment(self):
+        return 0
+
+    def subtrees(self):
+        """
+        Divide l'albero del pacchetto nei sottoalberi dei figli del nodo a
+        cui è indirizzato.
+
+        :return: La lista dei sottoalberi, in preordine.
+        """
+
+        tree = self.tree
+        subtrees = []
+        i = 1
+
+        while i < len(tree):
+            _, descendants, _ = tree[i]
+            subtrees.append(tree[i:i + descendants + 1])
+            i += descendants + 1
+
+        return subtrees
+
+
+class MulticastResponsePacket(ResponsePacket):
+    """
+    Risposte aggregate dei destinatari di un MulticastRequestPacket.
+
+    Ogni nodo attraversato aggiunge la propria risposta, se è un
+    destinatario, e il proprio report della tabella del rumore:
+    `noise_sources` contiene l'indirizzo statico del nodo che ha inviato
+    ciascun report di `noise_tables`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.noise_sources: List[int] = []
+        self.answers: List[Tuple[int, object, int]] = []
+
+    def __repr__(self):
+        return f'<MulticastResponsePacket tok={self.token} ' \
+               f'source={self.source_static} next_hop={self.next_hop}>'
+
+    def _frame_increment(self):
+
+        # The address of every report, and the address and the length of
+        # every answer before its payload.
+        return len(self.noise_sources) + sum(
+            2 + payload_frame_count(payload, length)
+            for _, payload, length in self.answers
+        )
+
+    def _header_frame_increment(self):
+        return 0
+
+    def merge(self, other: 'MulticastResponsePacket'):
+        """
+        Aggiunge al pacchetto le risposte e i report di un altro.
+        """
+
+        self.answers.extend(other.answers)
+        self.noise_tables.extend(other.noise_tables)
+        self.noise_sources.extend(other.noise_sources)
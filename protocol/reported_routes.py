@@ -0,0 +1,122 @@
+"""
+Contiene il modello con cui il master ricostruisce le tabelle di routing
+degli slave, per stabilire quando può indirizzarli dinamicamente.
+
+Uno slave inoltra una richiesta indirizzata dinamicamente secondo la tabella
+di routing inviata con il suo ultimo report. Nella tabella compaiono solo i
+vicini che ha sentito trasmettere, ognuno con l'ultimo indirizzo logico con
+cui lo ha sentito, e ogni indirizzo logico è associato a un solo nodo.
+
+Il master ricostruisce la tabella di ogni nodo dalle trasmissioni di cui è
+a conoscenza (`heard_routing_table` del NodeData), tiene traccia dei vicini
+di cui non può conoscere la voce (`unknown_routing_entries`) e, a ogni
+report del nodo, ne conserva una copia (`reported_routing_table` e
+`reported_unknown_entries`). Le voci diventano incerte per le trasmissioni
+di transazioni scadute, per i nuovi collegamenti e per i sottoalberi di una
+richiesta multicast che non hanno risposto, e tornano note con il report
+successivo del nodo.
+"""
+
+from typing import Iterable, Optional
+
+import networkx as nx
+
+from protocol.node_data_manager import NodeDataT
+from protocol.routing_table import RoutingTable
+
+
+def reported_next_hop(node: NodeDataT, logic_address) -> Optional[int]:
+    """
+    Stabilisce a quale vicino uno slave inoltra una richiesta indirizzata
+    dinamicamente, secondo la tabella di routing inviata con il suo ultimo
+    report.
+
+    :return: L'indirizzo statico del vicino, o None se il master non conosce
+    la tabella o se lo slave non può inoltrare la richiesta.
+    """
+
+    table = node.reported_routing_table
+
+    if table is None or node.reported_unknown_entries:
+        return None
+
+    next_logic_hop = table.floor_key(logic_address)
+
+    # Like the slave, which has already taken its new address.
+    if next_logic_hop is None or next_logic_hop <= node.logic_address:
+        return None
+
+    return table[next_logic_hop]
+
+
+def address_heard(graph: nx.Graph, node: NodeDataT, logic_address):
+    """
+    Registra nelle tabelle dei vicini di un nodo che questo ha trasmesso con
+    l'indirizzo logico dato.
+    """
+
+    if node not in graph:
+        return
+
+    static_addr = node.static_address
+
+    for neighbor in graph.neighbors(node):
+
+        if neighbor.heard_routing_table is None:
+            neighbor.heard_routing_table = RoutingTable()
+
+        neighbor.heard_routing_table[logic_address] = static_addr
+
+        if static_addr in neighbor.unknown_routing_entries:
+            neighbor.unknown_routing_entries -= {static_addr}
+
+
+def transmission_lost(graph: nx.Graph, node: NodeDataT,
+                      logic_addresses: Iterable[Optional[int]]):
+    """
+    Registra che un nodo può avere trasmesso con uno degli indirizzi logici
+    dati senza che il master ne abbia ricevuto il report.
+
+    Nelle tabelle dei vicini diventano incerte la voce del nodo e quelle che
+    ha sostituito; il nodo viene indirizzato staticamente fino al suo
+    prossimo report.
+    """
+
+    node.reported_routing_table = None
+
+    if node not in graph:
+        return
+
+    logic_addresses = tuple(logic_addresses)
+
+    for neighbor in graph.neighbors(node):
+        table = neighbor.heard_routing_table or {}
+
+        neighbor.unknown_routing_entries = (
+            neighbor.unknown_routing_entries.union(
+                (node.static_address,),
+                (table[addr] for addr in logic_addresses if addr in table)
+            )
+        )
+
+
+def link_heard(node1: NodeDataT, node2: NodeDataT):
+    """
+    Registra un nuovo collegamento: i due nodi possono essersi sentiti con
+    indirizzi logici che il master non conosce.
+    """
+    node1.unknown_routing_entries |= {node2.static_address}
+    node2.unknown_routing_entries |= {node1.static_address}
+
+
+def table_reported(node: NodeDataT):
+    """
+    Registra che un nodo ha inviato un report, con la tabella di routing
+    secondo cui inoltra le richieste successive.
+    """
+
+    if node.heard_routing_table is None:
+        node.heard_routing_table = RoutingTable()
+
+    node.reported_routing_table = node.heard_routing_table.snapshot()
+    node.reported_unknown_entries = node.unknown_routing_entries
@@ -1,28 +1,87 @@
+import collections
 import logging
-from typing import Optional
+from typing import Dict, Optional
 
 import simpy
 
-from infrastructure.message import CollisionSentinel
+from infrastructure.message import CollisionSentinel, make_transmission_delay
 from infrastructure.node import NetworkNode
-from protocol.packet import Packet, PacketWithSource, AckPacket
+from protocol.packet import (
+    Packet, PacketWithSource, PacketWithNextHop, AckPacket,
+    CommunicationPacket, HelloProbePacket, HelloRequestPacket,
+    HelloResponsePacket, RequestPacket, PHYSICAL_ADDRESS_BITS
+)
+from protocol.routing_table import RoutingTable
 from utils import BroadcastConditionVar
+from utils.preemption_first_resource import PreemptionFirstResource
+from utils.simpy_process import simpy_process
+from utils.table_aging import TableAging
 
 logger = logging.getLogger(__name__)
 
+# Priorities of the transmissions when link-level acks are enabled: acks
+# preempt the packets waiting for the medium.
+ACK_PRIORITY = 0
+DATA_PRIORITY = 1
+
+# A packet whose ack the node is waiting for: peer is the node it was sent
+# to (None if it has no address yet), acked triggers when the ack arrives and
+# released when the node stops waiting.
+AckWaiter = collections.namedtuple('AckWaiter', 'peer, acked, released')
+
 
 class ReThunderNode(NetworkNode):
 
+    # If set, the packets whose next hop is another node only update the
+    # tables of the node, without scheduling events or waking up the
+    # protocol process. The received messages are still broadcast on
+    # _receive_ev while someone waits on it.
+    next_hop_filtering = False
+
     def __init__(self, network, static_address: int,
-                 logic_address: Optional[int]):
+                 logic_address: Optional[int],
+                 noise_table_aging: Optional[TableAging]=None,
+                 routing_table_aging: Optional[TableAging]=None,
+                 ack_timeout: Optional[int]=None, max_retransmissions=3):
 
         super().__init__(network)
         self.static_address = static_address
         self.logic_address = logic_address
-        self.noise_table = {}
-        self.routing_table = {}
+        self.noise_table = (
+            {} if network.noise_store is None or static_address is None
+            else network.noise_store.table_for(static_address)
+        )
+        self.routing_table = RoutingTable()
+        self.noise_table_aging = noise_table_aging
+        self.routing_table_aging = routing_table_aging
         self._receive_packet_cond = BroadcastConditionVar(self.env)
 
+        # If ack_timeout is set, every hop acks the communication packets it
+        # receives, and the sender retransmits them up to max_retransmissions
+        # times if the ack doesn't arrive within ack_timeout.
+        self.ack_timeout = ack_timeout
+        self.max_retransmissions = max_retransmissions
+        self.retransmissions = 0
+
+        # The retransmissions of the packets with every token: the master
+        # counts them from the request of a transaction on (see
+        # MasterNode._complete_messages).
+        self._transaction_retransmissions = collections.Counter()
+        self._transmitter = (
+            None if ack_timeout is None else PreemptionFirstResource(self.env)
+        )
+        self._ack_waiters: Dict[int, AckWaiter] = {}
+
+        # The packets handled recently, by type, token and sender, with the
+        # time until which a copy of them is a retransmission.
+        self._accepted = collections.OrderedDict()
+
+        # Probes sent to the nodes without an address, and the ones whose
+        # answers have collided (see _probe_neighbors).
+        self.hello_probes = 0
+        self.hello_collisions = 0
+        self._garbled_receptions = 0
+
         self._receive_current_transmission_cond.callbacks.append(
             self._check_packet_callback
         )
@@ -36,27 +95,456 @@ class ReThunderNode(NetworkNode):
             self.noise_table[packet.source_static] = (
                 int(packet.frame_error_average() * 1000)
             )
+            self._touch_table_entry(self.noise_table, self.noise_table_aging,
+                                    packet.source_static)
 
     def _update_routing_table(self, packet: Packet):
 
-        if isinstance(packet, PacketWithSource):
-            self.routing_table[packet.source_logic] = packet.source_static
+        if not isinstance(packet, PacketWithSource):
+            return
+
+        routing_table = self.routing_table
+        aging = self.routing_table_aging
+        previous_address = routing_table.logic_address_of(packet.source_static)
+
+        routing_table[packet.source_logic] = packet.source_static
+
+        # The entry with the previous address of the node has been replaced.
+        if (aging is not None and previous_address is not None and
+                previous_address != packet.source_logic):
+            aging.discard(previous_address)
+
+        self._touch_table_entry(routing_table, aging, packet.source_logic)
+
+    def _touch_table_entry(self, table, aging: Optional[TableAging], key):
+
+        if aging is None:
+            return
+
+        self._evict_table_entries(table, aging.touch(key, self.env.now))
+
+    def _expire_table_entries(self):
+        """
+        Rimuove dalle tabelle del nodo le voci più vecchie dell'età massima
+        stabilita, anche se nel frattempo non sono stati ricevuti pacchetti.
+        """
+
+        now = self.env.now
+
+        for table, aging in ((self.noise_table, self.noise_table_aging),
+                             (self.routing_table, self.routing_table_aging)):
+            if aging is not None:
+                self._evict_table_entries(table, aging.expire(now))
+
+    def _evict_table_entries(self, table, keys):
+
+        for key in keys:
+            del table[key]
+
+    def _message_received(self, value):
+
+        # The broadcast checks the packet through _check_packet_callback.
+        if (self.next_hop_filtering and
+                not self._receive_current_transmission_cond.has_waiters):
+            self._check_packet(value)
+        else:
+            super()._message_received(value)
 
     def _check_packet_callback(self, ev: simpy.Event):
+        self._check_packet(ev.value)
 
-        received = ev.value
+    def _check_packet(self, received):
 
         if received is CollisionSentinel:
-            pass
+            self._garbled_receptions += 1
         elif not isinstance(received, Packet):
             logger.error(f"{self} received something different from a packet")
         elif not received.is_readable():
-            pass
+            self._garbled_receptions += 1
+            self._unreadable_packet_received(received)
         else:
             self._update_noise_table(received)
             self._update_routing_table(received)
-            self._receive_packet_cond.broadcast(received)
+
+            if self.ack_timeout is not None:
+                if not self._handle_link_ack(received):
+                    return
+
+            elif isinstance(received, AckPacket):
+                # Without link-level acks, only the address assignments are
+                # acked.
+                if received.next_hop == self.static_address:
+                    self._ack_received(received.token)
+                return
+
+            if self._is_next_hop_of(received):
+                self._receive_packet_cond.broadcast(received)
+
+    def _unreadable_packet_received(self, packet: Packet):
+        pass
+
+    def _is_next_hop_of(self, packet: Packet):
+        return (not self.next_hop_filtering or
+                not isinstance(packet, PacketWithNextHop) or
+                packet.next_hop == self.static_address)
 
     def _receive_packet_ev(self):
         return self._receive_packet_cond.wait()
 
+    # Ack a livello di collegamento.
+
+    def _send_packet(self, packet: Packet, frames: Optional[int]=None):
+        """
+        Trasmette un pacchetto. Se gli ack a livello di collegamento sono
+        attivi, i pacchetti di comunicazione vengono ritrasmessi finché il
+        nodo successivo non ne conferma la ricezione.
+
+        :param packet: Il pacchetto da trasmettere.
+        :param frames: Il numero di frame da trasmettere la prima volta, se
+        diverso da quello del pacchetto.
+        :return: Un evento che scatta al termine della prima trasmissione.
+        """
+
+        if frames is None:
+            frames = packet.number_of_frames()
+
+        if (self.ack_timeout is None or
+                not isinstance(packet, CommunicationPacket)):
+            return self._transmit_process(packet, frames)
+
+        first_transmission = self.env.event()
+        self._transmit_reliably(packet, first_transmission, frames)
+        return first_transmission
+
+    @simpy_process
+    def _transmit_reliably(self, packet: CommunicationPacket,
+                           first_transmission: simpy.Event, frames: int):
+
+        env = self.env
+        token = packet.token
+
+        # The nodes which receive the packet modify it while forwarding, so
+        # the retransmissions use copies of the original.
+        original = packet.copy()
+
+        acked = yield from self._wait_for_ack(token, packet.next_hop)
+
+        for attempt in range(self.max_retransmissions + 1):
+
+            if attempt > 0:
+                logger.info(f"{self} retransmits {original}")
+                self.retransmissions += 1
+                self._transaction_retransmissions[token] += 1
+                packet = original.copy()
+                frames = packet.number_of_frames()
+
+                # Nodes which can't hear each other and whose packets have
+                # collided would retransmit them together after the same
+                # ack_timeout: with a MAC layer, they wait a backoff which
+                # grows with the attempts, as for a busy medium.
+                if self.mac is not None:
+                    yield env.timeout(self.mac.backoff.delay(attempt))
+
+            yield from self._transmit_with_priority(packet, DATA_PRIORITY,
+                                                    frames)
+
+            if not first_transmission.triggered:
+                first_transmission.succeed()
+
+            yield acked | env.timeout(self.ack_timeout)
+
+            # The packet being received when the timeout expires may be the
+            # ack, or the next hop forwarding the packet.
+            while not acked.triggered and self.is_busy():
+                yield self._idle_ev()
+
+            if acked.triggered:
+                return True
+
+        self._release_ack_waiter(token, acked)
+
+        logger.warning(f"{self} received no ack for {original}")
+        return False
+
+    def _transmit_with_priority(self, packet: Packet, priority,
+                                frames: Optional[int]=None):
+
+        with self._transmitter.request(
+                priority=priority, preempt=priority == ACK_PRIORITY
+        ) as request:
+
+            yield request
+
+            transmission = self._transmit_process(
+                packet, frames or packet.number_of_frames()
+            )
+
+            try:
+                yield transmission
+            except simpy.Interrupt:
+                # Preempted by an ack, which is transmitted as soon as the
+                # packet already on the medium ends.
+                yield transmission
+
+    def _handle_link_ack(self, packet: Packet):
+        """
+        Gestisce gli ack dei pacchetti ricevuti e inviati dal nodo.
+
+        :param packet: Il pacchetto ricevuto.
+        :return: True se il pacchetto va passato al protocollo, False se è
+        un ack o un duplicato di un pacchetto già ricevuto.
+        """
+
+        if isinstance(packet, AckPacket):
+            if packet.next_hop == self.static_address:
+                self._ack_received(packet.token)
+            return False
+
+        if not isinstance(packet, CommunicationPacket):
+            return True
+
+        # A packet from the node the ack is expected from, like the one it
+        # forwards to the following hop, shows that it has received the one
+        # sent to it, even if its ack was lost. A request sent to this node
+        # doesn't: it's a retransmission by a node which hasn't received the
+        # response yet.
+        if not (isinstance(packet, RequestPacket) and
+                packet.next_hop == self.static_address):
+            self._ack_received(packet.token, packet.source_static)
+
+        if packet.next_hop != self.static_address:
+            return True
+
+        self.env.process(
+            self._transmit_with_priority(AckPacket(of=packet), ACK_PRIORITY)
+        )
+
+        # The sender retransmits a packet whose ack was lost: it is acked
+        # again, but not handled twice. The packets of concurrent
+        # transactions may arrive in between.
+        key = (type(packet), packet.token, packet.source_static)
+        now = self.env.now
+        accepted = self._accepted
+
+        while accepted and next(iter(accepted.values())) < now:
+            accepted.popitem(last=False)
+
+        if accepted.get(key, -1) >= now:
+            logger.info(f"{self} received a duplicate of {packet}")
+            return False
+
+        duplicate_window = (self.max_retransmissions + 1) * (
+            self.ack_timeout +
+            make_transmission_delay(self._transmission_speed,
+                                    packet.number_of_frames())
+        )
+
+        accepted.pop(key, None)
+        accepted[key] = now + duplicate_window
+        return True
+
+    def _wait_for_ack(self, token, peer):
+        """
+        Registra l'attesa dell'ack di un pacchetto inviato a peer.
+
+        Gli ack riportano solo il token del pacchetto: se il nodo attende
+        già l'ack di un altro pacchetto con lo stesso token, la registrazione
+        attende che l'attesa precedente termini, perché l'ack non venga
+        attribuito al pacchetto sbagliato.
+
+        :return: L'evento che scatta all'arrivo dell'ack.
+        """
+
+        waiters = self._ack_waiters
+
+        while token in waiters:
+            yield waiters[token].released
+
+        acked = self.env.event()
+        waiters[token] = AckWaiter(peer, acked, self.env.event())
+
+        return acked
+
+    def _release_ack_waiter(self, token, acked):
+
+        waiter = self._ack_waiters.get(token)
+
+        if waiter is not None and waiter.acked is acked:
+            del self._ack_waiters[token]
+            waiter.released.succeed()
+
+    def _ack_received(self, token, source_static=None):
+
+        waiter = self._ack_waiters.get(token)
+
+        if waiter is None:
+            return
+
+        if source_static is None or source_static == waiter.peer:
+            waiter.acked.succeed()
+            self._release_ack_waiter(token, waiter.acked)
+
+    # Scoperta dei vicini.
+
+    def _probe_neighbors(self, first_static_address, max_nodes):
+        """
+        Assegna gli indirizzi ai nodi senza indirizzo che sentono il nodo.
+
+        Il nodo invita a rispondere i nodi il cui indirizzo fisico inizia con
+        un prefisso, a partire da quello vuoto. Se le risposte collidono, il
+        prefisso viene esteso di un bit in entrambi i modi, e i due prefissi
+        vengono provati in ordine, finché ogni nodo risponde da solo.
+
+        :param first_static_address: Il primo indirizzo statico da
+        assegnare. I nodi ricevono indirizzi statici consecutivi, e lo
+        stesso valore come indirizzo logico provvisorio.
+        :param max_nodes: Il numero massimo di nodi a cui assegnare un
+        indirizzo.
+        :return: Le coppie (indirizzo fisico, indirizzo statico) dei nodi
+        che hanno confermato l'indirizzo.
+        """
+
+        found = []
+        prefixes = [(0, 0)]
+        window = self._hello_window()
+
+        while prefixes and len(found) < max_nodes:
+            prefix, length = prefixes.pop()
+
+            probe = HelloProbePacket()
+            probe.physical_address = prefix << (PHYSICAL_ADDRESS_BITS - length)
+            probe.prefix_length = length
+            probe.source_static = self.static_address
+            probe.source_logic = self.logic_address
+
+            self.hello_probes += 1
+            garbled_receptions = self._garbled_receptions
+
+            yield self._send_packet(probe)
+
+            requests = yield from self._collect_packets(HelloRequestPacket,
+                                                        window)
+            collided = self._garbled_receptions != garbled_receptions
+
+            # With a MAC layer the answers may not overlap, and are all
+            # readable.
+            physical_addrs = sorted({
+                request.physical_address for request in requests
+                if probe.matches(request.physical_address)
+            })
+
+            for physical_addr in physical_addrs:
+
+                if len(found) == max_nodes:
+                    collided = True
+                    break
+
+                static_addr = first_static_address + len(found)
+
+                if (yield from self._assign_addresses(physical_addr,
+                                                      static_addr)):
+                    found.append((physical_addr, static_addr))
+
+            if not collided:
+                continue
+
+            self.hello_collisions += 1
+
+            if length == PHYSICAL_ADDRESS_BITS:
+                logger.error(f"{self} found many nodes with physical address "
+                             f"{prefix}")
+            else:
+                prefixes.append(((prefix << 1) | 1, length + 1))
+                prefixes.append((prefix << 1, length + 1))
+
+        return found
+
+    def _assign_addresses(self, physical_address, static_address):
+        """
+        Assegna gli indirizzi a un nodo e ne attende la conferma.
+
+        :return: True se il nodo ha confermato.
+        """
+
+        # Another token if a packet with the one of the address is waiting
+        # for its ack, since the acks only carry the token.
+        tokens = 1 << Packet.TOKEN_BIT_SIZE
+        token = next(
+            (token for token in (static_address % tokens, *range(tokens))
+             if token not in self._ack_waiters),
+            static_address % tokens
+        )
+
+        response = HelloResponsePacket()
+        response.token = token
+        response.physical_address = physical_address
+        response.source_static = self.static_address
+        response.source_logic = self.logic_address
+        response.new_static_address = static_address
+        response.new_logic_address = static_address
+
+        acked = yield from self._wait_for_ack(token, None)
+
+        for _ in range(self.max_retransmissions + 1):
+
+            yield self._send_packet(response)
+            yield acked | self.env.timeout(self._hello_window())
+
+            if acked.triggered:
+                logger.info(f"{self} assigned {static_address} to "
+                            f"{physical_address}")
+                return True
+
+        self._release_ack_waiter(token, acked)
+
+        logger.warning(f"{self} couldn't assign {static_address} to "
+                       f"{physical_address}")
+        return False
+
+    def _collect_packets(self, packet_type, delay):
+        """
+        Raccoglie i pacchetti di un tipo ricevuti entro un tempo.
+        """
+
+        timeout = self.env.timeout(delay)
+        received = []
+
+        while True:
+            recv_ev = self._receive_packet_ev()
+            cond_value = yield recv_ev | timeout
+
+            if recv_ev in cond_value and isinstance(recv_ev.value,
+                                                    packet_type):
+                received.append(recv_ev.value)
+
+            if timeout in cond_value:
+                return received
+
+    def _hello_window(self):
+        """
+        Stima il tempo entro cui arrivano le risposte dei vicini a un
+        pacchetto trasmesso dal nodo.
+        """
+
+        transmission_delay = make_transmission_delay(
+            self._transmission_speed, HelloResponsePacket().number_of_frames()
+        )
+
+        return (transmission_delay + 50) * 2
+
+    def _probe_duration(self, max_nodes):
+        """
+        Stima il tempo massimo di _probe_neighbors: ogni nodo trovato può
+        richiedere fino a due prove per bit dell'indirizzo fisico, e
+        un'assegnazione con tutte le ritrasmissioni.
+        """
+
+        probe_delay = make_transmission_delay(
+            self._transmission_speed, HelloProbePacket().number_of_frames()
+        )
+        window = self._hello_window()
+
+        probes = 2 * PHYSICAL_ADDRESS_BITS * max_nodes + 1
+        assignments = max_nodes * (self.max_retransmissions + 1)
+
+        return probes * (probe_delay + window) + assignments * 2 * window
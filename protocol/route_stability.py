@@ -0,0 +1,128 @@
+"""
+Contiene la politica di stabilità dell'albero dei cammini minimi del master.
+
+Il rumore degli archi cambia di poco a ogni risposta, e basta questo per far
+passare un nodo da un padre a un altro di costo quasi uguale. Ogni cambio di
+padre costa una serie di scambi di indirizzi logici, che vanno poi
+comunicati agli slave nelle richieste successive. Con RouteStability un
+nodo cambia padre solo se il nuovo cammino è migliore di quello attuale di
+almeno un margine, e solo se lo rimane per un tempo minimo.
+"""
+
+from typing import Any, Dict
+
+import networkx as nx
+
+from utils.graph import dijkstra
+
+
+class RouteStability:
+
+    def __init__(self, margin=0.0, min_dwell=0):
+        """
+        :param margin: La frazione di cui viene ridotto il peso degli archi
+        dell'albero attuale: un nodo cambia padre solo se il nuovo cammino
+        costa meno di quello attuale ridotto di questa frazione.
+        :param min_dwell: Il tempo per cui un nuovo padre deve rimanere il
+        migliore prima che il nodo lo adotti.
+        """
+
+        if not 0 <= margin < 1:
+            raise ValueError('margin must be between 0 and 1')
+
+        if min_dwell < 0:
+            raise ValueError('min_dwell must not be negative')
+
+        self.margin = margin
+        self.min_dwell = min_dwell
+
+        # Changes of parent which the shortest paths would have made, but
+        # the policy has prevented.
+        self.avoided_changes = 0
+
+        # Node -> (preferred parent, since when it has been preferred).
+        self._candidates: Dict[Any, Any] = {}
+
+        # Node -> parent of the shortest path which it hasn't adopted.
+        self._avoided: Dict[Any, Any] = {}
+
+    def __repr__(self):
+        return (f'<RouteStability margin={self.margin} '
+                f'min_dwell={self.min_dwell}>')
+
+    def stable_parents(self, graph: nx.Graph, root, current_tree: nx.DiGraph,
+                       now, weight='weight') -> Dict[Any, Any]:
+        """
+        Sceglie il padre di ogni nodo nel nuovo albero.
+
+        :param graph: Il grafo dei nodi.
+        :param root: La radice dell'albero.
+        :param current_tree: L'albero attuale.
+        :param now: L'istante attuale.
+        :param weight: L'attributo degli archi che ne indica il peso.
+        :return: Il padre di ogni nodo raggiungibile (None per la radice).
+        """
+
+        keep = 1 - self.margin
+
+        def stable_weight(u, v, data):
+            w = data.get(weight, 1)
+            return w * keep if current_tree.has_edge(u, v) else w
+
+        dist, parents = dijkstra(graph, root, weight=stable_weight)
+        parents = {node: parents[node] for node in dist}
+
+        if self.min_dwell > 0:
+            self._defer_changes(graph, current_tree, parents, dist, now)
+
+        _, shortest_parents = dijkstra(graph, root, weight=weight)
+        avoided = self._avoided
+
+        for node, parent in parents.items():
+            shortest_parent = shortest_parents[node]
+
+            if (shortest_parent == parent or node not in current_tree or
+                    not current_tree.has_edge(parent, node)):
+                avoided.pop(node, None)
+
+            elif avoided.get(node) != shortest_parent:
+                # Counted once for as long as the same parent is refused.
+                avoided[node] = shortest_parent
+                self.avoided_changes += 1
+
+        return parents
+
+    def _defer_changes(self, graph, current_tree, parents, dist, now):
+
+        candidates = self._candidates
+
+        for node in sorted(dist, key=dist.get):
+            parent = parents[node]
+
+            if parent is None or node not in current_tree:
+                continue
+
+            old_parent = next(iter(current_tree.predecessors_iter(node)), None)
+
+            if old_parent == parent or not graph.has_edge(old_parent, node):
+                candidates.pop(node, None)
+                continue
+
+            candidate, since = candidates.get(node, (None, None))
+
+            if candidate != parent:
+                candidates[node] = (parent, now)
+                since = now
+
+            if now - since >= self.min_dwell:
+                del candidates[node]
+                continue
+
+            # The old parent is kept, unless it now descends from the node.
+            ancestor = old_parent
+
+            while ancestor is not None and ancestor != node:
+                ancestor = parents.get(ancestor)
+
+            if ancestor is None and old_parent in parents:
+                parents[node] = old_parent
@@ -0,0 +1,134 @@
+import collections.abc
+
+from sortedcontainers import SortedDict
+
+
+class RoutingTable(collections.abc.MutableMapping):
+    """
+    Tabella di routing dei nodi, che associa gli indirizzi logici dei nodi
+    vicini ai loro indirizzi statici.
+
+    Ogni nodo compare al più una volta: quando gli viene associato un nuovo
+    indirizzo logico, la voce con quello precedente viene rimossa.
+
+    Le chiavi sono mantenute ordinate, in modo che la ricerca del prossimo
+    salto (il massimo indirizzo logico non superiore alla destinazione)
+    richieda tempo logaritmico.
+
+    Le tabelle sono copy-on-write: snapshot() restituisce in tempo costante
+    una tabella che condivide i dati con quella originale, e i dati vengono
+    copiati solo quando una delle due tabelle viene modificata mentre la
+    condivisione è ancora in corso. Ogni modifica effettiva incrementa
+    `version`, che nelle snapshot resta quello del momento in cui sono state
+    create.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._data = SortedDict()
+        self._logic_addresses = {}
+        self._shared = False
+        self.version = 0
+
+        self.update(*args, **kwargs)
+        self.version = 0
+
+    def __repr__(self):
+        return f'RoutingTable({dict(self._data)!r}, version={self.version})'
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, logic_address):
+        return logic_address in self._data
+
+    def __getitem__(self, logic_address):
+        return self._data[logic_address]
+
+    def __setitem__(self, logic_address, static_address):
+
+        data = self._data
+
+        if (logic_address in data and
+                data[logic_address] == static_address):
+            return
+
+        data = self._own_data()
+        logic_addresses = self._logic_addresses
+
+        if logic_address in data:
+            del logic_addresses[data[logic_address]]
+
+        # The node has changed its logic address.
+        previous_address = logic_addresses.get(static_address)
+
+        if previous_address is not None:
+            del data[previous_address]
+
+        data[logic_address] = static_address
+        logic_addresses[static_address] = logic_address
+        self.version += 1
+
+    def __delitem__(self, logic_address):
+
+        if logic_address not in self._data:
+            raise KeyError(logic_address)
+
+        data = self._own_data()
+        del self._logic_addresses[data.pop(logic_address)]
+        self.version += 1
+
+    def logic_address_of(self, static_address):
+        """
+        Restituisce l'indirizzo logico associato a un nodo, o None se il
+        nodo non è nella tabella.
+        """
+        return self._logic_addresses.get(static_address)
+
+    def _own_data(self) -> SortedDict:
+
+        if self._shared:
+            self._data = self._data.copy()
+            self._logic_addresses = self._logic_addresses.copy()
+            self._shared = False
+
+        return self._data
+
+    def snapshot(self) -> 'RoutingTable':
+        """
+        Restituisce una copia della tabella in tempo costante. I dati
+        vengono condivisi finché una delle due tabelle non viene modificata.
+
+        :return: La copia della tabella.
+        """
+
+        snapshot = RoutingTable.__new__(RoutingTable)
+        snapshot._data = self._data
+        snapshot._logic_addresses = self._logic_addresses
+        snapshot.version = self.version
+        snapshot._shared = self._shared = True
+
+        return snapshot
+
+    __copy__ = copy = snapshot
+
+    def floor_key(self, logic_address, default=None):
+        """
+        Restituisce il massimo indirizzo logico nella tabella che non supera
+        quello dato.
+
+        :param logic_address: L'indirizzo logico da cercare.
+        :param default: Il valore restituito se nessun indirizzo è minore o
+        uguale a quello dato.
+        :return: L'indirizzo logico trovato, o default.
+        """
+
+        data = self._data
+        index = data.bisect_right(logic_address)
+
+        if index == 0:
+            return default
+
+        return data.keys()[index - 1]
@@ -0,0 +1,99 @@
+"""
+Contiene le politiche con cui il master sceglie il prossimo messaggio da
+inviare tra quelli in coda.
+
+Una politica è un oggetto con un metodo select(master, pending, now), che
+riceve la lista dei messaggi in attesa, nell'ordine di arrivo, e restituisce
+l'indice di quello da servire.
+"""
+
+from typing import Optional
+
+
+class FifoPolicy:
+    """
+    Serve i messaggi nell'ordine di arrivo.
+    """
+
+    # noinspection PyMethodMayBeStatic
+    def select(self, master, pending, now):
+        return 0
+
+
+class TreeOrderPolicy:
+    """
+    Serve le destinazioni nel preordine inverso dell'albero dei cammini
+    minimi, cioè per indirizzi logici decrescenti, ripartendo dall'ultimo
+    nodo dopo la radice. Ogni nodo è servito dopo i suoi discendenti, per
+    cui le richieste successive percorrono parte del cammino appena
+    percorso, i cui indirizzi logici sono stati appena confermati e le cui
+    tabelle di routing sono appena state inviate al master.
+
+    Un messaggio che attende da più di `max_delay` viene servito prima
+    degli altri.
+    """
+
+    def __init__(self, max_delay: Optional[int]=None):
+        self.max_delay = max_delay
+        self._last_logic_address = 0
+
+    def select(self, master, pending, now):
+
+        if self.max_delay is not None:
+            overdue = [i for i, request in enumerate(pending)
+                       if now - request.enqueue_time > self.max_delay]
+
+            if overdue:
+                return self._served(master, pending, overdue[0])
+
+        nodes = master._node_manager
+        last = self._last_logic_address
+        modulus = len(nodes.logic_addresses_view())
+
+        def distance(i):
+            logic_address = self._logic_address(master, pending[i])
+            return (last - logic_address) % modulus, i
+
+        return self._served(master, pending,
+                            min(range(len(pending)), key=distance))
+
+    @staticmethod
+    def _logic_address(master, request):
+
+        # A multicast request covers the whole tree, from its root.
+        dest_addr = getattr(request, 'dest_static_addr', 0)
+
+        # The nodes of a segment are in the place of their gateway.
+        dest_addr = getattr(dest_addr, 'segment', dest_addr)
+
+        try:
+            return master._node_manager[dest_addr].logic_address
+        except KeyError:
+            return 0
+
+    def _served(self, master, pending, index):
+        self._last_logic_address = self._logic_address(master, pending[index])
+        return index
+
+
+class PriorityAgingPolicy:
+    """
+    Serve il messaggio con la priorità più alta, cioè con il valore minore.
+    La priorità di un messaggio cresce di `aging_rate` per ogni unità di
+    tempo passata in coda, per cui nessun messaggio attende indefinitamente.
+    A parità di priorità i messaggi sono serviti in ordine di arrivo.
+    """
+
+    def __init__(self, aging_rate=0.01):
+        self.aging_rate = aging_rate
+
+    def select(self, master, pending, now):
+
+        aging_rate = self.aging_rate
+
+        def effective_priority(i):
+            request = pending[i]
+            waited = now - request.enqueue_time
+            return request.priority - aging_rate * waited, i
+
+        return min(range(len(pending)), key=effective_priority)
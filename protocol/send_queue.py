@@ -0,0 +1,242 @@
+"""
+Contiene la coda dei messaggi che il master deve inviare.
+
+La coda può avere una capacità massima, complessiva e per destinazione.
+Quando un messaggio non entra, la politica della coda stabilisce cosa
+succede: con `block` il messaggio attende che si liberi spazio, con
+`drop_oldest` viene scartato il messaggio più vecchio, con `drop_newest` e
+`reject` viene scartato quello appena arrivato. Nell'ultimo caso il rifiuto
+è segnalato a chi ha inviato il messaggio.
+"""
+
+import collections
+import enum
+from typing import Optional
+
+
+class QueuePolicy(enum.Enum):
+    block = 0
+    drop_oldest = 1
+    drop_newest = 2
+    reject = 3
+
+
+class SendQueueStats:
+    """
+    Statistiche sull'occupazione di una SendQueue.
+    """
+
+    def __init__(self):
+        self.admitted = 0
+        self.blocked = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self._depth = 0
+        self._depth_area = 0
+        self._last_change = 0
+
+    def __repr__(self):
+        return (f'<SendQueueStats admitted={self.admitted} '
+                f'dropped={self.dropped} rejected={self.rejected}>')
+
+    def depth_changed(self, depth, now):
+
+        self._depth_area += self._depth * (now - self._last_change)
+        self._depth = depth
+        self._last_change = now
+
+        self.max_depth = max(self.max_depth, depth)
+
+    def mean_depth(self, now):
+        """
+        La lunghezza media della coda, pesata sul tempo, dall'inizio della
+        simulazione fino a `now`.
+        """
+
+        if now <= 0:
+            return 0
+
+        area = self._depth_area + self._depth * (now - self._last_change)
+        return area / now
+
+
+class SendQueue:
+
+    def __init__(self, env, capacity: Optional[int]=None,
+                 policy=QueuePolicy.block,
+                 per_destination_limit: Optional[int]=None,
+                 on_discard=None):
+        """
+        :param env: L'environment della simulazione.
+        :param capacity: Il numero massimo di messaggi in coda, o None.
+        :param policy: La QueuePolicy da applicare ai messaggi che non
+        entrano nella coda.
+        :param per_destination_limit: Il numero massimo di messaggi in coda
+        per la stessa destinazione, o None.
+        :param on_discard: Funzione chiamata con un messaggio e la politica
+        che lo ha scartato.
+        """
+
+        if capacity is not None and capacity < 1:
+            raise ValueError('capacity must be positive')
+
+        if per_destination_limit is not None and per_destination_limit < 1:
+            raise ValueError('per_destination_limit must be positive')
+
+        self.env = env
+        self.capacity = capacity
+        self.policy = policy
+        self.per_destination_limit = per_destination_limit
+        self.on_discard = on_discard or (lambda item, policy: None)
+        self.stats = SendQueueStats()
+        self.items = []
+        self._per_destination = collections.Counter()
+        self._getters = collections.deque()
+        self._blocked = collections.deque()
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def _destination(item):
+        # Multicast requests have no single destination.
+        return getattr(item, 'dest_static_addr', None)
+
+    def _fits(self, item):
+
+        if self.capacity is not None and len(self.items) >= self.capacity:
+            return False
+
+        dest = self._destination(item)
+
+        return (self.per_destination_limit is None or dest is None or
+                self._per_destination[dest] < self.per_destination_limit)
+
+    def put(self, item):
+        """
+        Mette in coda un messaggio.
+
+        :return: Un evento che scatta quando il messaggio entra nella coda,
+        con valore True, o viene scartato, con valore False.
+        """
+
+        admission = self.env.event()
+
+        if self._fits(item):
+            self._append(item)
+            admission.succeed(True)
+            return admission
+
+        policy = self.policy
+
+        if policy is QueuePolicy.block:
+            self.stats.blocked += 1
+            self._blocked.append((item, admission))
+
+        elif policy is QueuePolicy.drop_oldest:
+            self._discard(self._oldest_to_drop(item), policy)
+            self._append(item)
+            admission.succeed(True)
+
+        else:
+            if policy is QueuePolicy.reject:
+                self.stats.rejected += 1
+            else:
+                self.stats.dropped += 1
+
+            self.on_discard(item, policy)
+            admission.succeed(False)
+
+        return admission
+
+    def _oldest_to_drop(self, item):
+
+        dest = self._destination(item)
+
+        # If only the destination is over its limit, its oldest message
+        # makes room for the new one.
+        if (self.per_destination_limit is not None and dest is not None and
+                self._per_destination[dest] >= self.per_destination_limit):
+            return next(i for i in self.items if self._destination(i) == dest)
+
+        return self.items[0]
+
+    def _discard(self, item, policy):
+        self._remove(item)
+        self.stats.dropped += 1
+        self.on_discard(item, policy)
+
+    def get(self):
+        """
+        Toglie dalla coda il primo messaggio.
+
+        :return: Un evento che scatta con il messaggio, appena ce n'è uno.
+        """
+
+        ev = self.env.event()
+        self._getters.append(ev)
+        self._serve_getters()
+        return ev
+
+    def remove(self, item):
+        """
+        Toglie un messaggio dalla coda, liberando il suo posto.
+        """
+        self._remove(item)
+        self._admit_blocked()
+
+    def unget(self, item):
+        """
+        Rimette in testa alla coda un messaggio ottenuto tramite get, che
+        non può ancora essere inviato. Se nel frattempo è entrato un
+        messaggio bloccato, la coda supera per poco la propria capacità.
+        """
+
+        self.items.insert(0, item)
+        self._per_destination[self._destination(item)] += 1
+        self.stats.depth_changed(len(self.items), self.env.now)
+        self._serve_getters()
+
+    def swap_front(self, item, taken):
+        """
+        Rimette in testa alla coda un messaggio ottenuto tramite get, al
+        posto di un altro che viene tolto. L'occupazione della coda non
+        cambia, per cui i messaggi bloccati continuano ad attendere.
+        """
+
+        self.items.remove(taken)
+        self.items.insert(0, item)
+
+        self._per_destination[self._destination(taken)] -= 1
+        self._per_destination[self._destination(item)] += 1
+
+    def _append(self, item):
+        self.items.append(item)
+        self._per_destination[self._destination(item)] += 1
+        self.stats.admitted += 1
+        self.stats.depth_changed(len(self.items), self.env.now)
+        self._serve_getters()
+
+    def _remove(self, item):
+        self.items.remove(item)
+        self._per_destination[self._destination(item)] -= 1
+        self.stats.depth_changed(len(self.items), self.env.now)
+
+    def _serve_getters(self):
+
+        while self._getters and self.items:
+            item = self.items[0]
+            self._remove(item)
+            self._getters.popleft().succeed(item)
+
+        self._admit_blocked()
+
+    def _admit_blocked(self):
+
+        blocked = self._blocked
+
+        while blocked and self._fits(blocked[0][0]):
+            item, admission = blocked.popleft()
+            self._append(item)
+            admission.succeed(True)
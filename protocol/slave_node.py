@@ -1,29 +1,106 @@
+import collections
 import logging
-from copy import copy
+from typing import Optional
 
+from infrastructure.message import make_transmission_delay
 from protocol.packet import (
-    Packet, RequestPacket, ResponsePacket, AddressType
+    Packet, PacketWithSource, RequestPacket, ResponsePacket, AddressType,
+    NoiseReport, CommunicationPacket, MulticastRequestPacket,
+    MulticastResponsePacket, CoalescedPayload, AckPacket, HelloProbePacket,
+    HelloRequestPacket, HelloResponsePacket, MAX_PAYLOAD_LENGTH,
+    PROBED_NODE_LENGTH
 )
 from protocol.rethunder_node import ReThunderNode
+from protocol.routing_table import RoutingTable
 from utils.func import singledispatchmethod
 from utils.simpy_process import simpy_process
+from utils.table_aging import TableAging
 from types import MethodType
 
 logger = logging.getLogger(__name__)
 
 
+class MulticastCollection:
+    """
+    Stato di uno slave che inoltra una richiesta multicast ai propri figli
+    e ne raccoglie le risposte.
+    """
+
+    def __init__(self, request: MulticastRequestPacket, parent: int,
+                 response: MulticastResponsePacket):
+        """
+        :param request: La richiesta ricevuta, da cui vengono copiate quelle
+        inoltrate ai figli.
+        :param parent: L'indirizzo statico del nodo da cui è arrivata la
+        richiesta, a cui va inviata la risposta.
+        :param response: La risposta in cui vengono aggregate quelle dei
+        figli.
+        """
+
+        self.request = request
+        self.parent = parent
+        self.response = response
+        self.subtrees = collections.deque(request.subtrees())
+        self.current_child: Optional[int] = None
+
+
 class SlaveNode(ReThunderNode):
 
+    next_hop_filtering = True
+
     # noinspection PyMethodMayBeStatic
     def on_message_received(self, payload, payload_length):
         return None, 0
 
-    def __init__(self, network, static_address: int, on_message_received=None):
+    def __init__(self, network, static_address: Optional[int],
+                 on_message_received=None,
+                 noise_report_threshold=0, noise_full_report_interval=16,
+                 noise_table_aging: Optional[TableAging]=None,
+                 routing_table_aging: Optional[TableAging]=None,
+                 ack_timeout: Optional[int]=None, max_retransmissions=3,
+                 cut_through=False, physical_address: Optional[int]=None):
+
+        if static_address is None and physical_address is None:
+            raise ValueError('A node without a static address needs a '
+                             'physical address')
+
+        super().__init__(network, static_address, None,
+                         noise_table_aging, routing_table_aging,
+                         ack_timeout, max_retransmissions)
+
+        # The entries of the subtree are needed to forward the requests (see
+        # _request_packet_received), so they don't age and the others are
+        # evicted first.
+        if (routing_table_aging is not None and
+                routing_table_aging.pinned is None):
+            routing_table_aging.pinned = self._forwards_to
+
+        # A node without a static address receives it, with a logic
+        # address, from the discovery of the master (see
+        # MasterNode.discover).
+        self.physical_address = physical_address
+        self._noise_store = network.noise_store
+
+        # If set, a generator which creates the response to the last request
+        # received, run by run_proc when the node can't answer immediately.
+        self._deferred_response = None
+
+        # If set, the node starts forwarding a packet as soon as its header
+        # has been received, instead of waiting for the whole packet.
+        self.cut_through = cut_through
+
+        self.last_sent_routing_table = RoutingTable()
+        self._previous_node_static_addr = None
 
-        super().__init__(network, static_address, None)
+        self.noise_report_threshold = noise_report_threshold
+        self.noise_full_report_interval = noise_full_report_interval
+        self._reported_noise_table = {}
+        self._changed_noise_sources = set()
+        self._evicted_noise_sources = set()
+        self._reports_since_full = 0
+        self._full_noise_report_due = True
 
-        self.last_sent_routing_table = {}
-        self._previous_node_static_addr = None
+        self._multicast: Optional[MulticastCollection] = None
 
         self.run_until = lambda: False
 
@@ -42,13 +119,177 @@ class SlaveNode(ReThunderNode):
         while not self.run_until():
 
             received = yield self._receive_packet_ev()  # type: Packet
+            received_frames = received.number_of_frames()
             response = self._handle_received(received)  # type: Packet
 
+            if self._deferred_response is not None:
+                deferred, self._deferred_response = (
+                    self._deferred_response, None
+                )
+                response = yield from deferred
+
             if response is not None:
                 logger.debug(f"{self} is sending {response}")
-                self._transmit_process(
-                    response, response.number_of_frames()
-                )
+                self._send_packet(response, self._frames_to_forward(
+                    response, received, received_frames
+                ))
+
+    def _frames_to_forward(self, response: Packet, received: Packet,
+                           received_frames: int) -> Optional[int]:
+        """
+        Calcola quanti frame di un pacchetto inoltrato restano da trasmettere
+        al termine della sua ricezione.
+
+        La ricezione di un pacchetto viene notificata solo al suo termine.
+        In modalità cut-through l'inoltro sarebbe iniziato dopo la ricezione
+        dell'intestazione: i frame trasmessi nel frattempo, sovrapposti a
+        quelli ricevuti, vengono tolti dalla trasmissione, che termina così
+        nello stesso istante.
+
+        :param response: Il pacchetto da trasmettere.
+        :param received: Il pacchetto ricevuto.
+        :param received_frames: Il numero di frame del pacchetto ricevuto.
+        :return: Il numero di frame da trasmettere, o None se il pacchetto va
+        trasmesso interamente.
+        """
+
+        if not self.cut_through or response is not received:
+            return None
+
+        overlapping_frames = received_frames - received.header_frames()
+        return max(response.number_of_frames() - overlapping_frames, 1)
+
+    def _unreadable_packet_received(self, packet: Packet):
+
+        # A node in cut-through mode has already started forwarding a packet
+        # with an intact header when the errors in its tail are detected:
+        # the rest of the packet is forwarded anyway, and the next hop
+        # discards it, or forwards it in turn.
+        if not (self.cut_through and isinstance(packet, CommunicationPacket)
+                and packet.is_header_readable() and
+                packet.next_hop == self.static_address):
+            return
+
+        next_hop = self._damaged_packet_next_hop(packet)
+
+        if next_hop is None:
+            return
+
+        forwarded = packet.copy()
+        forwarded.source_static = self.static_address
+        forwarded.source_logic = self.logic_address
+        forwarded.next_hop = next_hop
+
+        logger.info(f"{self} forwards the damaged {forwarded}")
+        self._transmit_process(forwarded, forwarded.header_frames())
+
+    def _damaged_packet_next_hop(self, packet: CommunicationPacket) \
+            -> Optional[int]:
+        """
+        Stabilisce a chi inoltrare un pacchetto di cui è leggibile solo
+        l'intestazione.
+
+        :return: L'indirizzo statico del prossimo nodo, o None se il
+        pacchetto non va inoltrato.
+        """
+
+        # The multicast packets are routed through their tails, and so are
+        # the requests for this node, which carry the rest of their path.
+        if isinstance(packet, (MulticastRequestPacket,
+                               MulticastResponsePacket)):
+            return None
+
+        if isinstance(packet, ResponsePacket):
+            return self._previous_node_static_addr
+
+        if self._is_destination_of(packet):
+            return None
+
+        return self._request_next_hop(packet)
+
+    def _update_noise_table(self, packet: Packet):
+        super()._update_noise_table(packet)
+
+        if isinstance(packet, PacketWithSource):
+            self._changed_noise_sources.add(packet.source_static)
+            self._evicted_noise_sources.discard(packet.source_static)
+
+    def _evict_table_entries(self, table, keys):
+
+        if table is self.noise_table:
+            self._evicted_noise_sources.update(keys)
+
+        super()._evict_table_entries(table, keys)
+
+    def _forwards_to(self, logic_address):
+        return (self.logic_address is not None and
+                logic_address > self.logic_address)
+
+    def _snapshot_routing_table(self):
+
+        self._expire_table_entries()
+        self.last_sent_routing_table = self.routing_table.snapshot()
+
+    def _make_noise_report(self) -> NoiseReport:
+        """
+        Crea il report della tabella del rumore da aggiungere a un
+        ResponsePacket.
+
+        Il report è completo se il master lo ha richiesto, se è il primo
+        inviato dal nodo o se ne sono stati inviati
+        `noise_full_report_interval` differenziali dall'ultimo completo.
+        Altrimenti contiene solo i valori che si discostano di più di
+        `noise_report_threshold` da quelli dell'ultimo report.
+
+        Il report viene considerato ricevuto dal master finché questo non
+        chiede un aggiornamento completo tramite `code_is_noise_refresh`.
+        Le voci già riportate e poi rimosse dalla tabella per l'invecchiamento
+        vengono elencate in `removed`, anche nei report completi.
+
+        :return: Il report da inviare.
+        """
+
+        self._expire_table_entries()
+
+        noise_table = self.noise_table
+        reported = self._reported_noise_table
+        changed = self._changed_noise_sources
+
+        full = (self._full_noise_report_due or
+                self._reports_since_full >= self.noise_full_report_interval)
+
+        removed = self._evicted_noise_sources.intersection(reported)
+        self._evicted_noise_sources.clear()
+
+        for addr in removed:
+            del reported[addr]
+
+        if full:
+            report = NoiseReport(noise_table, full=True)
+            reported.clear()
+            self._reports_since_full = 0
+            self._full_noise_report_due = False
+        else:
+            threshold = self.noise_report_threshold
+            report = NoiseReport(full=False)
+
+            for addr in changed:
+                noise = noise_table.get(addr)
+
+                if noise is None:
+                    continue
+
+                if (addr not in reported or
+                        abs(noise - reported[addr]) > threshold):
+                    report[addr] = noise
+
+            self._reports_since_full += 1
+
+        report.removed = removed
+        reported.update(report)
+        changed.difference_update(report)
+
+        return report
 
     def _is_destination_of(self, packet):
         if packet.code_is_addressing_static:
@@ -73,13 +314,20 @@ class SlaveNode(ReThunderNode):
         logger.info(f"{self} received {packet}")
         self._previous_node_static_addr = packet.source_static
 
+        if packet.code_is_noise_refresh:
+            self._full_noise_report_due = True
+
+        # The master addresses the node by the logic address it had before
+        # receiving the request.
+        is_destination = self._is_destination_of(packet)
+
         self.logic_address = packet.new_logic_addresses.pop(self.static_address,
                                                             self.logic_address)
 
         packet.source_static = self.static_address
         packet.source_logic = self.logic_address
 
-        if self._is_destination_of(packet):
+        if is_destination:
 
             if len(packet.path) == 0:
                 return self._make_response_packet(packet)
@@ -88,26 +336,31 @@ class SlaveNode(ReThunderNode):
             packet.destination = dest
             packet.code_is_addressing_static = dest_type is AddressType.static
 
+        next_hop = self._request_next_hop(packet)
+
+        if next_hop is None:
+            return
+
+        packet.next_hop = next_hop
+        return packet
+
+    def _request_next_hop(self, packet: RequestPacket) -> Optional[int]:
+
         if packet.code_is_addressing_static:
-            packet.next_hop = packet.destination
-        else:
-            routing_table = self.last_sent_routing_table
+            return packet.destination
 
-            next_logic_hop = max(
-                (addr for addr in routing_table.keys()
-                 if addr <= packet.destination),
-                default=None
-            )
+        routing_table = self.last_sent_routing_table
+
+        next_logic_hop = routing_table.floor_key(packet.destination)
 
-            if next_logic_hop is None or next_logic_hop <= self.logic_address:
-                logger.warning(f"{self} couldn't complete the addressing.")
-                return
+        if next_logic_hop is None or next_logic_hop <= self.logic_address:
+            logger.warning(f"{self} couldn't complete the addressing.")
+            return None
 
-            packet.next_hop = routing_table[next_logic_hop]
-            logger.debug(f"{self} dynamically addressed to node "
-                         f"{packet.next_hop}")
+        next_hop = routing_table[next_logic_hop]
+        logger.debug(f"{self} dynamically addressed to node {next_hop}")
 
-        return packet
+        return next_hop
 
     @_handle_received.register(ResponsePacket)
     def _response_packet_received(self, packet):
@@ -128,14 +381,146 @@ class SlaveNode(ReThunderNode):
 
         packet.next_hop = self._previous_node_static_addr
 
-        packet.noise_tables.append(self.noise_table)
-        self.last_sent_routing_table = copy(self.routing_table)
+        packet.noise_tables.append(self._make_noise_report())
+        self._snapshot_routing_table()
 
         return packet
 
-    def _make_response_packet(self, packet):
+    @_handle_received.register(MulticastRequestPacket)
+    def _multicast_request_received(self, packet: MulticastRequestPacket):
 
-        logger.info(f'{self} received a payload')
+        if packet.next_hop != self.static_address:
+            return None
+
+        logger.info(f"{self} received {packet}")
+
+        if packet.code_is_noise_refresh:
+            self._full_noise_report_due = True
+
+        self.logic_address = packet.new_logic_addresses.pop(self.static_address,
+                                                            self.logic_address)
+
+        response = MulticastResponsePacket()
+        response.token = packet.token
+
+        _, _, is_destination = packet.tree[0]
+
+        if is_destination:
+            logger.info(f'{self} received a payload')
+            response.answers.append((self.static_address,
+                                     *self.on_message_received(
+                                         packet.payload, packet.payload_length
+                                     )))
+
+        # The received packet is modified by the nodes that overhear it.
+        self._multicast = MulticastCollection(packet.copy(),
+                                              packet.source_static, response)
+
+        return self._next_multicast_packet()
+
+    @_handle_received.register(MulticastResponsePacket)
+    def _multicast_response_received(self, packet: MulticastResponsePacket):
+
+        if packet.next_hop != self.static_address:
+            return None
+
+        logger.info(f"{self} received {packet}")
+
+        collection = self._multicast
+
+        if (collection is None or packet.token != collection.request.token or
+                packet.source_static != collection.current_child):
+            logger.warning(f'{self} received {packet}, which was not '
+                           f'expected')
+            return None
+
+        collection.response.merge(packet)
+
+        return self._next_multicast_packet()
+
+    def _next_multicast_packet(self) -> Packet:
+        """
+        Crea il prossimo pacchetto da inviare per la richiesta multicast in
+        corso: la richiesta per il figlio successivo o, se tutti i figli
+        hanno risposto, la risposta aggregata per il padre.
+        """
+
+        collection = self._multicast
+
+        if collection.subtrees:
+            subtree = collection.subtrees.popleft()
+            child, _, _ = subtree[0]
+
+            request = collection.request.copy()
+            request.tree = subtree
+
+            subtree_addrs = {addr for addr, _, _ in subtree}
+            request.new_logic_addresses = {
+                addr: logic_addr for addr, logic_addr
+                in request.new_logic_addresses.items()
+                if addr in subtree_addrs
+            }
+            request.source_static = self.static_address
+            request.source_logic = self.logic_address
+            request.destination = child
+            request.next_hop = child
+
+            collection.current_child = child
+            self._multicast_child_timeout(
+                collection, child, self._multicast_timeout(request)
+            )
+
+            return request
+
+        self._multicast = None
+
+        response = collection.response
+        response.source_static = self.static_address
+        response.source_logic = self.logic_address
+        response.next_hop = collection.parent
+
+        response.noise_tables.append(self._make_noise_report())
+        response.noise_sources.append(self.static_address)
+        self._snapshot_routing_table()
+
+        return response
+
+    def _multicast_timeout(self, request: MulticastRequestPacket):
+        """
+        Stima il tempo entro cui deve arrivare la risposta di un figlio.
+
+        Il figlio attende a sua volta i propri figli uno alla volta, ognuno
+        per il tempo stimato allo stesso modo: l'attesa è la somma di quelle
+        per i suoi figli, più la richiesta e la risposta scambiate con il
+        figlio stesso. Ogni nodo del sottoalbero aggiunge quindi il proprio
+        scambio all'attesa di tutti i suoi antenati.
+        """
+
+        # The requests for the descendants carry a part of this tree, so
+        # they are no longer than this one.
+        transmission_delay = make_transmission_delay(
+            self._transmission_speed, request.number_of_frames()
+        )
+
+        hop_timeout = (2 * transmission_delay + 50) * 5
+
+        if self.ack_timeout is not None:
+            hop_timeout += (2 * self.max_retransmissions *
+                            (self.ack_timeout + transmission_delay))
+
+        return len(request.tree) * hop_timeout
+
+    @simpy_process
+    def _multicast_child_timeout(self, collection: MulticastCollection,
+                                 child: int, delay):
+
+        yield self.env.timeout(delay)
+
+        if self._multicast is collection and collection.current_child == child:
+            logger.info(f'{self} received no answer from {child}')
+            self._send_packet(self._next_multicast_packet())
+
+    def _new_response_packet(self, packet) -> ResponsePacket:
 
         response = ResponsePacket()
 
@@ -144,11 +529,111 @@ class SlaveNode(ReThunderNode):
         response.next_hop = self._previous_node_static_addr
         response.token = packet.token
 
-        response.noise_tables.append(copy(self.noise_table))
-        self.last_sent_routing_table = copy(self.routing_table)
+        response.noise_tables.append(self._make_noise_report())
+        self._snapshot_routing_table()
 
-        response.payload, response.payload_length = self.on_message_received(
-            packet.payload, packet.payload_length
-        )
+        return response
+
+    def _make_response_packet(self, packet):
+
+        if packet.code_is_node_init:
+            # The node probes its neighbors before answering, from run_proc.
+            self._deferred_response = self._answer_probe_request(packet)
+            return None
+
+        logger.info(f'{self} received a payload')
+
+        response = self._new_response_packet(packet)
+
+        if isinstance(packet.payload, CoalescedPayload):
+            answers = CoalescedPayload(
+                self.on_message_received(payload, payload_length)
+                for payload, payload_length in packet.payload
+            )
+
+            # The master completes the messages left without an answer as
+            # MessageOutcome.answer_too_long.
+            if answers.length > MAX_PAYLOAD_LENGTH:
+                answers = answers.truncated()
+                logger.warning(f"{self} answers only {len(answers)} of "
+                               f"{len(packet.payload)} messages, whose "
+                               f"answers don't fit in the response")
+
+            response.payload = answers
+            response.payload_length = answers.length
+        elif packet.payload is None:
+            # A request without message, by which the master checks that the
+            # node is reachable: only the noise report is sent back.
+            pass
+        else:
+            response.payload, response.payload_length = (
+                self.on_message_received(packet.payload, packet.payload_length)
+            )
+
+        return response
+
+    # Scoperta della rete.
+
+    @_handle_received.register(HelloProbePacket)
+    def _hello_probe_received(self, packet: HelloProbePacket):
+
+        if (self.static_address is not None or
+                not packet.matches(self.physical_address)):
+            return None
+
+        request = HelloRequestPacket()
+        request.physical_address = self.physical_address
+
+        return request
+
+    @_handle_received.register(HelloRequestPacket)
+    def _(self, _):
+        # Handled only by a node probing its neighbors, which waits for them
+        # in _probe_neighbors.
+        return None
+
+    @_handle_received.register(HelloResponsePacket)
+    def _hello_response_received(self, packet: HelloResponsePacket):
+
+        if packet.physical_address != self.physical_address:
+            return None
+
+        if self.static_address is None:
+            self._set_static_address(packet.new_static_address)
+            self.logic_address = packet.new_logic_address
+            logger.info(f"{self} received its addresses from "
+                        f"{packet.source_static}")
+
+        # The ack of a previous assignment may have been lost.
+        elif self.static_address != packet.new_static_address:
+            return None
+
+        return AckPacket(of=packet)
+
+    def _set_static_address(self, static_address):
+
+        self.static_address = static_address
+
+        if self._noise_store is not None:
+            noise_table = self._noise_store.table_for(static_address)
+            noise_table.update(self.noise_table)
+            self.noise_table = noise_table
+
+    def _answer_probe_request(self, request: RequestPacket):
+        """
+        Assegna gli indirizzi ai vicini senza indirizzo, come richiesto dal
+        master, e crea la risposta con i nodi configurati.
+        """
+
+        first_static_address, max_nodes = request.payload
+
+        logger.info(f"{self} probes its neighbors")
+        found = yield from self._probe_neighbors(first_static_address,
+                                                 max_nodes)
+
+        response = self._new_response_packet(request)
+        response.code_is_node_init = True
+        response.payload = found
+        response.payload_length = PROBED_NODE_LENGTH * len(found)
 
         return response
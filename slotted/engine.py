@@ -0,0 +1,528 @@
+"""
+Simulatore a slot del protocollo ReThunder.
+
+Il simulatore a eventi (infrastructure e protocol) è fedele ma lento per gli
+studi di capacità, che richiedono migliaia di sequenze di traffico casuali.
+SlottedSimulation modella il mezzo in slot discreti, pari all'unità di tempo
+del simulatore a eventi, e fa avanzare insieme molte repliche indipendenti
+della stessa rete: lo stato di ogni replica (tempo, transazione e salto
+corrente, indirizzi logici confermati, report del rumore) è tenuto in array
+NumPy, e ogni iterazione esegue un salto per tutte le repliche attive.
+
+Le decisioni di instradamento e di indirizzamento vengono prese da un
+MasterNode, che calcola i percorsi e costruisce i RequestPacket come nel
+simulatore a eventi; i pacchetti risultanti vengono memorizzati per
+percorso e stato di conferma degli indirizzi, così che il costo in Python
+sia proporzionale al numero di transazioni e non a quello degli slot.
+
+Il modello del mezzo:
+
+* Ogni salto occupa il mezzo per il ritardo di propagazione (se il
+  collegamento passa per un bus) più il ritardo di trasmissione del
+  pacchetto, come nel simulatore a eventi.
+
+* Un frame è illeggibile se contiene almeno due bit errati (Hamming SECDED),
+  con bit errati indipendenti con probabilità `bit_error_rate`. Un pacchetto
+  con un frame illeggibile viene scartato.
+
+* Il traffico di fondo inizia su ogni mezzo (bus o collegamento diretto) in
+  ogni slot con probabilità `background_load` e dura `background_length`
+  slot. Un salto che si sovrappone a del traffico di fondo collide.
+
+Un pacchetto perso fa attendere al master il timeout della transazione,
+calcolato come in MasterNode. Le statistiche prodotte sono
+TransactionMetrics, le stesse del master del simulatore a eventi.
+
+Le reti con più percorsi minimi equivalenti possono divergere dal
+simulatore a eventi, in cui le stime del rumore del master cambiano i
+percorsi durante la simulazione; il confronto fra i due è significativo su
+reti ad albero.
+"""
+import collections
+import itertools
+from typing import Dict, List, Optional, Sequence
+
+import networkx as nx
+import numpy as np
+
+from infrastructure import Bus, Network
+from infrastructure.message import make_transmission_delay
+from protocol.master_node import MasterNode
+from protocol.metrics import TransactionMetrics
+from protocol.packet import AddressType, ResponsePacket
+from protocol.rethunder_node import ReThunderNode
+from protocol.routing_table import RoutingTable
+
+HAMMING_FRAME_BITS = 16
+
+_TransactionPlan = collections.namedtuple(
+    '_TransactionPlan',
+    'path, new_addrs, expiry_delay, first_request_delay, request_hops, '
+    'response_propagation, response_media'
+)
+
+# Per-hop arrays: duration, error probability, collision probability,
+# medium, sender, receiver and frames.
+_Hops = collections.namedtuple(
+    '_Hops', 'duration, error_p, collision_p, medium, sender, receiver, frames'
+)
+
+
+def frame_loss_probability(bit_error_rate: float) -> float:
+    """
+    Calcola la probabilità che un frame codificato in Hamming SECDED non sia
+    leggibile, ovvero che contenga almeno due bit errati.
+    """
+
+    p = bit_error_rate
+    n = HAMMING_FRAME_BITS
+
+    return 1 - (1 - p) ** n - n * p * (1 - p) ** (n - 1)
+
+
+class SlottedResults:
+    """
+    Risultati di una esecuzione di SlottedSimulation.
+
+    :ivar metrics: Le TransactionMetrics di ogni replica.
+    :ivar frames_sent: Frame trasmessi per replica e per nodo.
+    :ivar frame_errors: Pacchetti persi per errori, per replica e per nodo
+    ricevente.
+    :ivar collisions: Collisioni per replica e per mezzo.
+    :ivar end_times: Il tempo finale di ogni replica.
+    """
+
+    def __init__(self, metrics, frames_sent, frame_errors, collisions,
+                 end_times, node_addresses):
+        self.metrics: List[TransactionMetrics] = metrics
+        self.frames_sent = frames_sent
+        self.frame_errors = frame_errors
+        self.collisions = collisions
+        self.end_times = end_times
+        self.node_addresses = node_addresses
+
+    def merged_metrics(self) -> TransactionMetrics:
+        return TransactionMetrics.merge(self.metrics)
+
+
+class SlottedSimulation:
+
+    def __init__(self, netgraph: nx.Graph, replicas=1, transmission_speed=5,
+                 bit_error_rate=0., background_load=0., background_length=1,
+                 noise_full_report_interval=16, seed=None):
+        """
+        :param netgraph: Il grafo di rete, come quello di Network, che
+        contiene un MasterNode, dei SlaveNode ed eventualmente dei Bus.
+        :param replicas: Il numero di repliche indipendenti da simulare.
+        :param transmission_speed: La velocità di trasmissione, come in
+        Network.
+        :param bit_error_rate: La probabilità di errore di ogni bit.
+        :param background_load: La probabilità che in uno slot inizi del
+        traffico di fondo su un mezzo.
+        :param background_length: La durata in slot del traffico di fondo.
+        :param noise_full_report_interval: Ogni quanti report del rumore uno
+        è completo, come in SlaveNode.
+        :param seed: Il seme del generatore di numeri casuali.
+        """
+
+        self.replicas = replicas
+        self.transmission_speed = transmission_speed
+        self.frame_loss_probability = frame_loss_probability(bit_error_rate)
+        self.background_load = background_load
+        self.background_length = background_length
+        self.noise_full_report_interval = noise_full_report_interval
+        self._rng = np.random.RandomState(seed)
+
+        self._master = master = MasterNode(
+            Network(transmission_speed=transmission_speed)
+        )
+        master.init_from_netgraph(netgraph)
+
+        self._node_manager = node_manager = master._node_manager
+        self.node_addresses = addresses = list(node_manager)
+        self._index = {addr: i for i, addr in enumerate(addresses)}
+
+        self._media: Dict[frozenset, int] = {}
+        self._propagation: Dict[frozenset, int] = {}
+        self._init_media(netgraph)
+
+        self._adjacency = nx.to_numpy_matrix(
+            master.node_graph,
+            nodelist=[node_manager[addr] for addr in addresses]
+        ).A.astype(bool)
+        self._plans = {}
+        self._relevant_nodes = {}
+
+    def _init_media(self, netgraph):
+
+        media_ids = itertools.count()
+
+        for node in netgraph.nodes_iter():
+
+            if isinstance(node, Bus):
+                medium = next(media_ids)
+                attached = [n.static_address for n in netgraph.neighbors(node)
+                            if isinstance(n, ReThunderNode)]
+
+                # noinspection PyProtectedMember
+                for pair in itertools.combinations(attached, 2):
+                    pair = frozenset(pair)
+                    self._media.setdefault(pair, medium)
+                    self._propagation.setdefault(
+                        pair, node._propagation_delay
+                    )
+
+        for n1, n2 in netgraph.edges_iter():
+            if isinstance(n1, ReThunderNode) and isinstance(n2, ReThunderNode):
+                pair = frozenset((n1.static_address, n2.static_address))
+                self._media.setdefault(pair, next(media_ids))
+                self._propagation.setdefault(pair, 0)
+
+        self.media_count = next(media_ids)
+
+    def _plan(self, dest_addr, confirmed: np.ndarray, message_length):
+        """
+        Costruisce con il MasterNode la richiesta per una destinazione, dato
+        l'insieme dei nodi il cui indirizzo logico è confermato.
+        """
+
+        master = self._master
+        node_manager = self._node_manager
+        index = self._index
+
+        path = master._shortest_paths[node_manager[dest_addr]]
+
+        # The request only depends on the confirmed addresses of the nodes
+        # on the path and of their neighbors.
+        relevant = self._relevant_nodes.get(dest_addr)
+
+        if relevant is None:
+            relevant = np.array(sorted(
+                {index[n.static_address]
+                 for node in path
+                 for n in itertools.chain(
+                     (node,), master.node_graph.neighbors(node))}
+            ))
+            self._relevant_nodes[dest_addr] = relevant
+
+        key = (dest_addr, message_length, confirmed[relevant].tobytes())
+        plan = self._plans.get(key)
+
+        if plan is not None:
+            return plan
+
+        for i in relevant:
+            node = node_manager[self.node_addresses[i]]
+            node.current_logic_address = (
+                node.logic_address if confirmed[i] else None
+            )
+
+        # Every slave is assumed to have heard its neighbors by their
+        # confirmed addresses, as happens on trees without losses.
+        for node in path[1:-1]:
+            node.reported_routing_table = RoutingTable(
+                (n.current_logic_address, n.static_address)
+                for n in master.node_graph.neighbors(node)
+                if n.current_logic_address is not None
+            )
+            node.reported_unknown_entries = frozenset()
+
+        packet = master._make_request_packet('', message_length, path)
+
+        # The master confirms all the new addresses once the answer arrives.
+        confirmed_on_answer = [index[a] for a in packet.new_logic_addresses]
+
+        new_addrs = packet.new_logic_addresses
+        request_frames = []
+
+        # Slaves remove their own entries from the request while forwarding
+        # it, so the request shrinks along the path.
+
+        path_entries = list(packet.path)
+        is_static = packet.code_is_addressing_static
+        destination = packet.destination
+
+        for receiver in path[1:]:
+            packet.path = path_entries
+            packet.new_logic_addresses = new_addrs
+            request_frames.append(packet.number_of_frames())
+
+            new_addrs.pop(receiver.static_address, None)
+
+            # The request reaches the slaves by the addresses they had
+            # before receiving it.
+            receiver_addr = (receiver.static_address if is_static
+                             else receiver.current_logic_address)
+
+            if receiver_addr == destination and path_entries:
+                dest_type, destination = path_entries.pop()
+                is_static = dest_type is AddressType.static
+
+        first_request_delay = make_transmission_delay(
+            self.transmission_speed, request_frames[0]
+        )
+        expiry_delay = (len(path) * first_request_delay + 50) * 5
+
+        path = np.array([index[n.static_address] for n in path])
+        pairs = [frozenset((self.node_addresses[a], self.node_addresses[b]))
+                 for a, b in zip(path, path[1:])]
+
+        propagation = np.array([self._propagation[p] for p in pairs])
+        media = np.array([self._media[p] for p in pairs])
+
+        request_hops = self._hops(path[:-1], path[1:], propagation, media,
+                                  np.array(request_frames))
+
+        plan = _TransactionPlan(
+            path, confirmed_on_answer, expiry_delay, first_request_delay,
+            request_hops, propagation[::-1], media[::-1]
+        )
+
+        self._plans[key] = plan
+        return plan
+
+    def _hops(self, senders, receivers, propagation, media, frames) -> _Hops:
+        """
+        Calcola durata, probabilità di perdita per errori e probabilità di
+        collisione di una sequenza di salti.
+        """
+
+        duration = propagation + np.maximum(
+            (frames / self.transmission_speed).astype(np.int64), 1
+        )
+
+        error_p = 1 - (1 - self.frame_loss_probability) ** frames
+
+        collision_window = duration + self.background_length - 1
+        collision_p = 1 - (1 - self.background_load) ** collision_window
+
+        return _Hops(duration, error_p, collision_p, media, senders, receivers,
+                     frames)
+
+    def _response_frames(self, path, heard, reported, full_report,
+                         answer_length):
+        """
+        Calcola la dimensione della risposta a ogni salto, dalla
+        destinazione al master, aggiornando le sorgenti ascoltate e riportate
+        dai nodi del percorso.
+
+        Ogni nodo attraversato aggiunge il proprio report del rumore. Un
+        report completo contiene tutte le sorgenti ascoltate dal nodo; uno
+        differenziale quelle ascoltate dall'ultimo report, oppure, se il
+        mezzo ha errori e i valori del rumore cambiano, di nuovo tutte.
+
+        :param path: Gli indici dei nodi del percorso.
+        :param heard: Le sorgenti ascoltate dai nodi del percorso, modificata
+        sul posto.
+        :param reported: Le sorgenti riportate dai nodi del percorso,
+        modificata sul posto.
+        :param full_report: Quali slave del percorso inviano un report
+        completo.
+        :param answer_length: La lunghezza della risposta.
+        """
+
+        response = ResponsePacket()
+        response.payload = ''
+        response.payload_length = answer_length
+
+        adjacency = self._adjacency
+        dest = path[-1]
+
+        # During the request every node of the path but the destination
+        # transmits. The destination transmits first in the response, after
+        # its own report: every other report includes it, if adjacent.
+
+        heard[:, path[:-1]] |= adjacency[np.ix_(path, path[:-1])]
+
+        dest_heard = heard[-1].copy()
+        heard[:, dest] |= adjacency[path, dest]
+        heard[-1] = dest_heard
+
+        lossy = self.frame_loss_probability > 0 or self.background_load > 0
+
+        full = full_report | lossy
+        slaves_heard = heard[1:]
+
+        entries = np.where(
+            full, np.count_nonzero(slaves_heard, axis=1),
+            np.count_nonzero(slaves_heard & ~reported[1:], axis=1)
+        )
+
+        reported[1:] = slaves_heard
+
+        # The destination has not heard itself transmitting.
+        heard[-1, dest] |= adjacency[dest, dest]
+
+        table_frames = (1 + 2 * entries)[::-1]
+
+        return response.number_of_frames() + np.cumsum(table_frames)
+
+    def run(self, transactions: int, message_length=4, answer_length=4,
+            destinations: Optional[Sequence[Sequence[int]]]=None) \
+            -> SlottedResults:
+        """
+        Esegue la simulazione.
+
+        :param transactions: Il numero di transazioni per replica.
+        :param message_length: La lunghezza delle richieste.
+        :param answer_length: La lunghezza delle risposte.
+        :param destinations: Gli indirizzi statici delle destinazioni, come
+        matrice repliche x transazioni. Se non viene specificata, le
+        destinazioni vengono scelte a caso fra gli slave.
+        :return: I risultati della simulazione.
+        """
+
+        rng = self._rng
+        replicas = self.replicas
+        nodes_count = len(self.node_addresses)
+
+        if destinations is None:
+            slaves = self.node_addresses[1:]
+            destinations = rng.choice(slaves, size=(replicas, transactions))
+        else:
+            destinations = np.asarray(destinations)
+
+        if destinations.shape != (replicas, transactions):
+            raise ValueError('destinations must be a replicas x transactions '
+                             'matrix')
+
+        max_hops = 2 * max(len(path) - 1 for path
+                           in self._master._shortest_paths.values())
+
+        hops = _Hops(*(np.zeros((replicas, max_hops), dtype=dtype)
+                       for dtype in (np.int64, float, float, np.int64,
+                                     np.int64, np.int64, np.int64)))
+        hops_count = np.zeros(replicas, dtype=np.int64)
+
+        now = np.zeros(replicas, dtype=np.int64)
+        request_time = np.zeros(replicas, dtype=np.int64)
+        deadline = np.zeros(replicas, dtype=np.int64)
+        hop_index = np.zeros(replicas, dtype=np.int64)
+        transaction = np.zeros(replicas, dtype=np.int64)
+        active = np.ones(replicas, dtype=bool)
+
+        confirmed = np.zeros((replicas, nodes_count), dtype=bool)
+        reports = np.zeros((replicas, nodes_count), dtype=np.int64)
+        heard = np.zeros((replicas, nodes_count, nodes_count), dtype=bool)
+        reported = np.zeros((replicas, nodes_count, nodes_count), dtype=bool)
+
+        frames_sent = np.zeros((replicas, nodes_count), dtype=np.int64)
+        frame_errors = np.zeros((replicas, nodes_count), dtype=np.int64)
+        collisions = np.zeros((replicas, self.media_count), dtype=np.int64)
+
+        metrics = [TransactionMetrics() for _ in range(replicas)]
+        plans: List[Optional[_TransactionPlan]] = [None] * replicas
+
+        def start_transaction(r):
+
+            plan = self._plan(destinations[r, transaction[r]], confirmed[r],
+                              message_length)
+            plans[r] = plan
+            path = plan.path
+            slaves_on_path = path[1:]
+
+            # As in SlaveNode, a full report is followed by
+            # noise_full_report_interval differential ones.
+            full_report = (
+                reports[r, slaves_on_path] %
+                (self.noise_full_report_interval + 1) == 0
+            )
+            reports[r, slaves_on_path] += 1
+
+            path_heard = heard[r, path]
+            path_reported = reported[r, path]
+
+            response_frames = self._response_frames(
+                path, path_heard, path_reported, full_report, answer_length
+            )
+
+            heard[r, path] = path_heard
+            reported[r, path] = path_reported
+
+            # Nodes outside the path overhear the transmissions as well.
+            heard[r][:, path] |= self._adjacency[:, path]
+
+            response_hops = self._hops(
+                path[:0:-1], path[-2::-1], plan.response_propagation,
+                plan.response_media, response_frames
+            )
+
+            count = 2 * (len(path) - 1)
+
+            for field, request, response in zip(hops, plan.request_hops,
+                                                response_hops):
+                field[r, :count] = np.concatenate((request, response))
+
+            hops_count[r] = count
+            hop_index[r] = 0
+            request_time[r] = now[r]
+
+            # The master starts waiting for the answer once it has finished
+            # transmitting the request.
+            deadline[r] = (now[r] + plan.first_request_delay +
+                           plan.expiry_delay)
+
+            metrics[r].request_sent(now[r])
+
+        def end_transaction(r, answered):
+
+            plan = plans[r]
+
+            if answered:
+                metrics[r].answer_received(now[r] - request_time[r], now[r])
+                confirmed[r, plan.new_addrs] = True
+            else:
+                now[r] = deadline[r]
+                metrics[r].answer_timed_out(now[r])
+                confirmed[r, plan.new_addrs] = False
+                reports[r, plan.path[1:]] = 0
+
+            transaction[r] += 1
+
+            if transaction[r] < transactions:
+                start_transaction(r)
+            else:
+                active[r] = False
+
+        if transactions == 0:
+            active[:] = False
+
+        for r in np.flatnonzero(active):
+            start_transaction(r)
+
+        while active.any():
+
+            idx = np.flatnonzero(active)
+            hop = hop_index[idx]
+
+            now[idx] += hops.duration[idx, hop]
+            np.add.at(frames_sent, (idx, hops.sender[idx, hop]),
+                      hops.frames[idx, hop])
+
+            errors = rng.random_sample(len(idx)) < hops.error_p[idx, hop]
+            collided = (rng.random_sample(len(idx)) <
+                        hops.collision_p[idx, hop])
+
+            np.add.at(frame_errors,
+                      (idx[errors], hops.receiver[idx[errors], hop[errors]]),
+                      1)
+            np.add.at(collisions,
+                      (idx[collided], hops.medium[idx[collided],
+                                                  hop[collided]]),
+                      1)
+
+            hop_index[idx] += 1
+
+            completed = hop_index[idx] == hops_count[idx]
+            timed_out = (errors | collided |
+                         (completed & (now[idx] > deadline[idx])))
+            answered = completed & ~timed_out
+
+            for r in idx[timed_out]:
+                end_transaction(r, answered=False)
+
+            for r in idx[answered]:
+                end_transaction(r, answered=True)
+
+        return SlottedResults(metrics, frames_sent, frame_errors, collisions,
+                              now.copy(), list(self.node_addresses))
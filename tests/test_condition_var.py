@@ -87,3 +87,18 @@ class TestBroadcastConditionVar(unittest.TestCase):
             [p.value for p in worker_procs]
         )
 
+
+    def test_has_waiters(self):
+
+        env = simpy.Environment()
+        bell_has_ringed = BroadcastConditionVar(env)
+
+        self.assertFalse(bell_has_ringed.has_waiters)
+
+        env.process(waiter(env, bell_has_ringed))
+        env.run()
+
+        self.assertTrue(bell_has_ringed.has_waiters)
+
+        bell_has_ringed.broadcast()
+        self.assertFalse(bell_has_ringed.has_waiters)
@@ -0,0 +1,77 @@
+import unittest
+
+import networkx as nx
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol.edge_costs import NoiseCost, HopCountCost, EtxCost
+from protocol.packet import NoiseReport
+
+
+class TestEdgeCosts(unittest.TestCase):
+
+    def test_etx(self):
+
+        cost = EtxCost(packet_frames=10)
+
+        self.assertEqual(cost(0), 10)
+
+        # A tenth of the frames damaged, one in a hundred lost.
+        self.assertAlmostEqual(cost(200), 10 / 0.99 ** 10)
+
+        costs = [cost(noise) for noise in range(0, 4000, 100)]
+        self.assertEqual(costs, sorted(costs))
+        self.assertLess(costs[-1], float('inf'))
+
+        with self.assertRaises(ValueError):
+            EtxCost(packet_frames=0)
+
+    def make_master(self, edge_cost):
+
+        # Two routes to node 3: a short one with a noisy link, and a longer
+        # quiet one.
+        addr_graph = nx.Graph()
+        addr_graph.add_path((0, 1, 3))
+        addr_graph.add_path((0, 2, 4, 3))
+
+        master = MasterNode(Network(), edge_cost=edge_cost)
+        master.init_from_static_addr_graph(addr_graph, initial_noise_value=0)
+
+        nodes = master._node_manager
+        master._update_node_graph_from_table(nodes[1], NoiseReport({3: 900}))
+        master._update_sptree()
+
+        return master
+
+    def path_to_3(self, edge_cost):
+        master = self.make_master(edge_cost)
+        path = master._shortest_paths[master._node_manager[3]]
+        return [node.static_address for node in path]
+
+    def test_path_choice(self):
+
+        self.assertEqual(self.path_to_3(None), [0, 2, 4, 3])
+        self.assertEqual(self.path_to_3(NoiseCost()), [0, 2, 4, 3])
+        self.assertEqual(self.path_to_3(HopCountCost()), [0, 1, 3])
+
+        # The noisy link loses few frames of short packets, which are worth
+        # a hop less, but many of long ones.
+        self.assertEqual(self.path_to_3(EtxCost(packet_frames=4)), [0, 1, 3])
+        self.assertEqual(self.path_to_3(EtxCost(packet_frames=200)),
+                         [0, 2, 4, 3])
+
+    def test_lazy_paths(self):
+
+        master = MasterNode(Network(), edge_cost=EtxCost(), lazy_paths=True)
+        addr_graph = nx.Graph()
+        addr_graph.add_path((0, 1, 2))
+        master.init_from_static_addr_graph(addr_graph)
+
+        nodes = master._node_manager
+        paths = master._shortest_paths
+
+        self.assertEqual(paths[nodes[2]], [nodes[0], nodes[1], nodes[2]])
+
+        # A new quieter edge makes the cached path stale.
+        master._update_node_graph_from_table(nodes[0], NoiseReport({2: 0}))
+        self.assertEqual(paths[nodes[2]], [nodes[0], nodes[2]])
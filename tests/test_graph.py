@@ -0,0 +1,84 @@
+import random
+import unittest
+
+import networkx as nx
+
+from utils.graph import LazyShortestPaths
+
+
+class TestLazyShortestPaths(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(7)
+
+        self.graph = graph = nx.connected_watts_strogatz_graph(200, 4, 0.2,
+                                                               seed=7)
+
+        for u, v in graph.edges_iter():
+            graph[u][v]['noise'] = rand.choice((0.25, 0.5, 1))
+
+        self.rand = rand
+        self.paths = LazyShortestPaths(graph, 0, weight='noise')
+
+    def distance(self, path):
+        graph = self.graph
+        return sum(graph[u][v]['noise'] for u, v in zip(path, path[1:]))
+
+    def test_same_paths(self):
+
+        expected = nx.shortest_path(self.graph, 0, weight='noise')
+
+        for target in (199, 3, 100, 0, 57):
+            self.assertEqual(self.paths[target], expected[target])
+
+        self.assertEqual(len(self.paths), 5)
+        self.assertTrue(nx.is_tree(self.paths.tree()))
+
+    def test_settles_only_needed_nodes(self):
+
+        paths = self.paths
+        neighbour = next(iter(self.graph[0]))
+
+        paths[neighbour]
+        paths[neighbour]
+
+        self.assertEqual(paths.computations, 1)
+        self.assertLess(paths.settled_nodes, len(self.graph) // 10)
+
+    def test_invalidation(self):
+
+        graph = self.graph
+        paths = self.paths
+        targets = list(range(0, 200, 10))
+
+        for _ in range(50):
+            for target in targets:
+                paths[target]
+
+            u, v = self.rand.choice(graph.edges())
+            old = graph[u][v]['noise']
+            new = graph[u][v]['noise'] = self.rand.choice((0.1, 0.5, 2))
+            paths.edge_changed(u, v, old, new)
+
+            lengths = nx.single_source_dijkstra_path_length(graph, 0,
+                                                            weight='noise')
+
+            for target in targets:
+                paths[target]
+
+            tree = paths.tree()
+
+            self.assertTrue(nx.is_tree(tree))
+
+            for target in targets:
+                path = paths[target]
+                self.assertAlmostEqual(self.distance(path), lengths[target])
+                self.assertTrue(all(tree.has_edge(u, v)
+                                    for u, v in zip(path, path[1:])))
+
+        self.assertLess(paths.computations, 50 * len(targets))
+
+    def test_unknown_target(self):
+        with self.assertRaises(KeyError):
+            # noinspection PyStatementEffect
+            self.paths[1000]
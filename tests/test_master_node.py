@@ -84,4 +84,3 @@ class MasterNodeTest(unittest.TestCase):
         # noinspection PyTypeChecker
         sptree = nx.relabel_nodes(master._sptree, lambda x: x.logic_address)
         self.assertFalse(addressing_is_wrong(sptree))
-
@@ -1,9 +1,16 @@
+import itertools
+import random
 import unittest
 
+import simpy
+
 from infrastructure.bus import Bus
+from infrastructure.mac import MacLayer, PriorityBackoff, RandomBackoff
 from infrastructure.message import CollisionSentinel
 from infrastructure.network import Network
 from nodes.nodes import SenderNode, ReceiverNode
+from protocol import MasterNode, SlaveNode
+from protocol.packet import RequestPacket
 
 
 class TestNetwork(unittest.TestCase):
@@ -50,3 +57,239 @@ class TestNetwork(unittest.TestCase):
         self.assertEqual(receiver.received,
                          [(8 * i, CollisionSentinel)
                           for i, (msg, _) in enumerate(messages, start=1)])
+
+
+class CountingEnvironment(simpy.Environment):
+
+    def __init__(self):
+        super().__init__()
+        self.scheduled_events = 0
+
+    def schedule(self, *args, **kwargs):
+        self.scheduled_events += 1
+        return super().schedule(*args, **kwargs)
+
+
+class TestChannelNetwork(TestNetwork):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.network = Network(CountingEnvironment(), transmission_speed=2,
+                               channel_delivery=True)
+
+    def test_fewer_events(self):
+
+        scheduled_events = []
+
+        for channel_delivery in (False, True):
+            network = Network(CountingEnvironment(), transmission_speed=2,
+                              channel_delivery=channel_delivery)
+
+            messages = [(f'Message{i}', 8) for i in range(10)]
+            senders = [SenderNode(network, messages) for _ in range(2)]
+            receivers = [ReceiverNode(network) for _ in range(5)]
+            bus = Bus(network, 4)
+
+            network.netgraph.add_star((bus, *senders, *receivers))
+            network.run_nodes_processes()
+            network.env.run()
+
+            scheduled_events.append(network.env.scheduled_events)
+
+        process_events, channel_events = scheduled_events
+        self.assertLess(channel_events * 2, process_events)
+
+
+class TestNextHopFiltering(unittest.TestCase):
+
+    @staticmethod
+    def scheduled_events(slaves_count, next_hop_filtering):
+
+        network = Network(CountingEnvironment(), transmission_speed=2,
+                          channel_delivery=True)
+        master = MasterNode(network)
+        slaves = [SlaveNode(network, i,
+                            on_message_received=lambda *_: ('Blop', 4))
+                  for i in range(1, slaves_count + 1)]
+
+        for node in (master, *slaves):
+            node.next_hop_filtering = next_hop_filtering
+
+        network.netgraph.add_star((Bus(network, 4), master, *slaves))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        for _ in range(5):
+            master.send_message('Blip', 4, 1)
+
+        network.env.run(until=10000)
+
+        return network.env.scheduled_events
+
+    def test_receive_ev(self):
+
+        network = Network(transmission_speed=2)
+        master = MasterNode(network)
+        answered, overhearing = (
+            SlaveNode(network, i, on_message_received=lambda *_: ('Blop', 4))
+            for i in (1, 2)
+        )
+
+        network.netgraph.add_star((Bus(network, 4), master, answered,
+                                   overhearing))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        # The filtered node still broadcasts the packets meant for other
+        # nodes to whoever waits for them.
+        def receive():
+            return (yield overhearing._receive_ev())
+
+        received = network.env.process(receive())
+        master.send_message('Blip', 4, 1)
+        network.env.run(until=10000)
+
+        self.assertIsInstance(received.value, RequestPacket)
+        self.assertEqual(received.value.next_hop, 1)
+        self.assertEqual(master.metrics.answers, 1)
+
+    def test_fewer_events(self):
+
+        unfiltered = [self.scheduled_events(n, False) for n in (5, 50)]
+        filtered = [self.scheduled_events(n, True) for n in (5, 50)]
+
+        self.assertLess(filtered[0] * 2, unfiltered[0])
+
+        # Only the receiver wakes up, so the events barely grow with the
+        # number of nodes on the bus.
+        self.assertLess((filtered[1] - filtered[0]) * 10,
+                        unfiltered[1] - unfiltered[0])
+
+
+class TestMacLayer(unittest.TestCase):
+
+    def run_senders(self, senders_count, mac_factory):
+
+        network = Network(transmission_speed=2, mac_factory=mac_factory)
+
+        senders = [SenderNode(network, [(f'Message{i}_{j}', 8)
+                                        for j in range(10)])
+                   for i in range(senders_count)]
+        receiver = ReceiverNode(network)
+
+        network.netgraph.add_star((Bus(network, 4), *senders, receiver))
+        network.run_nodes_processes()
+        network.env.run()
+
+        return senders, [msg for _, msg in receiver.received]
+
+    def test_no_collisions(self):
+
+        rng = random.Random(1)
+
+        for senders_count in (1, 4, 8):
+            senders, received = self.run_senders(
+                senders_count, lambda: MacLayer(RandomBackoff(rng=rng))
+            )
+
+            self.assertNotIn(CollisionSentinel, received)
+            self.assertEqual(len(received), 10 * senders_count)
+
+            for sender in senders:
+                stats = sender.mac.stats
+                self.assertEqual(stats.enqueued, 10)
+                self.assertEqual(stats.transmitted, 10)
+                self.assertEqual(stats.max_queue_length, 1)
+
+        self.assertGreater(sum(s.mac.stats.deferrals for s in senders), 0)
+
+    def test_priority(self):
+
+        priorities = itertools.count()
+        _, received = self.run_senders(
+            2, lambda: MacLayer(PriorityBackoff(next(priorities)))
+        )
+
+        self.assertEqual(received[0], 'Message0_0')
+        self.assertNotIn(CollisionSentinel, received)
+
+    def test_queue_statistics(self):
+
+        network = Network(transmission_speed=2)
+        sender = SenderNode(network)
+        sender.mac = MacLayer(PriorityBackoff(0))
+        sender.mac.attach(sender)
+        receiver = ReceiverNode(network)
+        network.netgraph.add_star((Bus(network, 4), sender, receiver))
+
+        for i in range(3):
+            sender._transmit_process(f'Message{i}', 8)
+
+        network.env.run()
+
+        stats = sender.mac.stats
+        self.assertEqual(stats.max_queue_length, 3)
+        self.assertEqual(stats.transmitted, 3)
+        self.assertGreater(stats.mean_queue_length(network.env.now), 0)
+        self.assertGreater(stats.mean_queueing_time, 0)
+
+
+class TestHeapEnvironmentNetwork(TestNetwork):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.network = Network(transmission_speed=2,
+                               lightweight_scheduler=True)
+
+    def test_same_receptions(self):
+
+        received = []
+
+        for lightweight_scheduler in (False, True):
+            network = Network(transmission_speed=2,
+                              lightweight_scheduler=lightweight_scheduler)
+
+            messages = [(f'Message{i}', 8) for i in range(10)]
+            senders = [SenderNode(network, messages[i::2]) for i in range(2)]
+            receiver = ReceiverNode(network)
+            bus = Bus(network, 4)
+
+            network.netgraph.add_star((bus, *senders, receiver))
+            network.run_nodes_processes()
+            network.env.run(until=1000)
+
+            received.append(receiver.received)
+
+        self.assertEqual(*received)
+
+    def test_explicit_env(self):
+
+        with self.assertRaises(ValueError):
+            Network(simpy.Environment(), lightweight_scheduler=True)
+
+
+class TestNoiseTableStore(unittest.TestCase):
+
+    def test_views(self):
+
+        network = Network(compact_noise_tables=True)
+        store = network.noise_store
+
+        table = store.table_for(3)
+        other = store.table_for(5)
+
+        table[1] = 100
+        table[200] = 40000
+        other[3] = 7
+
+        self.assertEqual(dict(table), {1: 100, 200: (1 << 15) - 1})
+        self.assertEqual(len(table), 2)
+        self.assertEqual(dict(other), {3: 7})
+
+        del table[1]
+        self.assertNotIn(1, table)
+        self.assertEqual(len(table), 1)
+
+        snapshot = network.noise_snapshot()
+        self.assertEqual(snapshot[5, 3], 7)
+        self.assertEqual(snapshot[3, 1], -1)
@@ -0,0 +1,125 @@
+import unittest
+
+from protocol.noise_estimation import (
+    EwmaEstimator, WindowMeanEstimator, VarianceAwareEstimator
+)
+
+
+class TestNoiseEstimators(unittest.TestCase):
+
+    def test_ewma(self):
+
+        estimator = EwmaEstimator(past_weight=0.5)
+
+        self.assertEqual(estimator.update(1, {2: 100, 3: 40}),
+                         [(2, None, 100), (3, None, 40)])
+
+        # The table of node 2 updates the same edge.
+        self.assertEqual(estimator.update(2, {1: 0}), [(1, 100, 50)])
+        self.assertEqual(estimator.estimate(1, 2), 50)
+        self.assertEqual(estimator.estimate(2, 1), 50)
+        self.assertIsNone(estimator.estimate(2, 3))
+        self.assertEqual(len(estimator), 2)
+
+    def test_threshold(self):
+
+        estimator = EwmaEstimator(past_weight=0.5, threshold=10)
+        estimator.add_edges([(1, 2)], 100)
+
+        self.assertEqual(estimator.update(1, {2: 80}), [])
+        self.assertEqual(estimator.estimate(1, 2), 100)
+
+        # The drift accumulates until it exceeds the threshold.
+        self.assertEqual(estimator.update(1, {2: 80}), [(2, 100, 85)])
+        self.assertEqual(estimator.changes, 1)
+        self.assertEqual(estimator.samples, 2)
+
+    def test_window_mean(self):
+
+        estimator = WindowMeanEstimator(window=2)
+        estimator.update(1, {2: 10})
+
+        self.assertEqual(estimator.update(1, {2: 20}), [(2, 10, 15)])
+        self.assertEqual(estimator.update(1, {2: 40}), [(2, 15, 30)])
+        self.assertEqual(estimator.update(1, {2: 40}), [(2, 30, 40)])
+
+    def test_variance_aware(self):
+
+        steady = VarianceAwareEstimator(deviation_weight=2)
+        unsteady = VarianceAwareEstimator(deviation_weight=2)
+
+        for sample in (100, 100, 100, 100):
+            steady.update(1, {2: sample})
+
+        for sample in (100, 0, 200, 100):
+            unsteady.update(1, {2: sample})
+
+        self.assertEqual(steady.estimate(1, 2), 100)
+        self.assertGreater(unsteady.estimate(1, 2), 150)
+
+    def test_many_edges(self):
+
+        estimator = EwmaEstimator(initial_capacity=4)
+
+        for source in range(50):
+            estimator.update(source, {dest: source + dest
+                                      for dest in range(source + 1, 60)})
+
+        self.assertEqual(len(estimator), sum(range(10, 60)))
+        self.assertEqual(estimator.estimate(7, 30), 37)
+        self.assertEqual(estimator.estimate(30, 7), 37)
+
+    def test_set_edges(self):
+
+        estimator = EwmaEstimator(past_weight=0.5)
+        estimator.update(1, {2: 100})
+        estimator.update(1, {2: 0})
+
+        # The state of the edge starts again from the given estimate.
+        estimator.set_edges([(2, 1), (1, 3)], 20)
+        self.assertEqual(estimator.estimate(1, 2), 20)
+        self.assertEqual(estimator.estimate(1, 3), 20)
+        self.assertEqual(estimator.update(1, {2: 40}), [(2, 20, 30)])
+
+        estimator = WindowMeanEstimator(window=2)
+        estimator.update(1, {2: 10})
+        estimator.update(1, {2: 20})
+        estimator.set_edges([(1, 2)], 40)
+        self.assertEqual(estimator.update(1, {2: 60}), [(2, 40, 50)])
+
+    def test_remove_edges(self):
+
+        estimator = EwmaEstimator(past_weight=0.5, initial_capacity=2)
+        estimator.update(1, {2: 100, 3: 40})
+        estimator.remove_edges([(2, 1), (3, 4)])
+
+        self.assertIsNone(estimator.estimate(1, 2))
+        self.assertEqual(estimator.estimate(1, 3), 40)
+        self.assertEqual(len(estimator), 1)
+
+        # A removed edge is new again, and its row is reused.
+        self.assertEqual(estimator.update(2, {1: 60, 4: 10}),
+                         [(1, None, 60), (4, None, 10)])
+        self.assertEqual(len(estimator), 3)
+        self.assertEqual(estimator._edge_count, 3)
+
+    def test_remove_node(self):
+
+        estimator = EwmaEstimator()
+        estimator.update(1, {2: 10, 3: 20})
+        estimator.update(3, {4: 30})
+        estimator.remove_node(3)
+
+        self.assertEqual(len(estimator), 1)
+        self.assertEqual(estimator.estimate(1, 2), 10)
+        self.assertIsNone(estimator.estimate(3, 4))
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            EwmaEstimator(past_weight=1)
+        with self.assertRaises(ValueError):
+            WindowMeanEstimator(window=0)
+        with self.assertRaises(ValueError):
+            VarianceAwareEstimator(deviation_weight=-1)
+        with self.assertRaises(ValueError):
+            EwmaEstimator(threshold=-1)
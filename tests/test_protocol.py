@@ -1,15 +1,29 @@
+import collections
 import logging
 import random
 import unittest
 
 from itertools import combinations
+from types import MethodType
 import networkx as nx
 
 import protocol
 from infrastructure import Bus
 from infrastructure import Network
+from infrastructure.mac import MacLayer, RandomBackoff
+from nodes.nodes import SenderNode
+from protocol import GatewayNode
 from protocol import MasterNode
 from protocol import SlaveNode
+from protocol.master_node import MessageOutcome, SegmentAddress
+from protocol.packet import (
+    AckPacket, RequestPacket, ResponsePacket, MulticastRequestPacket,
+    HelloProbePacket, NoiseReport, CoalescedPayload, MAX_PAYLOAD_LENGTH
+)
+from protocol.noise_estimation import EwmaEstimator
+from protocol.route_stability import RouteStability
+from protocol.scheduling import TreeOrderPolicy, PriorityAgingPolicy
+from protocol.send_queue import QueuePolicy
 
 
 class SimpleTestProtocol(unittest.TestCase):
@@ -109,6 +123,66 @@ class SimpleTestProtocol(unittest.TestCase):
 
         self.assertEquals(received, [ans.format(i) for i in range(15, 21)])
 
+    def test_confirmed_addresses(self):
+
+        network = self.network
+        master = MasterNode(network)
+        slaves = [SlaveNode(network, i,
+                            on_message_received=lambda x, y, z: ('Blop', 4))
+                  for i in range(1, 6)]
+
+        network.netgraph.add_path((master, *slaves))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        master.send_message('Blip', 4, 5)
+        master.send_message('Blip', 4, 5)
+        network.env.run()
+
+        # The first request assigns the logic addresses, which the master
+        # uses for the second one once confirmed by the answer.
+        for slave in slaves:
+            node = master._node_manager[slave.static_address]
+            self.assertEqual(node.current_logic_address, slave.logic_address)
+
+        self.assertEqual(master.metrics.requests, 2)
+        self.assertEqual(master.metrics.static_addressing_requests, 1)
+
+
+class CompactTablesTestProtocol(SimpleTestProtocol):
+
+    def setUp(self):
+        self.network = network = Network(transmission_speed=0.5,
+                                         compact_noise_tables=True)
+        network.configure_root_logger(level=logging.DEBUG)
+
+
+class ChannelDeliveryTestProtocol(SimpleTestProtocol):
+
+    def setUp(self):
+        self.network = network = Network(transmission_speed=0.5,
+                                         channel_delivery=True)
+        network.configure_root_logger(level=logging.DEBUG)
+
+
+class MacTestProtocol(SimpleTestProtocol):
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.network = network = Network(
+            transmission_speed=0.5,
+            mac_factory=lambda: MacLayer(RandomBackoff(rng=rng))
+        )
+        network.configure_root_logger(level=logging.DEBUG)
+
+
+class LightweightSchedulerTestProtocol(SimpleTestProtocol):
+
+    def setUp(self):
+        self.network = network = Network(transmission_speed=0.5,
+                                         lightweight_scheduler=True)
+        network.configure_root_logger(level=logging.DEBUG)
+
 
 class TestAddedCycle(unittest.TestCase):
     def setUp(self):
@@ -285,3 +359,1564 @@ class TestTreeConfiguration(unittest.TestCase):
         self.assertEquals(self.received,
                           [ans.format(i) for i in range(last_addr, 0, -1)] * 2)
 
+
+class LazyPathsTestTreeConfiguration(TestTreeConfiguration):
+
+    def setUp(self):
+        super().setUp()
+        self.nodes[0].lazy_paths = True
+
+
+class EstimatorTestTreeConfiguration(TestTreeConfiguration):
+
+    def setUp(self):
+        super().setUp()
+        self.nodes[0].noise_estimator = EwmaEstimator()
+
+
+class TestRouteStability(unittest.TestCase):
+
+    def run_cliques(self, route_stability):
+
+        network = Network(transmission_speed=0.5)
+        rand = random.Random(0)
+
+        self.received = received = []
+
+        def slave_on_received(slave, msg, _):
+            return slave.static_address, 1
+
+        master = MasterNode(
+            network, on_message_received=lambda _, m, __: received.append(m),
+            route_stability=route_stability
+        )
+
+        nodes = [master]
+        nodes.extend(
+            SlaveNode(network, i, on_message_received=slave_on_received)
+            for i in range(1, 30)
+        )
+
+        # Chained groups of fully connected slaves, with many paths of equal
+        # cost.
+        netgraph = network.netgraph
+        netgraph.add_path(nodes[:3])
+
+        for first in range(2, 30, 4):
+            netgraph.add_edges_from(combinations(nodes[first:first + 4], 2))
+
+        for first in range(3, 26, 4):
+            netgraph.add_edge(nodes[first], nodes[first + 5])
+
+        # The static addresses make the ties between paths of equal cost
+        # independent of the order of the nodes in memory.
+        master.init_from_static_addr_graph(nx.relabel_nodes(
+            netgraph, lambda node: node.static_address
+        ))
+        network.run_nodes_processes()
+
+        for _ in range(300):
+            master.send_message('Blip', 4, rand.randrange(1, 30))
+
+        network.env.run()
+
+        return master.metrics
+
+    def test_fewer_changes(self):
+
+        metrics = self.run_cliques(None)
+        expected = self.received
+
+        stability = RouteStability(margin=0.1, min_dwell=5000)
+        stable_metrics = self.run_cliques(stability)
+
+        self.assertEqual(self.received, expected)
+        self.assertLess(stable_metrics.parent_changes, metrics.parent_changes)
+        self.assertLess(stable_metrics.address_swaps, metrics.address_swaps)
+        self.assertGreater(stability.avoided_changes, 0)
+
+    def test_lazy_paths(self):
+        with self.assertRaises(ValueError):
+            MasterNode(Network(), lazy_paths=True,
+                       route_stability=RouteStability())
+
+
+class StableRoutesTestTreeConfiguration(TestTreeConfiguration):
+
+    def setUp(self):
+        super().setUp()
+        self.nodes[0].route_stability = RouteStability(margin=0.1,
+                                                       min_dwell=2000)
+
+
+class TestTopologyChanges(unittest.TestCase):
+
+    lazy_paths = False
+    make_estimator = None
+
+    def setUp(self):
+        self.network = network = Network(transmission_speed=0.5)
+        network.configure_root_logger(level=logging.DEBUG)
+
+        self.received = received = []
+
+        self.master = master = MasterNode(
+            network, on_message_received=lambda _, m, __: received.append(m),
+            lazy_paths=self.lazy_paths, unreachable_after=2,
+            noise_estimator=(None if self.make_estimator is None
+                             else self.make_estimator())
+        )
+
+        self.nodes = nodes = [master]
+        nodes.extend(self.make_slave(i) for i in range(1, 6))
+
+        # Two branches joining at the last slave: 0-1-2-5 and 0-3-4-5.
+        netgraph = network.netgraph
+        netgraph.add_path(nodes[:3])
+        netgraph.add_path([nodes[0], nodes[3], nodes[4]])
+        netgraph.add_edge(nodes[2], nodes[5])
+        netgraph.add_edge(nodes[4], nodes[5])
+
+        master.init_from_static_addr_graph(nx.relabel_nodes(
+            netgraph, lambda node: node.static_address
+        ))
+        network.run_nodes_processes()
+
+    def make_slave(self, static_addr):
+
+        def slave_on_received(slave, msg, _):
+            return slave.static_address, 1
+
+        return SlaveNode(self.network, static_addr,
+                         on_message_received=slave_on_received)
+
+    def send(self, dest_addrs):
+
+        completions = [self.master.send_message('Blip', 4, addr)
+                       for addr in dest_addrs]
+        self.network.env.run()
+
+        return [completion.value.outcome for completion in completions]
+
+    def assert_answered(self, dest_addrs):
+        self.assertEqual(self.send(dest_addrs),
+                         [MessageOutcome.answered] * len(dest_addrs))
+
+    def test_add_node(self):
+
+        netgraph = self.network.netgraph
+        slave = self.make_slave(6)
+        netgraph.add_edge(self.nodes[2], slave)
+        slave.run_proc()
+
+        self.master.add_node(6, [2])
+
+        self.assertEqual(
+            [node.static_address for node in self.master._shortest_paths[
+                self.master._node_manager[6]]],
+            [0, 1, 2, 6]
+        )
+        self.assert_answered([6, 5, 2])
+
+    def test_remove_edge(self):
+
+        self.assert_answered([5])
+
+        netgraph = self.network.netgraph
+        netgraph.remove_edge(self.nodes[1], self.nodes[2])
+        self.master.remove_edge(1, 2)
+
+        self.assert_answered([2, 5, 1])
+        self.assertNotIn(self.nodes[1].static_address,
+                         [node.static_address for node in
+                          self.master._shortest_paths[
+                              self.master._node_manager[2]]])
+
+    def test_remove_node(self):
+
+        netgraph = self.network.netgraph
+        netgraph.remove_node(self.nodes[3])
+        self.master.remove_node(3)
+
+        self.assertEqual(self.send([3]), [MessageOutcome.unreachable])
+        self.assert_answered([4, 5])
+        self.assertEqual(self.master.metrics.timeouts, 0)
+
+    def test_unreachable_after_timeouts(self):
+
+        netgraph = self.network.netgraph
+        edges = netgraph.edges(self.nodes[4])
+        netgraph.remove_node(self.nodes[4])
+
+        self.assertEqual(self.send([4, 4, 4]), [
+            MessageOutcome.timed_out, MessageOutcome.timed_out,
+            MessageOutcome.unreachable
+        ])
+        self.assertIn(4, self.master.unreachable_nodes)
+        self.assert_answered([5, 3])
+
+        netgraph.add_edges_from(edges)
+        self.master.restore_node(4)
+
+        self.assertNotIn(4, self.master.unreachable_nodes)
+        self.assert_answered([4, 5])
+
+    def test_restored_by_report(self):
+
+        master = self.master
+        nodes = master._node_manager
+        master.mark_unreachable(4)
+
+        # The entry of a full report may be older than the failure.
+        master._update_node_graph_from_table(nodes[5], NoiseReport({4: 0.1}))
+        self.assertIn(4, master.unreachable_nodes)
+
+        # Like the answer carrying the report, which then updates the paths.
+        master._update_node_graph_from_table(
+            nodes[5], NoiseReport({4: 0.1}, full=False)
+        )
+        master._topology_changed()
+
+        self.assertNotIn(4, master.unreachable_nodes)
+        self.assert_answered([4])
+
+    def test_restored_by_probe(self):
+
+        master = self.master
+        master.unreachable_probe_interval = interval = 100000
+        env = self.network.env
+        netgraph = self.network.netgraph
+        edges = netgraph.edges(self.nodes[4])
+        netgraph.remove_node(self.nodes[4])
+
+        completions = [master.send_message('Blip', 4, 4) for _ in range(2)]
+        env.run(until=completions[-1])
+        marked_time = env.now
+        self.assertIn(4, master.unreachable_nodes)
+
+        # The probe times out, and the node is probed again later.
+        env.run(until=marked_time + interval * 3 / 2)
+        self.assertIn(4, master.unreachable_nodes)
+
+        netgraph.add_edges_from(edges)
+        self.assertEqual(self.send([4]), [MessageOutcome.unreachable])
+        self.assertNotIn(4, master.unreachable_nodes)
+
+        # The answer to the probe doesn't reach the application.
+        self.received.clear()
+        self.assert_answered([4, 5])
+        self.assertEqual(self.received, [4, 5])
+
+    def test_new_node_in_noise_table(self):
+
+        master = self.master
+        master._update_node_graph_from_table(
+            master._node_manager[5], NoiseReport({6: 100})
+        )
+
+        new_node = master._node_manager[6]
+        self.assertTrue(master.node_graph.has_edge(master._node_manager[5],
+                                                   new_node))
+
+        master.remove_node(6)
+        master._update_node_graph_from_table(
+            master._node_manager[5], NoiseReport({6: 100})
+        )
+
+        self.assertNotIn(6, master._node_manager)
+
+    def test_aged_out_edge(self):
+
+        master = self.master
+        nodes = master._node_manager
+        self.assertTrue(master.node_graph.has_edge(nodes[5], nodes[4]))
+
+        master._update_node_graph_from_table(
+            nodes[5], NoiseReport(full=False, removed=[4])
+        )
+
+        self.assertFalse(master.node_graph.has_edge(nodes[5], nodes[4]))
+
+
+class LazyPathsTestTopologyChanges(TestTopologyChanges):
+
+    lazy_paths = True
+
+
+class EstimatorTestTopologyChanges(TestTopologyChanges):
+
+    make_estimator = EwmaEstimator
+
+    def test_estimator_edges(self):
+
+        master = self.master
+        estimator = master.noise_estimator
+
+        # The noise of an added edge replaces the estimate.
+        master.add_edge(1, 2, noise=30)
+        self.assertEqual(estimator.estimate(1, 2), 30)
+
+        master.remove_edge(1, 2)
+        self.assertIsNone(estimator.estimate(1, 2))
+
+        master.mark_unreachable(4)
+        self.assertIsNone(estimator.estimate(4, 5))
+
+        master.restore_node(4)
+        self.assertEqual(estimator.estimate(4, 5), 0.5)
+
+        master.remove_node(3)
+        self.assertIsNone(estimator.estimate(3, 4))
+
+        # The tables of the neighbors may still report the removed node.
+        master._update_node_graph_from_table(master._node_manager[4],
+                                             NoiseReport({3: 100}))
+        self.assertIsNone(estimator.estimate(3, 4))
+
+        self.assertEqual(len(estimator), master.node_graph.number_of_edges())
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def make_network(self, ack_timeout=None):
+
+        self.network = network = Network(transmission_speed=0.5)
+        network.configure_root_logger(level=logging.DEBUG)
+
+        self.received = received = []
+
+        self.master = master = MasterNode(
+            network, on_message_received=lambda _, m, __: received.append(m),
+            ack_timeout=ack_timeout
+        )
+
+        def slave_on_received(slave, msg, _):
+            return slave.static_address, 1
+
+        # Physical addresses sharing long prefixes, whose answers keep
+        # colliding until their last bits.
+        physical_addrs = [0b1011 << 18, (0b1011 << 18) | 1,
+                          (0b1011 << 18) | 2, 5, 1 << 21, 7, 3 << 20, 9]
+
+        self.slaves = slaves = [
+            SlaveNode(network, None, slave_on_received,
+                      ack_timeout=ack_timeout, physical_address=addr)
+            for addr in physical_addrs
+        ]
+
+        # Four neighbors of the master, with a cycle and a chain behind
+        # them.
+        netgraph = network.netgraph
+        netgraph.add_star([master, *slaves[:4]])
+        netgraph.add_path([slaves[0], slaves[4], slaves[5], slaves[6]])
+        netgraph.add_path([slaves[1], slaves[5]])
+        netgraph.add_path([slaves[6], slaves[7]])
+
+    def discover(self, **kwargs):
+
+        discovery = self.master.discover(**kwargs)
+        self.network.run_nodes_processes()
+
+        return self.network.env.run(discovery)
+
+    def assert_configured(self, report):
+
+        slaves = self.slaves
+
+        self.assertEqual(report.nodes, len(slaves))
+        self.assertEqual(report.levels, 4)
+        self.assertEqual(report.failed_probers, [])
+        self.assertEqual(sorted(slave.static_address for slave in slaves),
+                         list(range(1, len(slaves) + 1)))
+
+        # Only the master has collisions among its neighbors.
+        self.assertGreater(self.master.hello_collisions, 0)
+
+        for slave in slaves:
+            self.master.send_message('Blip', 4, slave.static_address)
+
+        self.network.env.run()
+
+        self.assertEqual(sorted(self.received),
+                         list(range(1, len(slaves) + 1)))
+
+    def test_discover(self):
+        self.make_network()
+        self.assert_configured(self.discover())
+
+    def test_repeated_probe_requests(self):
+        self.make_network()
+        report = self.discover(max_nodes_per_probe=1)
+
+        self.assert_configured(report)
+        self.assertGreater(report.probe_requests, len(self.slaves))
+
+    def test_link_acks(self):
+        self.make_network(ack_timeout=50)
+        self.assert_configured(self.discover())
+
+    def test_already_initialized(self):
+        self.make_network()
+        self.discover()
+
+        with self.assertRaises(ValueError):
+            self.master.discover()
+
+    def test_probe_prefix(self):
+
+        probe = HelloProbePacket()
+        probe.physical_address = 0b101 << 19
+        probe.prefix_length = 3
+
+        self.assertTrue(probe.matches((0b101 << 19) | 12345))
+        self.assertFalse(probe.matches(0b100 << 19))
+
+
+class TestSegments(unittest.TestCase):
+
+    def setUp(self):
+
+        self.network = network = Network(transmission_speed=0.5)
+        network.configure_root_logger(level=logging.DEBUG)
+
+        def slave_on_received(slave, msg, _):
+            return (slave, msg), 1
+
+        self.master = master = MasterNode(network, coalescing_delay=0)
+        slave = SlaveNode(network, 1, slave_on_received)
+        self.gateways = gateways = [
+            GatewayNode(network, addr, slave_on_received) for addr in (2, 3)
+        ]
+
+        netgraph = network.netgraph
+        netgraph.add_path([master, slave, gateways[0]])
+        netgraph.add_edge(master, gateways[1])
+
+        # The segments use the same local addresses.
+        self.segments = segments = [
+            [SlaveNode(network, addr, slave_on_received)
+             for addr in range(1, 5)]
+            for _ in gateways
+        ]
+
+        netgraph.add_path([gateways[0].downlink, *segments[0]])
+        netgraph.add_star([gateways[1].downlink, *segments[1]])
+
+        for gateway in gateways:
+            gateway.init_segment_from_netgraph(netgraph)
+
+        master.init_from_netgraph(netgraph)
+
+        for gateway in gateways:
+            master.add_segment(gateway.static_address, gateway.segment_depth)
+
+        network.run_nodes_processes()
+
+    def send(self, messages):
+
+        completions = self.master.send_many(messages)
+        self.network.env.run(until=100000)
+
+        return [completion.value for completion in completions]
+
+    def test_master_state(self):
+
+        self.assertEqual(
+            sorted(node.static_address for node in self.master.node_graph),
+            [0, 1, 2, 3]
+        )
+        self.assertEqual(self.master.segments, {2: 4, 3: 1})
+
+    def test_segment_addresses(self):
+
+        results = self.send([('Blip', 4, SegmentAddress(2, 4)),
+                             ('Blop', 4, SegmentAddress(3, 4)),
+                             ('Blup', 4, 2)])
+
+        self.assertEqual([result.outcome for result in results],
+                         [MessageOutcome.answered] * 3)
+        self.assertEqual([result.payload for result in results], [
+            (self.segments[0][3], 'Blip'), (self.segments[1][3], 'Blop'),
+            (self.gateways[0], 'Blup')
+        ])
+
+    def test_coalesced_messages(self):
+
+        results = self.send([('Blip', 4, SegmentAddress(2, 3)),
+                             ('Blop', 4, SegmentAddress(2, 3))])
+
+        self.assertEqual([result.payload for result in results],
+                         [(self.segments[0][2], 'Blip'),
+                          (self.segments[0][2], 'Blop')])
+        self.assertEqual(self.master.metrics.requests, 1)
+
+    def test_answers_overflow(self):
+
+        def on_received(_, msg, __):
+            return msg, 40
+
+        self.segments[0][2].on_message_received = MethodType(
+            on_received, self.segments[0][2]
+        )
+
+        results = self.send([(str(i), 1, SegmentAddress(2, 3))
+                             for i in range(100)])
+
+        # The gateway answers only the first messages, as a slave would.
+        answered = (MAX_PAYLOAD_LENGTH //
+                    CoalescedPayload.encoded_length(40))
+        self.assertEqual([result.outcome for result in results],
+                         [MessageOutcome.answered] * answered +
+                         [MessageOutcome.answer_too_long] * (100 - answered))
+        self.assertEqual([result.payload for result in results[:answered]],
+                         [str(i) for i in range(answered)])
+
+    def test_lost_node(self):
+
+        self.network.netgraph.remove_node(self.segments[0][3])
+
+        results = self.send([('Blip', 4, SegmentAddress(2, 4)),
+                             ('Blop', 4, SegmentAddress(2, 5)),
+                             ('Blup', 4, SegmentAddress(2, 3))])
+
+        # The master waits for the transaction in the segment to fail.
+        self.assertEqual([result.outcome for result in results],
+                         [MessageOutcome.timed_out] * 2 +
+                         [MessageOutcome.answered])
+        self.assertEqual(results[2].payload, (self.segments[0][2], 'Blup'))
+        self.assertEqual(self.gateways[0].downlink.metrics.timeouts, 1)
+
+    def test_unknown_segment(self):
+
+        with self.assertRaises(ValueError):
+            self.master.send_many([('Blip', 4, SegmentAddress(1, 1))])
+
+        with self.assertRaises(ValueError):
+            self.master.send_multicast('Blip', 4, [1, SegmentAddress(2, 1)])
+
+    def test_request_frames(self):
+
+        packet = RequestPacket()
+        frames = packet.number_of_frames()
+
+        packet.segment_destination = 4
+        self.assertEqual(packet.number_of_frames(), frames + 1)
+
+
+class TestNoiseReports(unittest.TestCase):
+
+    def setUp(self):
+        self.network = Network(transmission_speed=0.5)
+        self.slave = SlaveNode(self.network, 1, noise_report_threshold=10,
+                               noise_full_report_interval=2)
+
+    def _overhear(self, source, noise):
+        self.slave.noise_table[source] = noise
+        self.slave._changed_noise_sources.add(source)
+
+    def test_delta_reports(self):
+
+        slave = self.slave
+
+        self._overhear(2, 100)
+        self._overhear(3, 200)
+
+        report = slave._make_noise_report()
+        self.assertTrue(report.full)
+        self.assertEqual(report, {2: 100, 3: 200})
+
+        self._overhear(2, 105)
+        self._overhear(3, 250)
+
+        report = slave._make_noise_report()
+        self.assertFalse(report.full)
+        self.assertEqual(report, {3: 250})
+
+        # Changes below the threshold accumulate until they are reported.
+        self._overhear(2, 111)
+
+        report = slave._make_noise_report()
+        self.assertFalse(report.full)
+        self.assertEqual(report, {2: 111})
+
+        report = slave._make_noise_report()
+        self.assertTrue(report.full)
+        self.assertEqual(report, {2: 111, 3: 250})
+
+    def test_refresh_request(self):
+
+        slave = self.slave
+
+        self._overhear(2, 100)
+        slave._make_noise_report()
+
+        slave._full_noise_report_due = True
+        report = slave._make_noise_report()
+
+        self.assertTrue(report.full)
+        self.assertEqual(report, {2: 100})
+
+
+class LossySlaveNode(SlaveNode):
+    """
+    SlaveNode che perde i primi pacchetti di un tipo a esso indirizzati.
+    """
+
+    losses = 0
+    lost_type = RequestPacket
+
+    def _check_packet(self, received):
+
+        if (self.losses > 0 and isinstance(received, self.lost_type) and
+                received.next_hop == self.static_address):
+            self.losses -= 1
+            return
+
+        super()._check_packet(received)
+
+
+class TestHopAcks(unittest.TestCase):
+
+    def run_line(self, ack_timeout=None, losses=0, lost_type=RequestPacket,
+                 lossy_slave=3):
+
+        network = Network(transmission_speed=0.5)
+        kwargs = {} if ack_timeout is None else {'ack_timeout': ack_timeout}
+
+        self.payloads = payloads = []
+
+        def on_received(slave, msg, _):
+            payloads.append((slave.static_address, msg))
+            return 'Blop', 4
+
+        master = MasterNode(network, **kwargs)
+        slaves = [LossySlaveNode(network, i, on_message_received=on_received,
+                                 **kwargs)
+                  for i in range(1, 6)]
+
+        slaves[lossy_slave - 1].losses = losses
+        slaves[lossy_slave - 1].lost_type = lost_type
+
+        network.netgraph.add_path((master, *slaves))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        master.send_message('Blip', 4, 5)
+        network.env.run(until=100000)
+
+        retransmissions = sum(n.retransmissions for n in (master, *slaves))
+        return master.metrics, retransmissions
+
+    def test_lost_request_without_acks(self):
+        metrics, _ = self.run_line(losses=1)
+        self.assertEqual(metrics.timeouts, 1)
+        self.assertEqual(self.payloads, [])
+
+    def test_local_retransmission(self):
+
+        ack_timeout = 10
+        lossless, _ = self.run_line(ack_timeout)
+
+        for lost_type in (RequestPacket, ResponsePacket):
+            metrics, retransmissions = self.run_line(ack_timeout, losses=1,
+                                                     lost_type=lost_type)
+
+            self.assertEqual(metrics.answers, 1)
+            self.assertEqual(retransmissions, 1)
+            self.assertEqual(self.payloads, [(5, 'Blip')])
+
+            # The loss costs a single hop, instead of the whole round trip.
+            extra_latency = metrics.latencies[0] - lossless.latencies[0]
+            self.assertGreater(extra_latency, ack_timeout)
+            self.assertLess(extra_latency, lossless.latencies[0] / 4)
+
+    def test_lost_ack(self):
+
+        lossless, _ = self.run_line(10)
+
+        # Slave 2 hears slave 3 forwarding the request, which acks it.
+        metrics, retransmissions = self.run_line(10, losses=1,
+                                                 lost_type=AckPacket,
+                                                 lossy_slave=2)
+
+        self.assertEqual(retransmissions, 0)
+        self.assertEqual(metrics.latencies, lossless.latencies)
+
+        # Slave 1 loses the acks of slave 2 and of the master, so it
+        # retransmits the response, which the master acks again without
+        # handling it twice.
+        metrics, retransmissions = self.run_line(10, losses=2,
+                                                 lost_type=AckPacket,
+                                                 lossy_slave=1)
+
+        self.assertEqual(retransmissions, 1)
+        self.assertEqual(metrics.answers, 1)
+        self.assertEqual(metrics.timeouts, 0)
+        self.assertEqual(self.payloads, [(5, 'Blip')])
+
+    def test_interleaved_duplicates(self):
+
+        network = Network(transmission_speed=0.5)
+        env = network.env
+        slave = SlaveNode(network, 1, ack_timeout=10)
+
+        def receive(token, source, after=5):
+
+            packet = ResponsePacket()
+            packet.token = token
+            packet.source_static = source
+            packet.next_hop = 1
+
+            env.run(until=env.now + after)
+            return slave._handle_link_ack(packet)
+
+        # The retransmission of the first packet arrives after the packet
+        # of another transaction.
+        self.assertTrue(receive(1, 2))
+        self.assertTrue(receive(2, 3))
+        self.assertFalse(receive(1, 2))
+        self.assertFalse(receive(2, 3))
+
+        self.assertTrue(receive(1, 2, after=1000))
+
+    def test_same_token_waiters(self):
+
+        network = Network(transmission_speed=0.5)
+        env = network.env
+        slave = SlaveNode(network, 1, ack_timeout=10)
+
+        # An address assignment, whose token is the address modulo 8, and
+        # the packet of a transaction with the same token.
+        first = env.process(slave._wait_for_ack(3, None))
+        second = env.process(slave._wait_for_ack(3, 2))
+        env.run(until=1)
+
+        # The acks only carry the token: the second packet waits for the
+        # first one to be acked.
+        self.assertTrue(first.triggered)
+        self.assertFalse(second.triggered)
+
+        slave._ack_received(3)
+        env.run(until=2)
+
+        self.assertTrue(first.value.triggered)
+        self.assertTrue(second.triggered)
+        self.assertFalse(second.value.triggered)
+
+        slave._ack_received(3, 2)
+        self.assertTrue(second.value.triggered)
+        self.assertEqual(slave._ack_waiters, {})
+
+
+class DamagingSlaveNode(SlaveNode):
+    """
+    SlaveNode che riceve con errori la coda della prima richiesta che deve
+    inoltrare.
+    """
+
+    damage = False
+    damaged_received = 0
+    forwarded_damaged = 0
+
+    def _check_packet(self, received):
+
+        if (self.damage and isinstance(received, RequestPacket) and
+                received.next_hop == self.static_address and received.path):
+            self.damage = False
+            received.damage_frame(received.number_of_frames() - 1, 2)
+
+        super()._check_packet(received)
+
+    def _unreadable_packet_received(self, packet):
+        if self.cut_through and packet.next_hop == self.static_address:
+            self.damaged_received += 1
+        super()._unreadable_packet_received(packet)
+
+    def _damaged_packet_next_hop(self, packet):
+
+        next_hop = super()._damaged_packet_next_hop(packet)
+
+        if next_hop is not None:
+            self.forwarded_damaged += 1
+
+        return next_hop
+
+
+class TestCutThrough(unittest.TestCase):
+
+    def run_line(self, cut_through, length=5, ack_timeout=None,
+                 damaging_slave=None):
+
+        network = Network(transmission_speed=0.5)
+        kwargs = {} if ack_timeout is None else {'ack_timeout': ack_timeout}
+
+        self.payloads = payloads = []
+
+        def on_received(slave, msg, _):
+            payloads.append((slave.static_address, msg))
+            return 'Blop', 4
+
+        master = MasterNode(network, **kwargs)
+        slaves = [DamagingSlaveNode(network, i, on_message_received=on_received,
+                                    cut_through=cut_through, **kwargs)
+                  for i in range(1, length + 1)]
+
+        if damaging_slave is not None:
+            slaves[damaging_slave - 1].damage = True
+
+        network.netgraph.add_path((master, *slaves))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        for addr in range(1, length + 1):
+            master.send_message('Blip', 4, addr)
+
+        network.env.run(until=100000)
+
+        self.retransmissions = sum(n.retransmissions
+                                   for n in (master, *slaves))
+        self.damaged_received = [s.damaged_received for s in slaves]
+        self.forwarded_damaged = [s.forwarded_damaged for s in slaves]
+        return master.metrics
+
+    def test_lower_latency(self):
+
+        store_and_forward = self.run_line(False)
+        expected_payloads = self.payloads
+        cut_through = self.run_line(True)
+
+        self.assertEqual(cut_through.answers, 5)
+        self.assertEqual(self.payloads, expected_payloads)
+
+        # A single hop has nothing to overlap with.
+        self.assertEqual(cut_through.latencies[0],
+                         store_and_forward.latencies[0])
+
+        for latency, sf_latency in zip(cut_through.latencies[1:],
+                                       store_and_forward.latencies[1:]):
+            self.assertLess(latency, sf_latency)
+
+    def test_damaged_tail(self):
+
+        metrics = self.run_line(True, ack_timeout=10, damaging_slave=3)
+
+        # Slave 3 is the destination of the damaged request, whose path is
+        # in the tail, and can't forward it: slave 2 doesn't receive the
+        # ack and retransmits it.
+        self.assertEqual(metrics.answers, 5)
+        self.assertEqual(metrics.timeouts, 0)
+        self.assertEqual(self.damaged_received, [0, 0, 1, 0, 0])
+        self.assertEqual(self.forwarded_damaged, [0, 0, 0, 0, 0])
+        self.assertEqual(self.retransmissions, 1)
+        self.assertEqual(self.payloads, [(i, 'Blip') for i in range(1, 6)])
+
+    def test_damaged_tail_multi_hop(self):
+
+        network = Network(transmission_speed=0.5)
+
+        request = RequestPacket()
+        request.source_static = 10
+        request.next_hop = 1
+        request.destination = 4
+        request.code_is_addressing_static = False
+        request.path = []
+        request.new_logic_addresses = {}
+        request.payload = 'Blip'
+        request.payload_length = 4
+        request.damage_frame(request.number_of_frames() - 1, 2)
+
+        sender = SenderNode(network, [(request, request.number_of_frames())])
+        slaves = [DamagingSlaveNode(network, i, cut_through=True)
+                  for i in range(1, 5)]
+
+        # Every slave routes the logic address of the next one to it.
+        for slave in slaves:
+            slave.logic_address = slave.static_address
+            slave.last_sent_routing_table[slave.static_address + 1] = (
+                slave.static_address + 1
+            )
+
+        network.netgraph.add_path((sender, *slaves))
+        network.run_nodes_processes()
+        network.env.run(until=10000)
+
+        # Every slave forwards the damaged request to the next hop, until
+        # the destination discards it.
+        self.assertEqual([s.damaged_received for s in slaves], [1, 1, 1, 1])
+        self.assertEqual([s.forwarded_damaged for s in slaves], [1, 1, 1, 0])
+        self.assertEqual(sum(s.transmitted_frames for s in slaves),
+                         3 * request.header_frames())
+
+
+class TestMulticast(unittest.TestCase):
+
+    def setUp(self):
+        self.network = network = Network(transmission_speed=0.5)
+
+        self.received = received = []
+        self.answer_times = answer_times = []
+
+        def on_received(_, msg, __):
+            received.append(msg)
+            answer_times.append(network.env.now)
+
+        def slave_on_received(slave, _, __):
+            res = f'Blop_{slave.static_address}'
+            return res, len(res)
+
+        self.master = master = MasterNode(network,
+                                          on_message_received=on_received)
+
+        self.nodes = nodes = [master]
+        nodes.extend(
+            LossySlaveNode(network, i, on_message_received=slave_on_received)
+            for i in range(1, 18)
+        )
+
+        netgraph = network.netgraph
+        netgraph.add_path(nodes[:3])
+
+        for first, last in ((2, 6), (6, 10), (10, 14), (14, 18)):
+            netgraph.add_edges_from(combinations(nodes[first:last], 2))
+
+        netgraph.add_edges_from(((nodes[3], nodes[6]), (nodes[4], nodes[10]),
+                                 (nodes[5], nodes[14])))
+
+        master.init_from_netgraph(netgraph)
+        network.run_nodes_processes()
+
+    def expected_answers(self, rounds=1):
+        return sorted(f'Blop_{i}' for i in range(1, 18)) * rounds
+
+    def test_collection_round(self):
+
+        for addr in range(1, 18):
+            self.master.send_message('Blip', 4, addr)
+
+        self.network.env.run()
+
+        unicast_time = self.answer_times[-1]
+        unicast_frames = sum(n.transmitted_frames for n in self.nodes)
+        self.assertEqual(sorted(self.received), self.expected_answers())
+
+        for node in self.nodes:
+            node.transmitted_frames = 0
+
+        del self.received[:]
+        start = self.network.env.now
+
+        self.master.send_multicast('Blip', 4, range(1, 18))
+        self.network.env.run()
+
+        multicast_time = self.answer_times[-1] - start
+        multicast_frames = sum(n.transmitted_frames for n in self.nodes)
+
+        self.assertEqual(sorted(self.received), self.expected_answers())
+        self.assertLess(multicast_frames, unicast_frames * 2 / 3)
+        self.assertLess(multicast_time, unicast_time * 2 / 3)
+
+    def test_some_destinations(self):
+
+        self.master.send_multicast('Blip', 4, [2, 8, 13])
+        self.network.env.run()
+
+        self.assertEqual(sorted(self.received),
+                         ['Blop_13', 'Blop_2', 'Blop_8'])
+        self.assertEqual(self.master.metrics.answers, 1)
+
+    def test_lost_subtree(self):
+
+        lossy = self.nodes[6]
+        lossy.losses = 1
+        lossy.lost_type = MulticastRequestPacket
+
+        self.master.send_multicast('Blip', 4, range(1, 18))
+        self.network.env.run()
+
+        # The parent of the lossy node gives up waiting for its subtree, but
+        # the answers of the rest of the tree reach the master.
+        self.assertNotIn('Blop_6', self.received)
+        self.assertGreater(len(self.received), 10)
+        self.assertEqual(self.master.metrics.timeouts, 0)
+        self.assertIn(6, self.master._noise_refresh_needed)
+
+        del self.received[:]
+
+        self.master.send_multicast('Blip', 4, range(1, 18))
+        self.network.env.run()
+
+        self.assertEqual(sorted(self.received), self.expected_answers())
+        self.assertEqual(self.master._noise_refresh_needed, set())
+
+    def test_lost_children(self):
+
+        network = Network()
+
+        self.received = received = []
+
+        def slave_on_received(slave, _, __):
+            res = f'Blop_{slave.static_address}'
+            return res, len(res)
+
+        master = MasterNode(
+            network, on_message_received=lambda _, m, __: received.append(m)
+        )
+        slaves = [LossySlaveNode(network, i,
+                                 on_message_received=slave_on_received)
+                  for i in range(1, 6)]
+
+        netgraph = network.netgraph
+        netgraph.add_path((master, *slaves[:2]))
+        netgraph.add_star((slaves[1], *slaves[2:]))
+
+        master.init_from_netgraph(netgraph)
+        network.run_nodes_processes()
+
+        for slave in slaves[2:]:
+            slave.losses = 1
+            slave.lost_type = MulticastRequestPacket
+
+        master.send_multicast('Blip', 4, range(1, 6))
+        network.env.run()
+
+        # Node 2 waits for each of its children in turn: its parent waits
+        # for all of them, and for node 2 itself.
+        self.assertEqual(sorted(received), ['Blop_1', 'Blop_2'])
+        self.assertEqual(master.metrics.timeouts, 0)
+
+
+class TestCoalescing(unittest.TestCase):
+
+    def run_line(self, coalescing_delay, late_messages=()):
+
+        network = Network(transmission_speed=0.5)
+
+        self.received = received = []
+
+        def on_received(_, msg, __):
+            received.append(msg)
+
+        def slave_on_received(slave, msg, _):
+            res = f'{msg}_{slave.static_address}'
+            return res, len(res)
+
+        master = MasterNode(network, on_message_received=on_received,
+                            coalescing_delay=coalescing_delay)
+        slaves = [SlaveNode(network, i, on_message_received=slave_on_received)
+                  for i in range(1, 6)]
+
+        network.netgraph.add_path((master, *slaves))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        for i in range(10):
+            master.send_message(f'M{i}', 2, 5 - 2 * (i % 2))
+
+        def send_late():
+            for delay, msg, addr in late_messages:
+                yield network.env.timeout(delay)
+                master.send_message(msg, len(msg), addr)
+
+        network.env.process(send_late())
+        network.env.run()
+
+        return master.metrics
+
+    def expected(self, addrs=(5, 3)):
+        return [f'M{i}_{addrs[i % 2]}' for i in range(10)]
+
+    def test_same_answers(self):
+
+        plain = self.run_line(None)
+        self.assertEqual(self.received, self.expected())
+
+        coalesced = self.run_line(0)
+
+        # The answers are delivered per message, grouped by destination.
+        self.assertEqual(sorted(self.received), sorted(self.expected()))
+        self.assertEqual(self.received[:5], self.expected()[::2])
+
+        self.assertEqual(plain.requests, 10)
+        self.assertEqual(coalesced.requests, 2)
+        self.assertLess(coalesced.elapsed_time, plain.elapsed_time / 2)
+
+    def test_latency_bound(self):
+
+        late = [(10, 'L0', 5), (30, 'L1', 5)]
+
+        self.run_line(0, late)
+        immediate = list(self.received)
+
+        self.run_line(20, late)
+
+        # Only the message queued within the delay joins the first request.
+        self.assertEqual(immediate[:6], self.expected()[::2] + ['M1_3'])
+        self.assertEqual(self.received[:6], self.expected()[::2] + ['L0_5'])
+
+    def test_length_prefix(self):
+
+        payload = CoalescedPayload([('Blip', 127), ('Blop', 128)])
+
+        # Only the longer message needs two bytes for its length.
+        self.assertEqual(payload.length, 128 + 130)
+
+    def send_long_answers(self, max_answer_length):
+
+        network = Network(transmission_speed=0.5)
+
+        def slave_on_received(_, msg, __):
+            return msg, 40
+
+        master = MasterNode(network, coalescing_delay=0,
+                            max_answer_length=max_answer_length)
+        slave = SlaveNode(network, 1, on_message_received=slave_on_received)
+
+        network.netgraph.add_edge(master, slave)
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        completions = master.send_many(
+            [(str(i), 1, 1) for i in range(100)]
+        )
+        network.env.run()
+
+        return master.metrics, [completion.value for completion in completions]
+
+    def test_answers_overflow(self):
+
+        metrics, results = self.send_long_answers(None)
+
+        # The answers of all the messages don't fit in a single response: the
+        # slave answers only the first ones.
+        answered = (MAX_PAYLOAD_LENGTH //
+                    CoalescedPayload.encoded_length(40))
+        self.assertEqual(metrics.requests, 1)
+        self.assertEqual([result.outcome for result in results],
+                         [MessageOutcome.answered] * answered +
+                         [MessageOutcome.answer_too_long] * (100 - answered))
+        self.assertEqual([result.payload for result in results[:answered]],
+                         [str(i) for i in range(answered)])
+
+    def test_max_answer_length(self):
+
+        metrics, results = self.send_long_answers(40)
+
+        self.assertEqual(metrics.requests, 3)
+        self.assertEqual([result.outcome for result in results],
+                         [MessageOutcome.answered] * 100)
+        self.assertEqual([result.payload for result in results],
+                         [str(i) for i in range(100)])
+
+
+class TestSchedulingPolicies(unittest.TestCase):
+
+    def run_line(self, policy, messages):
+
+        network = Network(transmission_speed=0.5)
+
+        self.received = received = []
+
+        def slave_on_received(slave, msg, _):
+            return slave.static_address, 1
+
+        master = MasterNode(
+            network, on_message_received=lambda _, m, __: received.append(m),
+            scheduling_policy=policy
+        )
+        slaves = [SlaveNode(network, i, on_message_received=slave_on_received)
+                  for i in range(1, 6)]
+
+        network.netgraph.add_path((master, *slaves))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        def send_messages():
+            for delay, addr, priority in messages:
+                if delay > 0:
+                    yield network.env.timeout(delay)
+                master.send_message('Blip', 4, addr, priority)
+
+        network.env.process(send_messages())
+        network.env.run()
+
+        return master.metrics
+
+    def test_tree_order(self):
+
+        messages = [(0, 5, 0), (0, 1, 0), (0, 4, 0), (0, 2, 0), (0, 3, 0),
+                    (0, 1, 0)]
+
+        metrics = self.run_line(TreeOrderPolicy(), messages)
+        self.assertEqual(self.received, [5, 4, 3, 2, 1, 1])
+        self.assertEqual(len(metrics.queueing_times), 6)
+
+        # The first request assigns the addresses of the whole path, which
+        # the others use.
+        self.assertEqual(metrics.static_addressing_requests, 1)
+
+        # Once the first message is sent, the others have waited too long
+        # and are served in arrival order.
+        self.run_line(TreeOrderPolicy(max_delay=0), messages)
+        self.assertEqual(self.received, [5, 1, 4, 2, 3, 1])
+
+    def test_priority_aging(self):
+
+        messages = [(0, 1, 0), (0, 5, 2), (0, 4, 1), (10, 3, 0)]
+
+        self.run_line(PriorityAgingPolicy(aging_rate=0), messages)
+        self.assertEqual(self.received, [1, 3, 4, 5])
+
+        # The oldest message overtakes the one with a higher priority.
+        self.run_line(PriorityAgingPolicy(aging_rate=1), messages)
+        self.assertEqual(self.received, [1, 4, 5, 3])
+
+
+class TestSendMany(unittest.TestCase):
+
+    def setUp(self):
+
+        self.network = network = Network(transmission_speed=0.5)
+
+        def slave_on_received(slave, msg, _):
+            res = f'{msg}_{slave.static_address}'
+            return res, len(res)
+
+        self.master = MasterNode(network, coalescing_delay=None)
+        self.slaves = [LossySlaveNode(network, i,
+                                      on_message_received=slave_on_received)
+                       for i in range(1, 6)]
+
+        network.netgraph.add_path((self.master, *self.slaves))
+        self.master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+    def test_results(self):
+
+        self.slaves[3].losses = 1
+
+        events = self.master.send_many(
+            (f'M{addr}', 2, addr) for addr in range(1, 6)
+        )
+        self.network.env.run()
+
+        results = [ev.value for ev in events]
+
+        self.assertEqual([r.outcome for r in results],
+                         [MessageOutcome.answered] * 3 +
+                         [MessageOutcome.timed_out, MessageOutcome.answered])
+        self.assertEqual([r.payload for r in results],
+                         ['M1_1', 'M2_2', 'M3_3', None, 'M5_5'])
+        self.assertIsNone(results[3].latency)
+
+        latencies = [results[i].latency for i in (0, 1, 2, 4)]
+        self.assertEqual(latencies, sorted(latencies))
+        self.assertEqual(latencies, self.master.metrics.latencies)
+
+        queueing_times = [r.queueing_time for r in results]
+        self.assertEqual(queueing_times[0], 0)
+        self.assertEqual(queueing_times, sorted(queueing_times))
+
+        self.assertEqual([r.retries for r in results], [0] * 5)
+
+    def test_coalesced_results(self):
+
+        self.master.coalescing_delay = 0
+
+        events = self.master.send_many([('A', 1, 3), ('B', 1, 3), ('C', 1, 3)])
+        self.network.env.run()
+
+        results = [ev.value for ev in events]
+
+        self.assertEqual([r.payload for r in results], ['A_3', 'B_3', 'C_3'])
+        self.assertEqual(len({r.latency for r in results}), 1)
+        self.assertEqual(self.master.metrics.requests, 1)
+
+    def test_coalesced_queueing_times(self):
+
+        master = self.master
+        master.coalescing_delay = 100
+        env = self.network.env
+
+        def send_later():
+            yield env.timeout(40)
+            return master.send_message('B', 1, 3)
+
+        first = master.send_message('A', 1, 3)
+        second = env.process(send_later())
+        env.run()
+
+        # Every message has waited since it was queued.
+        self.assertEqual(master.metrics.requests, 1)
+        self.assertEqual(first.value.queueing_time, 100)
+        self.assertEqual(second.value.value.queueing_time, 60)
+
+    def test_unknown_destination(self):
+
+        with self.assertRaises(ValueError):
+            self.master.send_many([('A', 1, 3), ('B', 1, 42)])
+
+    def test_retries(self):
+
+        network = Network(transmission_speed=0.5)
+        master = MasterNode(network, ack_timeout=10)
+        slave = LossySlaveNode(network, 1, ack_timeout=10)
+        slave.losses = 1
+
+        network.netgraph.add_path((master, slave))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        event, = master.send_many([('A', 1, 1)])
+        network.env.run(until=10000)
+
+        self.assertEqual(event.value.outcome, MessageOutcome.answered)
+        self.assertEqual(event.value.retries, 1)
+
+
+class TestOverload(unittest.TestCase):
+
+    def run_line(self, blocking_source=False, **kwargs):
+
+        network = Network(transmission_speed=0.5)
+
+        master = MasterNode(network, **kwargs)
+        slaves = [SlaveNode(network, i) for i in range(1, 6)]
+
+        network.netgraph.add_path((master, *slaves))
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        self.completions = completions = []
+
+        # A request to the last slave takes a few hundred time units.
+        def source():
+            for i in range(60):
+                if blocking_source:
+                    completions.append(
+                        (yield master.put_message('Blip', 4, 5))
+                    )
+                else:
+                    completions.append(master.send_message('Blip', 4, 5))
+
+                yield network.env.timeout(50)
+
+        network.env.process(source())
+        network.env.run()
+
+        return master
+
+    def outcomes(self):
+        return collections.Counter(ev.value.outcome for ev in self.completions)
+
+    def test_bounded_queueing_time(self):
+
+        unbounded = self.run_line()
+        bounded = self.run_line(queue_capacity=3,
+                                queue_policy=QueuePolicy.drop_oldest)
+
+        service_time = max(bounded.metrics.latencies)
+
+        self.assertGreater(max(unbounded.metrics.queueing_times),
+                           20 * service_time)
+        self.assertLessEqual(max(bounded.metrics.queueing_times),
+                             4 * service_time)
+
+        self.assertEqual(bounded.queue_stats.max_depth, 3)
+        self.assertEqual(self.outcomes()[MessageOutcome.dropped],
+                         bounded.queue_stats.dropped)
+        self.assertEqual(self.outcomes()[MessageOutcome.answered],
+                         bounded.metrics.answers)
+
+    def test_reject(self):
+
+        master = self.run_line(queue_capacity=2,
+                               queue_policy=QueuePolicy.reject)
+
+        self.assertGreater(self.outcomes()[MessageOutcome.rejected], 0)
+        self.assertEqual(self.outcomes()[MessageOutcome.rejected],
+                         master.queue_stats.rejected)
+
+    def test_blocking_source(self):
+
+        master = self.run_line(blocking_source=True, queue_capacity=2)
+
+        # The source is slowed down, and no message is lost.
+        self.assertEqual(self.outcomes()[MessageOutcome.answered], 60)
+        self.assertEqual(master.queue_stats.max_depth, 2)
+
+
+class TestConcurrentDispatch(unittest.TestCase):
+
+    def make_network(self, lossy=(), **kwargs):
+
+        rng = random.Random(0)
+        self.network = network = Network(
+            mac_factory=lambda: MacLayer(RandomBackoff(rng=rng))
+        )
+
+        self.received = received = []
+
+        def on_received(_, msg, __):
+            received.append(msg)
+
+        def slave_on_received(slave, msg, _):
+            res = f'{msg}_{slave.static_address}'
+            return res, len(res)
+
+        self.master = master = MasterNode(network, on_received,
+                                          ack_timeout=30, **kwargs)
+
+        # Four chains of slaves 1-6, 7-12, 13-18, 19-24, every link with its
+        # own bus.
+        for first in range(1, 25, 6):
+            previous = master
+
+            for addr in range(first, first + 6):
+                slave = LossySlaveNode(network, addr, slave_on_received,
+                                       ack_timeout=30)
+                slave.losses = int(addr in lossy)
+                network.netgraph.add_star((Bus(network, 4), previous, slave))
+                previous = slave
+
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        return master
+
+    def learn_answer_delays(self):
+
+        # Until an answer has arrived from the end of a chain, the master
+        # doesn't know when the answers from there arrive.
+        self.master.send_message('W', 3, 6)
+        self.network.env.run()
+
+    def send(self, dest_addrs, learn_answer_delays=False, **kwargs):
+
+        master = self.make_network(**kwargs)
+
+        if learn_answer_delays:
+            self.learn_answer_delays()
+
+        events = master.send_many((f'M{addr}', 3, addr)
+                                  for addr in dest_addrs)
+        self.network.env.run()
+
+        return master.metrics, [ev.value for ev in events]
+
+    def test_separate_branches(self):
+
+        dest_addrs = [6, 12, 18, 24] * 2
+        serial, _ = self.send(dest_addrs)
+        metrics, results = self.send(dest_addrs, max_concurrent_requests=4)
+
+        # Every answer is matched to its request by the token of its
+        # transaction.
+        self.assertEqual([r.payload for r in results],
+                         [f'M{addr}_{addr}' for addr in dest_addrs])
+        # The answers reach the master one at a time.
+        self.assertEqual(metrics.max_concurrency, 2)
+        self.assertGreater(metrics.throughput, 1.25 * serial.throughput)
+
+    def test_unknown_answer_delays(self):
+
+        metrics, results = self.send([6, 12], max_concurrent_requests=4)
+
+        self.assertEqual([r.outcome for r in results],
+                         [MessageOutcome.answered] * 2)
+        self.assertEqual(metrics.max_concurrency, 1)
+
+    def test_retries(self):
+
+        master = self.make_network(lossy=[7], max_concurrent_requests=4)
+        self.learn_answer_delays()
+
+        events = master.send_many((f'M{addr}', 3, addr) for addr in (6, 12))
+        self.network.env.run()
+
+        # Only the request to the second branch is retransmitted, while the
+        # first one is in progress.
+        self.assertEqual(master.metrics.max_concurrency, 2)
+        self.assertEqual([ev.value.retries for ev in events], [0, 1])
+
+    def test_answer_windows(self):
+
+        master = self.make_network(max_concurrent_requests=4)
+        self.learn_answer_delays()
+
+        master.send_many((f'M{addr}', 3, addr) for addr in (6, 12))
+        self.network.env.run(until=self.network.env.now + 100)
+
+        (_, first), (_, second) = (
+            master._transactions[token].windows
+            for token in sorted(master._transactions)
+        )
+
+        # The second request is sent as soon as its answer can't collide
+        # with the first one.
+        self.assertEqual(second[0], first[1])
+
+    def test_answer_from_other_path(self):
+
+        master = self.make_network(max_concurrent_requests=4)
+        self.learn_answer_delays()
+
+        master.send_many((f'M{addr}', 3, addr) for addr in (6, 12))
+        self.network.env.run(until=self.network.env.now + 100)
+
+        tokens = sorted(master._transactions)
+        self.assertEqual(len(tokens), 2)
+
+        # An answer with the token of the first transaction, but from the
+        # branch of the second one.
+        answer = ResponsePacket()
+        answer.token = tokens[0]
+        answer.source_static = 7
+        answer.next_hop = 0
+
+        self.assertIsNone(master._pending_answer_to(answer))
+        self.assertEqual(sorted(master._transactions), tokens)
+
+    def test_same_branch(self):
+
+        metrics, results = self.send([6, 3, 5, 2],
+                                     max_concurrent_requests=4)
+
+        self.assertEqual([r.outcome for r in results],
+                         [MessageOutcome.answered] * 4)
+        self.assertEqual(metrics.max_concurrency, 1)
+
+    def test_conflicting_first(self):
+
+        # The second request waits for the first one, while the third one
+        # is sent meanwhile.
+        metrics, results = self.send([6, 3, 12], learn_answer_delays=True,
+                                     max_concurrent_requests=4)
+
+        self.assertEqual([r.outcome for r in results],
+                         [MessageOutcome.answered] * 3)
+        self.assertEqual(metrics.max_concurrency, 2)
+        self.assertLess(results[2].queueing_time, results[1].queueing_time)
+
+    def test_multicast(self):
+
+        master = self.make_network(max_concurrent_requests=4)
+
+        master.send_message('Blip', 4, 6)
+        master.send_multicast('Blap', 4, [3, 9, 15])
+        master.send_message('Blup', 4, 24)
+        self.network.env.run()
+
+        self.assertEqual(sorted(self.received),
+                         ['Blap_15', 'Blap_3', 'Blap_9', 'Blip_6', 'Blup_24'])
+        self.assertEqual(master.metrics.max_concurrency, 1)
+
+    def test_invalid_options(self):
+
+        network = Network()
+
+        with self.assertRaises(ValueError):
+            MasterNode(network, max_concurrent_requests=0)
+
+        with self.assertRaises(ValueError):
+            MasterNode(network, max_concurrent_requests=4,
+                       coalescing_delay=100)
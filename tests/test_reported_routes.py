@@ -0,0 +1,178 @@
+import unittest
+
+import networkx as nx
+
+from infrastructure import Network
+from protocol import MasterNode
+from protocol.node_data_manager import NodeDataManager
+from protocol.packet import AddressType, NoiseReport
+from protocol.reported_routes import (
+    reported_next_hop, address_heard, transmission_lost, link_heard,
+    table_reported
+)
+
+
+class TestReportedRoutes(unittest.TestCase):
+
+    def setUp(self):
+
+        self.nodes = nodes = NodeDataManager()
+
+        for static_addr in range(1, 4):
+            nodes.create(static_addr, static_addr * 10)
+
+        self.graph = graph = nx.Graph()
+        graph.add_star((nodes[1], nodes[2], nodes[3]))
+
+    def test_unreported_table(self):
+
+        address_heard(self.graph, self.nodes[2], 20)
+        self.assertIsNone(reported_next_hop(self.nodes[1], 20))
+
+    def test_reported_table(self):
+
+        nodes = self.nodes
+
+        address_heard(self.graph, nodes[2], 20)
+        address_heard(self.graph, nodes[3], 30)
+        table_reported(nodes[1])
+
+        self.assertEqual(reported_next_hop(nodes[1], 25), 2)
+        self.assertEqual(reported_next_hop(nodes[1], 30), 3)
+
+        # The node forwards only to addresses above its own.
+        self.assertIsNone(reported_next_hop(nodes[1], 10))
+
+        # The table is the one of the report.
+        address_heard(self.graph, nodes[3], 25)
+        self.assertEqual(reported_next_hop(nodes[1], 25), 2)
+
+    def test_shared_address(self):
+
+        nodes = self.nodes
+
+        # The last node heard with an address replaces the other one.
+        address_heard(self.graph, nodes[2], 20)
+        address_heard(self.graph, nodes[3], 20)
+        table_reported(nodes[1])
+
+        self.assertEqual(reported_next_hop(nodes[1], 20), 3)
+
+    def test_lost_transmission(self):
+
+        nodes = self.nodes
+
+        address_heard(self.graph, nodes[2], 20)
+        table_reported(nodes[1])
+        table_reported(nodes[2])
+
+        transmission_lost(self.graph, nodes[2], (20, 25))
+
+        # The report of the node is lost, and its neighbors may have heard
+        # it with another address.
+        self.assertIsNone(nodes[2].reported_routing_table)
+        self.assertEqual(nodes[1].unknown_routing_entries, {2})
+
+        table_reported(nodes[1])
+        self.assertIsNone(reported_next_hop(nodes[1], 20))
+
+        address_heard(self.graph, nodes[2], 25)
+        table_reported(nodes[1])
+        self.assertEqual(reported_next_hop(nodes[1], 25), 2)
+
+    def test_new_link(self):
+
+        nodes = self.nodes
+
+        link_heard(nodes[2], nodes[3])
+
+        self.assertEqual(nodes[2].unknown_routing_entries, {3})
+        self.assertEqual(nodes[3].unknown_routing_entries, {2})
+
+
+class DynamicAddressingTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.master = master = MasterNode(Network())
+
+        addr_graph = nx.Graph()
+        addr_graph.add_star((0, 1))
+        addr_graph.add_star((1, 2, 3))
+        master.init_from_static_addr_graph(addr_graph, initial_noise_value=0)
+
+        self.nodes = nodes = master._node_manager
+
+        for node in nodes.values():
+            node.current_logic_address = node.logic_address
+
+    def request_path(self, dest_addr):
+
+        master = self.master
+        path = master._shortest_paths[self.nodes[dest_addr]]
+        packet = master._make_request_packet('Blip', 4, path)
+
+        return packet.path
+
+    def heard(self, addr, logic_addr=None):
+
+        node = self.nodes[addr]
+
+        if logic_addr is None:
+            logic_addr = node.current_logic_address
+
+        address_heard(self.master.node_graph, node, logic_addr)
+
+    def report(self, *neighbors):
+
+        for addr in neighbors:
+            self.heard(addr)
+
+        self.master._update_node_graph_from_table(
+            self.nodes[1], NoiseReport({0: 0, 2: 0, 3: 0})
+        )
+
+    def test_unreported_table(self):
+        self.assertEqual(self.request_path(2), [(AddressType.static, 2)])
+
+    def test_reported_table(self):
+        self.report(2, 3)
+        self.assertEqual(self.request_path(2), [])
+
+    def test_unheard_neighbor(self):
+        # Node 1 has not heard node 3 by its current address.
+        self.report(2)
+        self.assertEqual(self.request_path(2), [])
+        self.assertEqual(self.request_path(3), [(AddressType.static, 3)])
+
+    def test_replaced_entry(self):
+
+        # Node 1 has heard node 3 by the address of node 2, which replaces
+        # the entry of node 2 in its table.
+        self.heard(2, self.nodes[2].logic_address)
+        self.heard(3, self.nodes[2].logic_address)
+        self.report()
+
+        self.assertEqual(self.request_path(2), [(AddressType.static, 2)])
+
+    def test_shared_confirmed_address(self):
+
+        # After an address swap, node 3 keeps the confirmed address of node
+        # 2 until it is reached again, but node 1 forwards to node 2.
+        nodes = self.nodes
+        nodes[3].current_logic_address = nodes[2].current_logic_address
+        self.report(2)
+
+        self.assertEqual(self.request_path(2), [])
+        self.assertEqual(self.request_path(3), [(AddressType.static, 3)])
+
+    def test_new_neighbor(self):
+
+        self.report(2, 3)
+
+        # The logic address by which node 1 has heard node 4 is unknown.
+        self.master._update_node_graph_from_table(
+            self.nodes[1], NoiseReport({4: 0})
+        )
+
+        self.assertEqual(self.request_path(2), [(AddressType.static, 2)])
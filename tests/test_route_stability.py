@@ -0,0 +1,77 @@
+import unittest
+
+import networkx as nx
+
+from protocol.route_stability import RouteStability
+
+
+class TestRouteStability(unittest.TestCase):
+
+    def setUp(self):
+        # Node 3 can be reached from 0 through 1 or through 2.
+        self.graph = graph = nx.Graph()
+        graph.add_edges_from(((0, 1), (0, 2), (1, 3), (2, 3)), noise=0.5)
+
+        self.tree = nx.DiGraph([(0, 1), (0, 2), (1, 3)])
+
+    def set_noise(self, u, v, noise):
+        self.graph[u][v]['noise'] = noise
+
+    def parent_of_3(self, stability, now=0):
+        parents = stability.stable_parents(self.graph, 0, self.tree, now,
+                                           weight='noise')
+        return parents[3]
+
+    def test_margin(self):
+
+        stability = RouteStability(margin=0.2)
+
+        self.set_noise(2, 3, 0.45)
+        self.assertEqual(self.parent_of_3(stability), 1)
+        self.assertEqual(stability.avoided_changes, 1)
+
+        self.set_noise(2, 3, 0.3)
+        self.assertEqual(self.parent_of_3(stability), 2)
+
+    def test_min_dwell(self):
+
+        stability = RouteStability(min_dwell=100)
+
+        self.set_noise(2, 3, 0.3)
+        self.assertEqual(self.parent_of_3(stability, now=0), 1)
+        self.assertEqual(self.parent_of_3(stability, now=50), 1)
+        self.assertEqual(stability.avoided_changes, 1)
+        self.assertEqual(self.parent_of_3(stability, now=100), 2)
+
+    def test_dwell_restarts(self):
+
+        stability = RouteStability(min_dwell=100)
+
+        self.set_noise(2, 3, 0.3)
+        self.assertEqual(self.parent_of_3(stability, now=0), 1)
+
+        self.set_noise(2, 3, 0.5)
+        self.assertEqual(self.parent_of_3(stability, now=50), 1)
+
+        self.set_noise(2, 3, 0.3)
+        self.assertEqual(self.parent_of_3(stability, now=100), 1)
+        self.assertEqual(self.parent_of_3(stability, now=200), 2)
+
+    def test_no_cycles(self):
+
+        stability = RouteStability(min_dwell=100)
+
+        # The shortest paths now reach 1 through 3: 3 can't keep 1 as its
+        # parent, while 1 keeps 0.
+        self.set_noise(0, 1, 2)
+
+        parents = stability.stable_parents(self.graph, 0, self.tree, 0,
+                                           weight='noise')
+
+        self.assertEqual(parents, {0: None, 1: 0, 2: 0, 3: 2})
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            RouteStability(margin=1)
+        with self.assertRaises(ValueError):
+            RouteStability(min_dwell=-1)
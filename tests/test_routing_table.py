@@ -0,0 +1,74 @@
+import unittest
+
+from protocol.routing_table import RoutingTable
+
+
+class TestRoutingTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = RoutingTable({3: 30, 7: 70, 12: 120})
+
+    def test_floor_key(self):
+
+        table = self.table
+
+        self.assertEqual(table.floor_key(3), 3)
+        self.assertEqual(table.floor_key(6), 3)
+        self.assertEqual(table.floor_key(11), 7)
+        self.assertEqual(table.floor_key(2000), 12)
+        self.assertIsNone(table.floor_key(2))
+        self.assertEqual(table.floor_key(0, default=-1), -1)
+
+    def test_floor_key_after_update(self):
+
+        table = self.table
+        table[5] = 50
+        del table[3]
+
+        self.assertEqual(table.floor_key(6), 5)
+        self.assertIsNone(table.floor_key(4))
+
+    def test_snapshot_shares_until_written(self):
+
+        table = self.table
+        snapshot = table.snapshot()
+
+        self.assertIs(snapshot._data, table._data)
+
+        table[7] = 70
+        self.assertIs(snapshot._data, table._data)
+
+        table[7] = 71
+        table[20] = 200
+
+        self.assertIsNot(snapshot._data, table._data)
+        self.assertEqual(dict(snapshot), {3: 30, 7: 70, 12: 120})
+        self.assertEqual(snapshot.floor_key(25), 12)
+        self.assertEqual(table.floor_key(25), 20)
+        self.assertEqual(table.version, snapshot.version + 2)
+
+    def test_snapshot_is_independent(self):
+
+        table = self.table
+        snapshot = table.snapshot()
+
+        del snapshot[3]
+
+        self.assertIn(3, table)
+        self.assertNotIn(3, snapshot)
+
+    def test_one_entry_per_node(self):
+
+        table = self.table
+        snapshot = table.snapshot()
+
+        table[9] = 70
+        table[3] = 120
+
+        self.assertEqual(dict(table), {3: 120, 9: 70})
+        self.assertEqual(table.logic_address_of(70), 9)
+        self.assertIsNone(table.logic_address_of(30))
+        self.assertEqual(snapshot.logic_address_of(70), 7)
+
+        del table[9]
+        self.assertIsNone(table.logic_address_of(70))
@@ -0,0 +1,97 @@
+import collections
+import unittest
+
+import simpy
+
+from protocol.send_queue import SendQueue, QueuePolicy
+
+Item = collections.namedtuple('Item', 'name, dest_static_addr')
+
+
+class TestSendQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.env = simpy.Environment()
+        self.discarded = []
+
+    def make_queue(self, policy, capacity=2, per_destination_limit=None):
+        return SendQueue(
+            self.env, capacity, policy, per_destination_limit,
+            lambda item, policy: self.discarded.append((item.name, policy))
+        )
+
+    def names(self, queue):
+        return [item.name for item in queue.items]
+
+    def test_drop_policies(self):
+
+        for policy, kept, discarded in (
+                (QueuePolicy.drop_oldest, ['b', 'c'], 'a'),
+                (QueuePolicy.drop_newest, ['a', 'b'], 'c'),
+                (QueuePolicy.reject, ['a', 'b'], 'c')):
+
+            del self.discarded[:]
+            queue = self.make_queue(policy)
+
+            admissions = [queue.put(Item(name, 1)) for name in 'abc']
+
+            self.assertEqual(self.names(queue), kept)
+            self.assertEqual(self.discarded, [(discarded, policy)])
+            self.assertEqual([ev.value for ev in admissions],
+                             [True, True, policy is QueuePolicy.drop_oldest])
+
+    def test_block(self):
+
+        queue = self.make_queue(QueuePolicy.block)
+
+        admissions = [queue.put(Item(name, 1)) for name in 'abc']
+
+        self.assertFalse(admissions[2].triggered)
+        self.assertEqual(queue.stats.blocked, 1)
+
+        got = queue.get()
+
+        self.assertEqual(got.value.name, 'a')
+        self.assertTrue(admissions[2].value)
+        self.assertEqual(self.names(queue), ['b', 'c'])
+
+    def test_per_destination_limit(self):
+
+        queue = self.make_queue(QueuePolicy.drop_oldest, capacity=None,
+                                per_destination_limit=2)
+
+        for name, dest in (('a', 1), ('b', 2), ('c', 1), ('d', 1), ('e', 2)):
+            queue.put(Item(name, dest))
+
+        self.assertEqual(self.names(queue), ['b', 'c', 'd', 'e'])
+        self.assertEqual(self.discarded, [('a', QueuePolicy.drop_oldest)])
+
+    def test_unget(self):
+
+        queue = self.make_queue(QueuePolicy.block)
+
+        admissions = [queue.put(Item(name, 1)) for name in 'abc']
+        got = queue.get()
+        queue.unget(got.value)
+
+        # The blocked message has been admitted meanwhile.
+        self.assertTrue(admissions[2].value)
+        self.assertEqual(self.names(queue), ['a', 'b', 'c'])
+        self.assertEqual(queue.get().value.name, 'a')
+
+    def test_depth_stats(self):
+
+        queue = self.make_queue(QueuePolicy.block, capacity=None)
+
+        def producer():
+            queue.put(Item('a', 1))
+            queue.put(Item('b', 1))
+            yield self.env.timeout(10)
+            yield queue.get()
+            yield self.env.timeout(10)
+
+        self.env.process(producer())
+        self.env.run()
+
+        self.assertEqual(queue.stats.max_depth, 2)
+        self.assertEqual(queue.stats.mean_depth(self.env.now), 1.5)
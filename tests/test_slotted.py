@@ -0,0 +1,76 @@
+import random
+import unittest
+
+from infrastructure import Bus
+from infrastructure import Network
+from protocol import MasterNode
+from protocol import SlaveNode
+from slotted import SlottedSimulation
+
+
+def build_network(use_bus):
+    network = Network(transmission_speed=0.5)
+    master = MasterNode(network)
+    slaves = [SlaveNode(network, i, on_message_received=lambda *_: ('Blop', 4))
+              for i in range(1, 6)]
+
+    if use_bus:
+        bus = Bus(network, 20)
+        for node in (master, *slaves):
+            network.netgraph.add_edge(bus, node)
+    else:
+        network.netgraph.add_path((master, *slaves))
+
+    return network, master
+
+
+class TestSlottedSimulation(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(1)
+        self.destinations = [rand.randrange(1, 6) for _ in range(40)]
+
+    def check_matches_event_simulation(self, use_bus):
+
+        network, master = build_network(use_bus)
+        master.init_from_netgraph(network.netgraph)
+        network.run_nodes_processes()
+
+        for dest in self.destinations:
+            master.send_message('Blip', 4, dest)
+
+        network.env.run(until=200000)
+
+        simulation = SlottedSimulation(build_network(use_bus)[0].netgraph,
+                                       replicas=3, transmission_speed=0.5)
+        results = simulation.run(len(self.destinations), 4, 4,
+                                 destinations=[self.destinations] * 3)
+
+        for metrics in results.metrics:
+            self.assertEqual(metrics.summary(), master.metrics.summary())
+            self.assertEqual(metrics.latencies, master.metrics.latencies)
+
+    def test_line_matches_event_simulation(self):
+        self.check_matches_event_simulation(use_bus=False)
+
+    def test_bus_matches_event_simulation(self):
+        self.check_matches_event_simulation(use_bus=True)
+
+    def test_lossy_medium(self):
+
+        network, _ = build_network(use_bus=False)
+        simulation = SlottedSimulation(network.netgraph, replicas=50,
+                                       transmission_speed=0.5,
+                                       bit_error_rate=1e-3, seed=3)
+        results = simulation.run(20)
+        merged = results.merged_metrics()
+
+        self.assertEqual(merged.requests, 50 * 20)
+        self.assertEqual(merged.answers + merged.timeouts, merged.requests)
+        self.assertGreater(merged.timeouts, 0)
+        self.assertGreater(results.frame_errors.sum(), 0)
+        self.assertTrue((results.end_times > 0).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
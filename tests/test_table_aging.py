@@ -0,0 +1,144 @@
+import unittest
+
+from infrastructure import Network
+from protocol import SlaveNode
+from protocol.packet import ResponsePacket
+from utils.table_aging import TableAging
+
+
+class TestTableAging(unittest.TestCase):
+
+    def test_capacity(self):
+
+        aging = TableAging(capacity=2)
+
+        self.assertEqual(aging.touch('a', 0), [])
+        self.assertEqual(aging.touch('b', 1), [])
+        self.assertEqual(aging.touch('a', 2), [])
+        self.assertEqual(aging.touch('c', 3), ['b'])
+        self.assertEqual(aging.capacity_evictions, 1)
+
+    def test_max_age(self):
+
+        aging = TableAging(max_age=10)
+
+        aging.touch('a', 0)
+        aging.touch('b', 5)
+
+        self.assertEqual(aging.touch('c', 11), ['a'])
+        self.assertEqual(aging.expire(15), [])
+        self.assertEqual(aging.expire(30), ['b', 'c'])
+        self.assertEqual(aging.age_evictions, 3)
+        self.assertEqual(aging.evictions, 3)
+
+    def test_pinned(self):
+
+        aging = TableAging(capacity=2, max_age=10,
+                           pinned=lambda key: key == 'a')
+
+        aging.touch('a', 0)
+        aging.touch('b', 1)
+
+        self.assertEqual(aging.touch('c', 2), ['b'])
+        self.assertEqual(aging.expire(20), ['c'])
+        self.assertEqual(len(aging), 1)
+        self.assertEqual(aging.touch('d', 21), [])
+        self.assertEqual(aging.touch('e', 22), ['d'])
+
+
+class TestSlaveTableEviction(unittest.TestCase):
+
+    @staticmethod
+    def receive_from(slave, addresses):
+
+        for addr in addresses:
+            packet = ResponsePacket()
+            packet.source_static = addr
+            packet.source_logic = addr * 10
+            slave._update_noise_table(packet)
+            slave._update_routing_table(packet)
+
+    def test_eviction(self):
+
+        network = Network()
+        slave = SlaveNode(network, 1,
+                          noise_table_aging=TableAging(capacity=2),
+                          routing_table_aging=TableAging(capacity=2))
+
+        self.receive_from(slave, range(2, 6))
+
+        self.assertEqual(set(slave.noise_table), {4, 5})
+        self.assertEqual(set(slave.routing_table), {40, 50})
+        self.assertEqual(slave.noise_table_aging.evictions, 2)
+        self.assertEqual(slave.routing_table_aging.evictions, 2)
+
+    def test_forwarding_entries_kept(self):
+
+        network = Network()
+        slave = SlaveNode(network, 1,
+                          routing_table_aging=TableAging(capacity=2))
+        slave.logic_address = 25
+
+        self.receive_from(slave, [3, 2, 4])
+
+        # The entries above the logic address of the node are needed to
+        # forward the requests to its subtree, so the others go first.
+        self.assertEqual(set(slave.routing_table), {30, 40})
+
+        self.receive_from(slave, [5])
+
+        self.assertEqual(set(slave.routing_table), {40, 50})
+        self.assertEqual(len(slave.routing_table_aging), 2)
+
+    def test_forwarding_entries_tracked(self):
+
+        network = Network()
+        aging = TableAging(max_age=10)
+        slave = SlaveNode(network, 1, routing_table_aging=aging)
+        slave.logic_address = 25
+
+        self.receive_from(slave, [2, 3])
+        network.env.run(until=20)
+        slave._expire_table_entries()
+
+        self.assertEqual(set(slave.routing_table), {30})
+        self.assertEqual(len(aging), 1)
+
+        # Once the node forwards no more to the entry, it ages as the others.
+        slave.logic_address = 35
+        slave._expire_table_entries()
+
+        self.assertEqual(len(slave.routing_table), 0)
+        self.assertEqual(len(aging), 0)
+
+    def test_expired_before_snapshot(self):
+
+        network = Network()
+        slave = SlaveNode(network, 1,
+                          routing_table_aging=TableAging(max_age=10))
+
+        self.receive_from(slave, [2])
+        network.env.run(until=20)
+        slave._snapshot_routing_table()
+
+        self.assertEqual(len(slave.last_sent_routing_table), 0)
+
+    def test_removals_reported(self):
+
+        network = Network()
+        slave = SlaveNode(network, 1,
+                          noise_table_aging=TableAging(capacity=2))
+
+        self.receive_from(slave, [2, 3])
+        self.assertEqual(slave._make_noise_report().removed, set())
+
+        self.receive_from(slave, [4])
+        report = slave._make_noise_report()
+
+        self.assertEqual(set(report), {4})
+        self.assertEqual(report.removed, {2})
+        self.assertEqual(slave._make_noise_report().removed, set())
+
+        # An entry which is evicted and heard again isn't removed.
+        self.receive_from(slave, [5, 3])
+        self.assertEqual(slave._make_noise_report().removed, {4})
@@ -43,6 +43,10 @@ class BroadcastConditionVar:
     def wait(self):
         return self._signal_ev
 
+    @property
+    def has_waiters(self):
+        return bool(self._signal_ev.callbacks)
+
     def broadcast(self, value=None):
         signal_ev, self._signal_ev = self._signal_ev, self.env.event()
         signal_ev.callbacks.extend(self.callbacks)
@@ -1,4 +1,6 @@
-from typing import List, Dict, Any
+from heapq import heappush, heappop
+from itertools import count
+from typing import List, Dict, Any, Optional, Tuple
 
 import networkx as nx
 
@@ -8,8 +10,17 @@ def shortest_paths_tree(shortest_paths: Dict[Any, List[Any]]):
 
     sptree = nx.DiGraph()
 
+    # The edges shared by many paths are added once, in the order in which
+    # add_path would have added them.
+    edges = {}
+
     for path in shortest_paths.values():
-        sptree.add_path(path)
+        if len(path) == 1:
+            sptree.add_node(path[0])
+        else:
+            edges.update(dict.fromkeys(zip(path, path[1:])))
+
+    sptree.add_edges_from(edges)
 
     if not nx.is_tree(sptree):
         raise ValueError("The graph resulting from adding all shortest_paths "
@@ -23,3 +34,225 @@ def preorder_tree_dfs(G: nx.DiGraph, start, action):
     action(start)
     for node in G.successors_iter(start):
         preorder_tree_dfs(G, node, action)
+
+
+def dijkstra(graph: nx.Graph, source, target=None, weight='weight'):
+    """
+    Algoritmo di Dijkstra, con gli stessi criteri di networkx a parità di
+    distanza.
+
+    :param graph: Il grafo.
+    :param source: Il nodo di partenza.
+    :param target: Se indicato, la ricerca termina quando il nodo viene
+    raggiunto.
+    :param weight: Il nome dell'attributo degli archi che ne indica il peso,
+    o una funzione che riceve i due nodi e gli attributi dell'arco e
+    restituisce il peso.
+    :return: Un dizionario con le distanze dei nodi raggiunti, in ordine di
+    distanza, e uno con il padre di ogni nodo incontrato (None per source).
+    """
+
+    if callable(weight):
+        get_weight = weight
+    else:
+        def get_weight(_, __, data):
+            return data.get(weight, 1)
+
+    graph_succ = graph.adj
+
+    dist = {}
+    seen = {source: 0}
+    parents = {source: None}
+    counter = count()
+    fringe = [(0, next(counter), source)]
+
+    while fringe:
+        d, _, v = heappop(fringe)
+
+        if v in dist:
+            continue
+
+        dist[v] = d
+
+        if v == target:
+            break
+
+        for u, data in graph_succ[v].items():
+            vu_dist = d + get_weight(v, u, data)
+
+            if u not in dist and (u not in seen or vu_dist < seen[u]):
+                seen[u] = vu_dist
+                parents[u] = v
+                heappush(fringe, (vu_dist, next(counter), u))
+
+    return dist, parents
+
+
+def path_from_parents(parents: Dict[Any, Any], target) -> List[Any]:
+    """
+    Ricostruisce il cammino verso target a partire dal padre di ogni nodo.
+    """
+
+    path = [target]
+
+    while parents[path[-1]] is not None:
+        path.append(parents[path[-1]])
+
+    path.reverse()
+    return path
+
+
+class LazyShortestPaths:
+    """
+    Cammini minimi da un nodo sorgente, calcolati solo per le destinazioni
+    richieste.
+
+    Ogni cammino viene calcolato con l'algoritmo di Dijkstra, interrotto
+    appena la destinazione viene raggiunta, e memorizzato insieme alle
+    distanze dei nodi visitati. Quando il peso di un arco cambia, vengono
+    scartati solo i cammini su cui il cambiamento può influire: quelli che
+    usano un arco il cui peso è aumentato e quelli la cui ricerca ha
+    raggiunto l'origine di un arco il cui peso è diminuito, se attraverso
+    questo si può arrivare entro la distanza della destinazione.
+
+    A parità di distanza i cammini sono gli stessi calcolati da
+    networkx.shortest_path.
+    """
+
+    def __init__(self, graph: nx.Graph, source, weight='weight'):
+        self.graph = graph
+        self.source = source
+        self.weight = weight
+        self._paths: Dict[Any, List[Any]] = {}
+        self._searches: Dict[Any, Tuple[float, Dict[Any, float]]] = {}
+        self._tree = None
+
+        # Number of searches and of nodes settled by them.
+        self.computations = 0
+        self.settled_nodes = 0
+
+    def __getitem__(self, target):
+
+        path = self._paths.get(target)
+
+        if path is None:
+            path = self._paths[target] = self._search(target)
+            self._tree = None
+
+        return path
+
+    def __contains__(self, target):
+        return target in self._paths
+
+    def __len__(self):
+        return len(self._paths)
+
+    def values(self):
+        return self._paths.values()
+
+    def _search(self, target):
+
+        dist, parents = dijkstra(self.graph, self.source, target, self.weight)
+
+        if target not in dist:
+            raise KeyError(target)
+
+        self.computations += 1
+        self.settled_nodes += len(dist)
+
+        self._searches[target] = (dist[target], dist)
+        return path_from_parents(parents, target)
+
+    def edge_changed(self, u, v, old_weight: Optional[float], new_weight):
+        """
+        Scarta i cammini che potrebbero essere cambiati con il peso di un
+        arco.
+
+        :param u: L'origine dell'arco.
+        :param v: La destinazione dell'arco.
+        :param old_weight: Il peso precedente, o None se l'arco è nuovo.
+        :param new_weight: Il nuovo peso.
+        """
+
+        decreased = old_weight is None or new_weight < old_weight
+
+        if not decreased and new_weight == old_weight:
+            return
+
+        edges = {(u, v)}
+
+        if not self.graph.is_directed():
+            edges.add((v, u))
+
+        invalid = []
+
+        for target, (radius, dist) in self._searches.items():
+
+            if decreased:
+                if any(a in dist and dist[a] + new_weight <= radius
+                       for a, _ in edges):
+                    invalid.append(target)
+            else:
+                path = self._paths[target]
+                if any(edge in edges for edge in zip(path, path[1:])):
+                    invalid.append(target)
+
+        for target in invalid:
+            del self._paths[target]
+            del self._searches[target]
+
+        if invalid:
+            self._tree = None
+
+    def node_removed(self, node):
+        """
+        Scarta i cammini che attraversano un nodo rimosso dal grafo.
+        """
+
+        invalid = [target for target, path in self._paths.items()
+                   if node in path]
+
+        for target in invalid:
+            del self._paths[target]
+            del self._searches[target]
+
+        if invalid:
+            self._tree = None
+
+    def clear(self):
+        self._paths.clear()
+        self._searches.clear()
+        self._tree = None
+
+    def tree(self) -> nx.DiGraph:
+        """
+        Restituisce l'albero formato dai cammini calcolati.
+
+        Cammini calcolati in momenti diversi possono raggiungere lo stesso
+        nodo da padri diversi, ma di pari distanza: ogni nodo mantiene il
+        primo padre trovato, e i cammini vengono aggiornati di conseguenza.
+        """
+
+        if self._tree is not None:
+            return self._tree
+
+        tree = nx.DiGraph()
+        tree.add_node(self.source)
+
+        for path in self._paths.values():
+            for parent, node in zip(path, path[1:]):
+                if node not in tree:
+                    tree.add_edge(parent, node)
+
+        for target in self._paths:
+            tree_path = [target]
+
+            while tree_path[-1] != self.source:
+                parent, = tree.predecessors(tree_path[-1])
+                tree_path.append(parent)
+
+            tree_path.reverse()
+            self._paths[target] = tree_path
+
+        self._tree = tree
+        return tree
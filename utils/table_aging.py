@@ -0,0 +1,116 @@
+import collections
+from typing import Any, Callable, List, Optional
+
+
+class TableAging:
+    """
+    Tiene traccia dell'ultimo aggiornamento delle voci di una tabella, e
+    stabilisce quali voci vadano rimosse perché troppo vecchie o perché la
+    tabella ha superato la capacità massima.
+
+    Le voci sono mantenute in ordine di ultimo aggiornamento. Poiché il
+    tempo di simulazione non decresce, la voce meno recente è sempre la
+    prima, ed è quindi sia quella da rimuovere per LRU sia la più vecchia.
+
+    Le voci per cui `pinned` è vero restano tracciate ma non invecchiano, e
+    vengono rimosse per la capacità solo se non ce ne sono altre.
+    """
+
+    def __init__(self, capacity: Optional[int]=None,
+                 max_age: Optional[int]=None,
+                 pinned: Optional[Callable[[Any], bool]]=None):
+        """
+        :param capacity: Il numero massimo di voci nella tabella, o None per
+        non avere limiti.
+        :param max_age: Il tempo di simulazione dopo il quale una voce non
+        aggiornata viene rimossa, o None per non avere limiti.
+        :param pinned: Stabilisce quali voci vadano tenute il più a lungo
+        possibile, o None se nessuna.
+        """
+
+        if capacity is not None and capacity < 1:
+            raise ValueError('capacity must be at least 1')
+
+        if max_age is not None and max_age < 0:
+            raise ValueError('max_age must not be negative')
+
+        self.capacity = capacity
+        self.max_age = max_age
+        self.pinned = pinned
+        self.capacity_evictions = 0
+        self.age_evictions = 0
+        self._last_seen = collections.OrderedDict()
+
+    @property
+    def evictions(self):
+        return self.capacity_evictions + self.age_evictions
+
+    def touch(self, key: Any, now) -> List[Any]:
+        """
+        Registra l'aggiornamento di una voce.
+
+        :param key: La chiave della voce aggiornata.
+        :param now: Il tempo di simulazione attuale.
+        :return: Le chiavi delle voci da rimuovere dalla tabella.
+        """
+
+        last_seen = self._last_seen
+
+        last_seen[key] = now
+        last_seen.move_to_end(key)
+
+        evicted = self.expire(now)
+
+        if self.capacity is not None:
+            while len(last_seen) > self.capacity:
+                evicted_key = self._least_recent_unpinned()
+
+                if evicted_key is None:
+                    evicted_key, _ = last_seen.popitem(last=False)
+                else:
+                    del last_seen[evicted_key]
+
+                evicted.append(evicted_key)
+                self.capacity_evictions += 1
+
+        return evicted
+
+    def expire(self, now) -> List[Any]:
+        """
+        Rimuove le voci più vecchie di `max_age`.
+
+        :param now: Il tempo di simulazione attuale.
+        :return: Le chiavi delle voci da rimuovere dalla tabella.
+        """
+
+        evicted = []
+
+        if self.max_age is None:
+            return evicted
+
+        last_seen = self._last_seen
+        oldest_allowed = now - self.max_age
+
+        for key, seen in list(last_seen.items()):
+            if seen >= oldest_allowed:
+                break
+
+            if not self._is_pinned(key):
+                del last_seen[key]
+                evicted.append(key)
+                self.age_evictions += 1
+
+        return evicted
+
+    def _is_pinned(self, key):
+        return self.pinned is not None and self.pinned(key)
+
+    def _least_recent_unpinned(self):
+        return next((key for key in self._last_seen
+                     if not self._is_pinned(key)), None)
+
+    def discard(self, key: Any):
+        self._last_seen.pop(key, None)
+
+    def __len__(self):
+        return len(self._last_seen)